@@ -1,4 +1,5 @@
 import os
+import atexit
 from flask import Flask
 from dotenv import load_dotenv
 from flask_cors import CORS
@@ -11,18 +12,46 @@ def create_app():
 
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG')
 
+    from app import compression, json_provider, metrics
+    # First, so its after_request hook runs last and times compression too.
+    metrics.init_app(app)
+    compression.init_app(app)
+    json_provider.init_app(app)
+
+    from app.database import close_pool
+    atexit.register(close_pool)
+
+    from app.migrations import migrate, migrate_command
+    app.cli.add_command(migrate_command)
+    from app.plans import check_plans_command
+    app.cli.add_command(check_plans_command)
+    from app.rollups import backfill_rollups_command
+    app.cli.add_command(backfill_rollups_command)
+    from app.partitions import ensure_partitions, ensure_partitions_command
+    app.cli.add_command(ensure_partitions_command)
+    if os.environ.get('MIGRATE_ON_STARTUP', '1') == '1':
+        migrate()
+        ensure_partitions()
+    if os.environ.get('LATEST_WARMUP', '1') == '1':
+        from app.latest import latest_readings
+        latest_readings.warm()
+
     # Register blueprints
     from app.routes.sensors import sensors_bp
     from app.routes.data import data_bp 
     from app.routes.root import root_bp
     from app.routes.users import users_bp
     from app.routes.user_data import user_data_bp
+    from app.routes.fleet import fleet_bp
+    from app.routes.admin import admin_bp
 
     app.register_blueprint(sensors_bp)
     app.register_blueprint(data_bp)
     app.register_blueprint(root_bp)
     app.register_blueprint(users_bp)
     app.register_blueprint(user_data_bp)
+    app.register_blueprint(fleet_bp)
+    app.register_blueprint(admin_bp)
 
 
     return app
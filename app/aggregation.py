@@ -0,0 +1,358 @@
+"""
+Generic time-bucketed aggregation over sensor or user readings.
+
+aggregate() takes a scope (a sensor or a user id), one or more metrics,
+a [start, end) range, a bucket width and an aggregate function, and
+runs one parameterized query. Table and column names only come from the
+whitelists below; every value is a bound parameter.
+
+When the function can be derived from sum/count/min/max (avg, min, max,
+count) and the bucket is an hour or coarser, the hourly/daily rollup
+tables are read instead of raw rows. Rollups only cover whole hours/days,
+so when `end` falls inside one the readings from that partial hour/day up
+to `end` are read raw and merged in. Minute buckets and percentiles fall
+back to the partitioned raw tables.
+"""
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import sql
+from psycopg2.extensions import cursor as tuple_cursor
+
+from app.database import get_connection
+from app.rollups import METRICS
+
+SCOPES = {
+    "sensor": {"table": "data", "key": "sensor_id", "hourly": "sensor_hourly_rollups", "daily": "sensor_daily_rollups"},
+    "user": {"table": "user_data", "key": "user_id", "hourly": "user_hourly_rollups", "daily": "user_daily_rollups"},
+}
+BUCKETS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+# Rollup table that can serve each bucket width, if any.
+ROLLUP_FOR_BUCKET = {"hour": "hourly", "day": "daily", "week": "daily"}
+# Rollup columns each function reads, per metric.
+ROLLUP_PARTS = {"avg": ("sum", "count"), "min": ("min",), "max": ("max",), "count": ("count",)}
+FUNCTIONS = ("avg", "min", "max", "count", "percentile")
+FILLS = ("null", "zero", "none")
+MAX_BUCKETS = 10000
+# Cap on ids × buckets for one aggregate_fleet() call.
+MAX_FLEET_POINTS = 100000
+# Readings are stored as naive wall time this far behind UTC.
+LOCAL_OFFSET = timedelta(hours=4)
+
+
+class AggregationError(ValueError):
+    """Raised for an aggregation request that cannot be served."""
+
+
+def local_now():
+    """
+    Current wall-clock time in the same convention add_data uses for
+    readings without a 'date' (UTC shifted back 4 hours), as a naive datetime.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None) - LOCAL_OFFSET
+
+
+def to_local(moment):
+    """
+    `moment` as a naive wall time in the stored convention: aware datetimes
+    are converted, naive ones are taken to be local already.
+    """
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None) - LOCAL_OFFSET
+    return moment
+
+
+def truncate(moment, bucket):
+    """Python equivalent of DATE_TRUNC(bucket, moment)."""
+    if bucket == "minute":
+        return moment.replace(second=0, microsecond=0)
+    if bucket == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _raw_expression(function, column):
+    if function == "avg":
+        return sql.SQL("AVG({})").format(column)
+    if function == "min":
+        return sql.SQL("MIN({})").format(column)
+    if function == "max":
+        return sql.SQL("MAX({})").format(column)
+    if function == "count":
+        return sql.SQL("COUNT({})").format(column)
+    return sql.SQL("percentile_cont(%(percentile)s) WITHIN GROUP (ORDER BY {})").format(column)
+
+
+def _rollup_expression(function, metric):
+    part = lambda suffix: sql.Identifier(f"{metric}_{suffix}")
+    if function == "avg":
+        return sql.SQL("SUM({}) / NULLIF(SUM({}), 0)").format(part("sum"), part("count"))
+    if function == "min":
+        return sql.SQL("MIN({})").format(part("min"))
+    if function == "max":
+        return sql.SQL("MAX({})").format(part("max"))
+    return sql.SQL("SUM({})").format(part("count"))
+
+
+def _raw_part(metric, suffix):
+    """A raw reading as the `suffix` rollup column of a single-reading bucket."""
+    if suffix == "count":
+        return sql.SQL("({} IS NOT NULL)::int").format(sql.Identifier(metric))
+    return sql.Identifier(metric)
+
+
+def validate(scope, metrics, start, end, bucket, function, percentile, fill):
+    if scope not in SCOPES:
+        raise AggregationError(f"Unknown scope '{scope}'.")
+    if not metrics:
+        raise AggregationError("At least one metric is required.")
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise AggregationError(f"Unknown metric(s): {', '.join(unknown)}. Use {', '.join(METRICS)}.")
+    if bucket not in BUCKETS:
+        raise AggregationError(f"Unknown bucket '{bucket}'. Use {', '.join(BUCKETS)}.")
+    if function not in FUNCTIONS:
+        raise AggregationError(f"Unknown function '{function}'. Use {', '.join(FUNCTIONS)}.")
+    if function == "percentile" and (percentile is None or not 0 <= percentile <= 1):
+        raise AggregationError("'percentile' must be between 0 and 1.")
+    if fill not in FILLS:
+        raise AggregationError(f"Unknown fill '{fill}'. Use {', '.join(FILLS)}.")
+    if start >= end:
+        raise AggregationError("'start' must be before 'end'.")
+    if (end - truncate(start, bucket)) / BUCKETS[bucket] > MAX_BUCKETS:
+        raise AggregationError(f"Range too large; at most {MAX_BUCKETS} {bucket} buckets per request.")
+
+
+def _source_table(scope, bucket, function):
+    """The rollup table serving this aggregation, or the raw readings table."""
+    rollup = ROLLUP_FOR_BUCKET.get(bucket) if function != "percentile" else None
+    return SCOPES[scope][rollup] if rollup else SCOPES[scope]["table"]
+
+
+def _query_parts(scope, metrics, bucket, function, fill, match):
+    """
+    The format() arguments shared by build_query() and build_fleet_query();
+    `match` is the condition on the id column.
+    """
+    config = SCOPES[scope]
+    rollup = ROLLUP_FOR_BUCKET.get(bucket) if function != "percentile" else None
+    key = sql.Identifier(config["key"])
+    table = sql.Identifier(config["table"])
+
+    if rollup:
+        # Whole hours/days up to %(rollup_end)s come from the rollup, the
+        # partial one after it from raw rows shaped like rollup rows.
+        parts = [(m, suffix) for m in metrics for suffix in ROLLUP_PARTS[function]]
+        rows = sql.SQL("""FROM (
+        SELECT {key}, bucket::timestamp AS moment, {rollup_columns}
+        FROM {rollup}
+        WHERE {key} {match}
+          AND bucket >= %(start)s
+          AND bucket < %(rollup_end)s
+        UNION ALL
+        SELECT {key}, date, {raw_columns}
+        FROM {table}
+        WHERE {key} {match}
+          AND date >= %(rollup_end)s
+          AND date < %(end)s
+    ) AS rows""").format(
+            key=key, match=match, table=table, rollup=sql.Identifier(config[rollup]),
+            rollup_columns=sql.SQL(", ").join(sql.Identifier(f"{m}_{suffix}") for m, suffix in parts),
+            raw_columns=sql.SQL(", ").join(
+                sql.SQL("{} AS {}").format(_raw_part(m, suffix), sql.Identifier(f"{m}_{suffix}"))
+                for m, suffix in parts))
+        bucketed = sql.SQL("DATE_TRUNC(%(bucket)s, moment)")
+        expressions = [_rollup_expression(function, m) for m in metrics]
+    else:
+        rows = sql.SQL("""FROM {table}
+    WHERE {key} {match}
+      AND date >= %(start)s
+      AND date < %(end)s""").format(table=table, key=key, match=match)
+        bucketed = sql.SQL("DATE_TRUNC(%(bucket)s, date)")
+        expressions = [_raw_expression(function, sql.Identifier(m)) for m in metrics]
+
+    aggregates = sql.SQL(", ").join(
+        sql.SQL("{} AS {}").format(expression, sql.Identifier(m))
+        for expression, m in zip(expressions, metrics))
+
+    if fill == "zero":
+        values = [sql.SQL("COALESCE(readings.{}, 0)").format(sql.Identifier(m)) for m in metrics]
+    else:
+        values = [sql.SQL("readings.{}").format(sql.Identifier(m)) for m in metrics]
+    outputs = [sql.SQL("{} AS {}").format(v, sql.Identifier(m)) for v, m in zip(values, metrics)]
+
+    return {
+        "bucketed": bucketed,
+        "aggregates": aggregates,
+        "rows": rows,
+        "key": key,
+        "outputs": sql.SQL(", ").join(outputs),
+        "join": sql.SQL("JOIN" if fill == "none" else "LEFT JOIN"),
+    }
+
+
+def build_query(scope, metrics, bucket="hour", function="avg", fill="null"):
+    """
+    Return the SQL for an aggregation; bind it with query_params(). Output
+    columns are `bucket` (timestamptz) and one column per metric.
+    """
+    query = sql.SQL("""
+WITH series AS (
+    SELECT generate_series(%(first_bucket)s::timestamp, %(last_bucket)s::timestamp, %(step)s::interval) AS bucket
+),
+readings AS (
+    SELECT {bucketed} AS bucket, {aggregates}
+    {rows}
+    GROUP BY 1
+)
+SELECT series.bucket::timestamptz AS bucket, {outputs}
+FROM series
+{join} readings ON readings.bucket = series.bucket
+ORDER BY series.bucket;
+""").format(**_query_parts(scope, metrics, bucket, function, fill, sql.SQL("= %(id)s")))
+    query.name = f"AGGREGATE_{_source_table(scope, bucket, function).upper()}"
+    return query
+
+
+def build_fleet_query(scope, metrics, bucket="hour", function="avg", fill="null"):
+    """
+    Like build_query(), but for every id in %(ids)s at once, grouped by id
+    in a single scan. Output columns are `id`, `bucket` and one column per
+    metric, ordered by id then bucket.
+    """
+    query = sql.SQL("""
+WITH ids AS (
+    SELECT unnest(%(ids)s::uuid[]) AS id
+),
+series AS (
+    SELECT generate_series(%(first_bucket)s::timestamp, %(last_bucket)s::timestamp, %(step)s::interval) AS bucket
+),
+readings AS (
+    SELECT {key} AS id, {bucketed} AS bucket, {aggregates}
+    {rows}
+    GROUP BY 1, 2
+)
+SELECT ids.id, series.bucket::timestamptz AS bucket, {outputs}
+FROM ids CROSS JOIN series
+{join} readings ON readings.id = ids.id AND readings.bucket = series.bucket
+ORDER BY ids.id, series.bucket;
+""").format(**_query_parts(scope, metrics, bucket, function, fill,
+                                  sql.SQL("= ANY(%(ids)s::uuid[])")))
+    query.name = f"FLEET_AGGREGATE_{_source_table(scope, bucket, function).upper()}"
+    return query
+
+
+def query_params(scope_id, start, end, bucket="hour", percentile=None):
+    first_bucket = truncate(start, bucket)
+    return {
+        "id": str(scope_id),
+        "start": first_bucket,
+        "end": end,
+        "bucket": bucket,
+        "step": BUCKETS[bucket],
+        "first_bucket": first_bucket,
+        "last_bucket": truncate(end - timedelta(microseconds=1), bucket),
+        # Hourly rollups serve hour buckets, daily ones day and week buckets.
+        "rollup_end": truncate(end, "hour" if bucket in ("minute", "hour") else "day"),
+        "percentile": percentile,
+    }
+
+
+def _fetch(query, params, cursor=None, tuples=False):
+    if cursor is not None and tuples:
+        with cursor.connection.cursor(cursor_factory=tuple_cursor) as tuple_cur:
+            tuple_cur.execute(query, params)
+            return tuple_cur.fetchall()
+    if cursor is not None:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    with get_connection() as conn:
+        with conn.cursor(cursor_factory=tuple_cursor if tuples else None) as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+
+def aggregate(scope, scope_id, metrics, start, end, bucket="hour", function="avg",
+              percentile=None, fill="null", cursor=None, tuples=False):
+    """
+    Aggregate `metrics` for one sensor/user over [start, end) in `bucket`
+    buckets. `start` is widened to the start of its bucket so every bucket
+    covers whole periods. Returns a list of {"bucket": datetime, metric: value}.
+    Empty buckets hold None (fill="null"), 0 (fill="zero") or are omitted
+    (fill="none"). All metrics come from the same scan of the source table.
+
+    Pass `cursor` to run on an already checked-out connection, and
+    tuples=True to get plain (bucket, *metrics) tuples instead of dicts,
+    which is cheaper on hot paths.
+    """
+    metrics = list(dict.fromkeys(metrics))
+    validate(scope, metrics, start, end, bucket, function, percentile, fill)
+    query = build_query(scope, metrics, bucket, function, fill)
+    params = query_params(scope_id, start, end, bucket, percentile)
+    return _fetch(query, params, cursor, tuples)
+
+
+def aggregate_fleet(scope, ids, metrics, start, end, bucket="hour", function="avg",
+                    percentile=None, fill="null", cursor=None):
+    """
+    aggregate() for many sensors/users in one query. Returns
+    {id: [{"bucket": datetime, metric: value}, ...]} with the ids sorted;
+    with fill="none" an id without readings maps to an empty list.
+    """
+    metrics = list(dict.fromkeys(metrics))
+    validate(scope, metrics, start, end, bucket, function, percentile, fill)
+    points = len(ids) * (end - truncate(start, bucket)) / BUCKETS[bucket]
+    if points > MAX_FLEET_POINTS:
+        raise AggregationError(
+            f"Too many points ({int(points)}); at most {MAX_FLEET_POINTS} per request. "
+            "Request fewer ids per page or wider buckets.")
+    query = build_fleet_query(scope, metrics, bucket, function, fill)
+    params = query_params(None, start, end, bucket, percentile)
+    params["ids"] = [str(i) for i in ids]
+    rows = _fetch(query, params, cursor)
+
+    results = {str(i): [] for i in sorted(params["ids"])}
+    for row in rows:
+        results[str(row["id"])].append({"bucket": row["bucket"], **{m: row[m] for m in metrics}})
+    return results
+
+
+def parse_metrics(value):
+    """Parse a comma-separated ?metrics= value; all metrics when empty."""
+    metrics = [m.strip() for m in (value or "").split(",") if m.strip()]
+    return list(dict.fromkeys(metrics)) or list(METRICS)
+
+
+def daily_chart(scope, scope_id, metrics, cursor=None):
+    """Daily averages of `metrics` over last_7_days(), newest day first."""
+    results = aggregate(scope, scope_id, metrics, *last_7_days(), bucket="day", fill="zero",
+                        cursor=cursor, tuples=True)
+    keys = ["date"] + [f"average_{m}" for m in metrics]
+    return [dict(zip(keys, (str(row[0].date()), *[round(v, 2) for v in row[1:]]))) for row in reversed(results)]
+
+
+def hourly_chart(scope, scope_id, metrics, cursor=None):
+    """Hourly averages of `metrics` over today_hourly(), oldest hour first."""
+    results = aggregate(scope, scope_id, metrics, *today_hourly(), bucket="hour", fill="zero",
+                        cursor=cursor, tuples=True)
+    keys = ["hour"] + [f"avg_{m}" for m in metrics]
+    return [dict(zip(keys, (str(row[0]), *[round(v, 2) for v in row[1:]]))) for row in results]
+
+
+def last_7_days():
+    """The [start, end) range of the 7-day chart: today and the 6 days before."""
+    today = truncate(local_now(), "day")
+    return today - timedelta(days=6), today + timedelta(days=1)
+
+
+def today_hourly():
+    """The [start, end) range of the hourly chart: midnight up to the current hour."""
+    now = local_now()
+    return truncate(now, "day"), truncate(now, "hour") + timedelta(hours=1)
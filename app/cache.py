@@ -0,0 +1,192 @@
+"""
+In-process LRU + TTL cache for the aggregate endpoints.
+
+Responses are cached per (endpoint, view arguments, query string) and
+tagged with the sensor or user they describe. Ingest invalidates a
+sensor's tag as soon as its readings are committed, so within a worker a
+cached chart is never older than the last write for that sensor. Other
+gunicorn workers only see the write once their entry's TTL expires, so
+TTLs bound the cross-worker staleness.
+
+TTLs are configured per endpoint family with CACHE_TTL_<FAMILY> (seconds),
+the size bound with CACHE_MAX_ENTRIES, and CACHE_ENABLED=0 turns it off.
+"""
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import make_response, request
+
+from app.ingest import on_ingest
+
+DEFAULT_TTLS = {
+    "recent": 5,
+    "hourly": 30,
+    "daily": 120,
+}
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def generation(self, tag):
+        with self._lock:
+            return self._generations.get(tag, 0)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, tag = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl, tag, generation):
+        """
+        Store `value` unless `tag` was invalidated after `generation` was
+        read, which would mean the value may predate a write.
+        """
+        with self._lock:
+            if self._generations.get(tag, 0) != generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tag)
+            self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, tag):
+        with self._lock:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+            for key in self._tags.pop(tag, ()):
+                self._entries.pop(key, None)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, tag = self._entries.pop(key)
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+
+response_cache = TTLCache(maxsize=int(os.environ.get("CACHE_MAX_ENTRIES", 1024)))
+
+
+def cache_enabled():
+    return os.environ.get("CACHE_ENABLED", "1") == "1"
+
+
+def ttl_for(family):
+    return float(os.environ.get(f"CACHE_TTL_{family.upper()}", DEFAULT_TTLS[family]))
+
+
+def _normalize_id(value):
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        return str(value)
+
+
+def sensor_tag(sensor_id):
+    return ("sensor", _normalize_id(sensor_id))
+
+
+def user_tag(user_id):
+    return ("user", _normalize_id(user_id))
+
+
+def invalidate_sensors(sensor_ids):
+    for sensor_id in set(sensor_ids):
+        response_cache.invalidate(sensor_tag(sensor_id))
+
+
+def invalidate_user(user_id):
+    response_cache.invalidate(user_tag(user_id))
+
+
+@on_ingest
+def _invalidate_ingested(rows):
+    invalidate_sensors(row[0] for row in rows)
+
+
+def cached(family):
+    """
+    Cache a successful (200) response of an aggregate view taking a
+    `sensor_id` or `user_id` argument.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not cache_enabled():
+                return view(**kwargs)
+
+            if "sensor_id" in kwargs:
+                tag = sensor_tag(kwargs["sensor_id"])
+            else:
+                tag = user_tag(kwargs["user_id"])
+            key = (request.endpoint, tuple(sorted((k, str(v)) for k, v in kwargs.items())),
+                   request.query_string)
+
+            hit = response_cache.get(key)
+            if hit is not None:
+                body, status, mimetype = hit
+                response = make_response(body, status)
+                response.mimetype = mimetype
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            generation = response_cache.generation(tag)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(key, (response.get_data(), response.status_code, response.mimetype),
+                                   ttl_for(family), tag, generation)
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
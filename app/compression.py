@@ -0,0 +1,88 @@
+"""
+Response compression negotiated through Accept-Encoding.
+
+Brotli is preferred when the client accepts it and the brotli package is
+installed; gzip is the fallback. Streamed responses (exports) are
+compressed chunk by chunk. Bodies smaller than COMPRESS_MIN_SIZE bytes and
+already-compressed formats are sent as they are.
+"""
+import gzip
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+# Already compressed; recompressing only costs CPU.
+INCOMPRESSIBLE_MIMETYPES = ("application/vnd.apache.parquet",)
+# The compressor would hold events back until it has a block to emit.
+UNBUFFERED_MIMETYPES = ("text/event-stream",)
+
+
+def choose_encoding():
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    encoding = request.accept_encodings.best_match(offered)
+    return encoding if encoding in offered else None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        finish = compressor.finish
+        process = compressor.process
+    else:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        finish = compressor.flush
+        process = compressor.compress
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """after_request hook: compress `response` if the client allows it."""
+    if (response.status_code != 200 or "Content-Encoding" in response.headers
+            or response.mimetype in INCOMPRESSIBLE_MIMETYPES + UNBUFFERED_MIMETYPES
+            or request.method == "HEAD"):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    if os.environ.get("COMPRESS_ENABLED", "1") == "1":
+        app.after_request(compress_response)
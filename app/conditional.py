@@ -0,0 +1,316 @@
+"""
+HTTP conditional requests for the read endpoints.
+
+Validators come from when data last changed, not from hashing a rendered
+body. The last_ingest table holds one timestamp per sensor, per user and
+for the sensor registry, and triggers on data, user_data, sensors and
+users keep it current. Each worker keeps an in-memory copy, so a matching
+If-None-Match or If-Modified-Since gets its 304 without any query. The
+copy is updated from the worker's own write paths (@on_ingest and the
+registry routes) and, for writes anywhere else, by a trigger on
+last_ingest that NOTIFYs the 'ingest_marks' channel, which each worker
+LISTENs on with one connection. Marks are re-read from the table only
+once older than CONDITIONAL_MARK_TTL seconds, a fallback for lost
+notifications, or every MARK_POLL_TTL seconds while the listener is not
+connected.
+
+Charts over sliding windows also change when the window moves, so a
+response's Last-Modified is the later of the last ingest and the start of
+the current minute (10-minute averages), hour (hourly charts) or day
+(7-day charts). The ETag is a weak tag over the request URL and that time.
+
+Cache-Control is set per endpoint family (CACHE_CONTROL_<FAMILY>), with
+"private" added for per-user responses.
+"""
+import hashlib
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+import psycopg2
+from flask import make_response, request
+
+from app.aggregation import LOCAL_OFFSET, local_now, truncate
+from app.cache import sensor_tag, user_tag
+from app.database import connect, get_connection
+from app.ingest import on_ingest
+from app.queries import LAST_INGEST
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_TAG = ("registry", "00000000-0000-0000-0000-000000000000")
+CHANNEL = "ingest_marks"
+# How long marks are trusted while no listener is connected.
+MARK_POLL_TTL = 1.0
+# How often the listener wakes up without notifications.
+LISTEN_POLL_SECONDS = 5.0
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DEFAULT_CACHE_CONTROL = {
+    "latest": "no-cache",
+    "recent": "max-age=5",
+    "hourly": "max-age=30",
+    "daily": "max-age=120",
+    "aggregate": "max-age=30",
+    "registry": "no-cache",
+}
+
+
+def _mark_sql(scope, source, id_column):
+    return f"""
+INSERT INTO last_ingest (scope, id, ingested_at)
+SELECT DISTINCT '{scope}', {id_column}, NOW() FROM {source} WHERE {id_column} IS NOT NULL
+ORDER BY 2
+ON CONFLICT (scope, id) DO UPDATE SET ingested_at = EXCLUDED.ingested_at;
+"""
+
+
+def _trigger_sql(name, table, event, body, transition=""):
+    return f"""
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+BEGIN
+{body}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {name} ON {table};
+CREATE TRIGGER {name}
+    AFTER {event} ON {table}
+    {transition}
+    FOR EACH STATEMENT EXECUTE FUNCTION {name}();
+"""
+
+
+def schema_sql():
+    """DDL for last_ingest, its triggers and the initial marks."""
+    registry = (
+        "INSERT INTO last_ingest (scope, id, ingested_at) "
+        f"VALUES ('{REGISTRY_TAG[0]}', '{REGISTRY_TAG[1]}', NOW()) "
+        "ON CONFLICT (scope, id) DO UPDATE SET ingested_at = EXCLUDED.ingested_at;"
+    )
+    return """
+CREATE TABLE IF NOT EXISTS last_ingest (
+    scope TEXT NOT NULL,
+    id UUID NOT NULL,
+    ingested_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (scope, id)
+);
+""" + "".join([
+        _trigger_sql("data_last_ingest", "data", "INSERT",
+                     _mark_sql("sensor", "new_rows", "sensor_id"), "REFERENCING NEW TABLE AS new_rows"),
+        _trigger_sql("user_data_last_ingest", "user_data", "INSERT",
+                     _mark_sql("user", "new_rows", "user_id"), "REFERENCING NEW TABLE AS new_rows"),
+        _trigger_sql("sensors_registry_changed", "sensors", "INSERT OR UPDATE OR DELETE", registry),
+        _trigger_sql("sensors_last_ingest", "sensors", "DELETE",
+                     _mark_sql("sensor", "old_rows", "id"), "REFERENCING OLD TABLE AS old_rows"),
+        _trigger_sql("users_last_ingest", "users", "DELETE",
+                     _mark_sql("user", "old_rows", "id"), "REFERENCING OLD TABLE AS old_rows"),
+    ]) + _mark_sql("sensor", "latest_readings", "sensor_id") + _mark_sql("user", "users", "id") + registry
+
+
+def notify_sql():
+    """DDL for the trigger that NOTIFYs every change to last_ingest."""
+    return f"""
+CREATE OR REPLACE FUNCTION last_ingest_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', json_build_array(
+        NEW.scope, NEW.id, (EXTRACT(EPOCH FROM NEW.ingested_at) * 1000000)::bigint)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS last_ingest_notify ON last_ingest;
+CREATE TRIGGER last_ingest_notify
+    AFTER INSERT OR UPDATE ON last_ingest
+    FOR EACH ROW EXECUTE FUNCTION last_ingest_notify();
+"""
+
+
+class IngestMarks:
+    def __init__(self, ttl=300.0, connect=None):
+        self.ttl = ttl
+        self._connect = connect
+        self._marks = {}
+        self._lock = threading.Lock()
+        self._thread_pid = None
+        self._listening = False
+
+    def touch(self, tag, when=None):
+        """Record a write for `tag` (a cache tag such as sensor_tag(id))."""
+        when = when or datetime.now(timezone.utc)
+        with self._lock:
+            current = self._marks.get(tag)
+            if current is None or current[1] < when:
+                self._marks[tag] = (time.monotonic(), when)
+
+    def get(self, tag):
+        """Return when `tag` last changed (aware UTC), or EPOCH if never."""
+        with self._lock:
+            entry = self._marks.get(tag)
+        ttl = self.ttl if self._listening else MARK_POLL_TTL
+        if entry is not None and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(LAST_INGEST, tag)
+                result = cursor.fetchone()
+        when = result["ingested_at"] if result else EPOCH
+        with self._lock:
+            current = self._marks.get(tag)
+            # A local write newer than the table's copy wins.
+            if current is not None and current[1] > when:
+                when = current[1]
+            self._marks[tag] = (time.monotonic(), when)
+        return when
+
+    def listen(self):
+        """Start this process's listener thread, if it has none yet (threads do not survive a fork)."""
+        pid = os.getpid()
+        if self._connect is None or self._thread_pid == pid:
+            return
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread_pid = pid
+            self._listening = False
+        threading.Thread(target=self._run, name="ingest-marks-listener", daemon=True).start()
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL};")
+                # Whatever changed while nobody was listening is re-read.
+                with self._lock:
+                    self._marks.clear()
+                    self._listening = True
+                backoff = 1.0
+                while True:
+                    if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError):
+                logger.exception("Ingest mark listener lost its connection; retrying in %.0fs", backoff)
+                self._listening = False
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+    def _dispatch(self, payload):
+        try:
+            scope, tag_id, micros = json.loads(payload)
+            when = EPOCH + timedelta(microseconds=micros)
+        except (TypeError, ValueError):
+            logger.warning("Ignoring malformed %s notification %r", CHANNEL, payload)
+            return
+        self.touch((scope, tag_id), when)
+
+
+ingest_marks = IngestMarks(ttl=float(os.environ.get("CONDITIONAL_MARK_TTL", 300)), connect=connect)
+
+
+@on_ingest
+def _mark_ingested(rows):
+    now = datetime.now(timezone.utc)
+    for sensor_id in {row[0] for row in rows}:
+        ingest_marks.touch(sensor_tag(sensor_id), now)
+
+
+def conditional_enabled():
+    return os.environ.get("CONDITIONAL_ENABLED", "1") == "1"
+
+
+def cache_control_for(family):
+    return os.environ.get(f"CACHE_CONTROL_{family.upper()}", DEFAULT_CACHE_CONTROL[family])
+
+
+def window_start(family):
+    """Start of the current time quantum of `family`'s window (aware UTC), or None."""
+    if family == "aggregate":
+        family = {"minute": "recent", "hour": "hourly"}.get(request.args.get("bucket", "hour"), "daily")
+    now = datetime.now(timezone.utc)
+    if family == "recent":
+        return now.replace(second=0, microsecond=0)
+    if family == "hourly":
+        return now.replace(minute=0, second=0, microsecond=0)
+    if family == "daily":
+        return (truncate(local_now(), "day") + LOCAL_OFFSET).replace(tzinfo=timezone.utc)
+    return None
+
+
+def _request_tag(kwargs):
+    if "sensor_id" in kwargs:
+        return sensor_tag(kwargs["sensor_id"])
+    if "user_id" in kwargs:
+        return user_tag(kwargs["user_id"])
+    # /api/data/aggregate names its sensor/user in the query string.
+    for scope, tag in (("sensor", sensor_tag), ("user", user_tag)):
+        value = request.args.get(scope)
+        if value:
+            try:
+                return tag(uuid.UUID(value))
+            except ValueError:
+                return None
+    return None
+
+
+def conditional(family):
+    """
+    Add ETag, Last-Modified and Cache-Control to a GET view's 200 responses
+    and answer matching conditional requests with 304 before running it.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not conditional_enabled():
+                return view(**kwargs)
+            tag = REGISTRY_TAG if family == "registry" else _request_tag(kwargs)
+            if tag is None:
+                return view(**kwargs)
+
+            ingest_marks.listen()
+            last_modified = ingest_marks.get(tag)
+            window = window_start(family)
+            if window is not None and window > last_modified:
+                last_modified = window
+            # The ETag keeps full precision so two writes within one second
+            # still yield different tags; Last-Modified is whole seconds.
+            digest = hashlib.sha1(f"{request.full_path}|{last_modified.isoformat()}".encode()).hexdigest()[:20]
+            last_modified = last_modified.replace(microsecond=0)
+            cache_control = cache_control_for(family)
+            if tag[0] == "user":
+                cache_control = f"private, {cache_control}"
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(digest)
+            else:
+                since = request.if_modified_since
+                not_modified = since is not None and last_modified <= since
+            response = make_response("", 304) if not_modified else make_response(view(**kwargs))
+
+            if response.status_code in (200, 304):
+                response.set_etag(digest, weak=True)
+                response.last_modified = last_modified
+                response.headers["Cache-Control"] = cache_control
+            return response
+        return wrapper
+    return decorator
@@ -1,8 +1,92 @@
+import logging
 import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
 
-def get_connection():
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+_statement_listeners = []
+_checkout_listeners = []
+_release_listeners = []
+
+
+def on_statement(listener):
+    """
+    Register `listener(cursor, query, vars, seconds, error)` to be called
+    after every statement run on the app's connections; `error` is the
+    exception it raised, or None.
+    """
+    _statement_listeners.append(listener)
+    return listener
+
+
+def on_checkout(listener):
+    """Register `listener(seconds, error)` to be called after every pool checkout attempt."""
+    _checkout_listeners.append(listener)
+    return listener
+
+
+def on_release(listener):
+    """Register `listener()` to be called when a checked-out connection is returned."""
+    _release_listeners.append(listener)
+    return listener
+
+
+def _notify(listeners, *args):
+    for listener in listeners:
+        try:
+            listener(*args)
+        except Exception:
+            logger.exception("Database listener %r failed", listener)
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        if not _statement_listeners:
+            return super().execute(query, vars)
+        error = None
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _notify(_statement_listeners, self, query, vars, time.perf_counter() - started, error)
+
+
+_timed_cursors = {}
+
+
+def _timed(cursor_factory):
+    cls = _timed_cursors.get(cursor_factory)
+    if cls is None:
+        cls = type(f"Timed{cursor_factory.__name__}", (_TimedCursorMixin, cursor_factory), {})
+        _timed_cursors[cursor_factory] = cls
+    return cls
+
+
+class TimedConnection(extensions.connection):
+    """A connection whose cursors, whatever their factory, report to on_statement listeners."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = _timed(factory)
+        return super().cursor(*args, **kwargs)
+
+
+def _connect():
     db = os.environ.get("DATABASE")
     host = os.environ.get("HOST")
     user = os.environ.get("USER")
@@ -10,8 +94,246 @@ def get_connection():
     port = os.environ.get("PORT")
     url = os.environ.get("DATABASE_URL")
 
-    # #gcp cloud sql connection
-    # return psycopg2.connect(url, cursor_factory=RealDictCursor)
+    # DB_CONNECTION=url connects through DATABASE_URL (e.g. a local Postgres),
+    # anything else keeps the Cloud SQL unix socket.
+    if os.environ.get("DB_CONNECTION", "socket") == "url":
+        return psycopg2.connect(url, cursor_factory=RealDictCursor, connection_factory=TimedConnection)
 
     unix_socket = '/cloudsql/{}'.format(host)
-    return psycopg2.connect(database=db, user =user, password = password, host = unix_socket, cursor_factory=RealDictCursor)
\ No newline at end of file
+    return psycopg2.connect(database=db, user =user, password = password, host = unix_socket, cursor_factory=RealDictCursor,
+                            connection_factory=TimedConnection)
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections.
+
+    Connections older than `max_lifetime` seconds are replaced, and connections
+    that sat idle longer than `health_check_after` seconds are pinged before
+    being handed out. Checkout blocks for at most `timeout` seconds.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=8, timeout=10.0,
+                 max_lifetime=1800.0, health_check_after=30.0):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool bounds must satisfy 0 <= minconn <= maxconn, maxconn >= 1")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(minconn):
+            self._idle.append(_PooledConnection(self._connect()))
+            self._size += 1
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed.")
+                if self._idle:
+                    pooled = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    pooled = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available within {self.timeout}s.")
+                self._cond.wait(remaining)
+
+        # Connecting and pinging happen outside the lock so that a slow
+        # server does not block other threads returning connections.
+        try:
+            if pooled is not None and not self._is_usable(pooled):
+                self._close_quietly(pooled.conn)
+                pooled = None
+            if pooled is None:
+                pooled = _PooledConnection(self._connect())
+        except Exception:
+            self._release_slot()
+            raise
+        return pooled
+
+    def putconn(self, pooled, discard=False):
+        conn = pooled.conn
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        if discard or conn.closed or self._expired(pooled):
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection, commit on success or roll back on error,
+        and always return it to the pool.
+        """
+        started = time.perf_counter()
+        try:
+            pooled = self.getconn()
+        except Exception as e:
+            _notify(_checkout_listeners, time.perf_counter() - started, e)
+            raise
+        _notify(_checkout_listeners, time.perf_counter() - started, None)
+        discard = False
+        try:
+            yield pooled.conn
+            pooled.conn.commit()
+        except BaseException:
+            try:
+                pooled.conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(pooled, discard=discard)
+            _notify(_release_listeners)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close_quietly(self._idle.pop().conn)
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max": self.maxconn}
+
+    def _expired(self, pooled):
+        return self.max_lifetime and time.monotonic() - pooled.created_at > self.max_lifetime
+
+    def _is_usable(self, pooled):
+        if pooled.conn.closed or self._expired(pooled):
+            return False
+        if time.monotonic() - pooled.last_used < self.health_check_after:
+            return True
+        try:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            pooled.conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return this process's pool, creating it on first use. The pool is
+    rebuilt after a fork so gunicorn workers never share sockets.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(
+                _connect,
+                minconn=int(os.environ.get("DB_POOL_MIN", 1)),
+                maxconn=int(os.environ.get("DB_POOL_MAX", 8)),
+                timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+                max_lifetime=float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800)),
+                health_check_after=float(os.environ.get("DB_POOL_HEALTH_CHECK_AFTER", 30)),
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+def connect():
+    """A connection outside the pool, for long-lived uses such as LISTEN."""
+    return _connect()
+
+
+def get_connection():
+    """
+    Usage: `with get_connection() as conn:` - the connection is committed
+    (or rolled back on error) and returned to the pool on exit.
+    """
+    return get_pool().connection()
+
+
+def _gevent_wait(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def make_green():
+    """
+    Make psycopg2 cooperative under gevent: while a statement (or connect)
+    waits on the server, the worker runs other greenlets instead of
+    blocking. Applies to connections already open too. Call after gevent
+    has monkey-patched the process (gunicorn.conf.py does, for gevent workers).
+    """
+    extensions.set_wait_callback(_gevent_wait)
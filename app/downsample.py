@@ -0,0 +1,191 @@
+"""
+Shape-preserving downsampling of long time series for ?points=N.
+
+Two methods, both over NumPy arrays built one batch of rows at a time:
+
+- lttb (default): Largest-Triangle-Three-Buckets. The series is cut into
+  N-2 buckets between its first and last row, and from each bucket the row
+  forming the largest triangle with the row kept before it and the average
+  of the next bucket is kept. With several metrics the triangle areas of
+  each (scaled to its own range) are summed, so one set of rows is kept
+  for all of them.
+- minmax: the time range is cut into pixel buckets and the rows holding
+  each metric's minimum and maximum in every bucket are kept (and a
+  row marking the gap, for buckets with no values). When N is too small
+  for even one bucket's worth of rows (2 per metric, 1 gap) plus the
+  first and last, lttb is used instead.
+
+Either way at most N rows come out, in time order, first and last
+included. Rows are streamed through Downsampler.add(): once more than a
+few times N candidates have piled up they are reduced to the min/max rows
+of PRESELECT_RATIO * N time buckets (the MinMaxLTTB preselection), so
+memory stays bounded by N rather than by the length of the range.
+
+Needs numpy; without it ?points is refused.
+"""
+import os
+import warnings
+from datetime import datetime, timezone
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+METHODS = ("lttb", "minmax")
+DOWNSAMPLE_MAX_POINTS = int(os.environ.get("DOWNSAMPLE_MAX_POINTS", 5000))
+# Time buckets per requested point when reducing streamed candidates.
+PRESELECT_RATIO = 4
+EPOCH = datetime(1970, 1, 1)
+
+
+class DownsampleError(ValueError):
+    """Raised for an invalid ?points / ?downsample or a missing numpy."""
+
+
+def parse_downsample(args):
+    """(points, method) from ?points= and ?downsample=, or (None, None) without ?points."""
+    if "points" not in args:
+        return None, None
+    if numpy is None:
+        raise DownsampleError("Downsampling is not available (numpy is not installed).")
+    try:
+        points = int(args["points"])
+    except ValueError:
+        raise DownsampleError(f"Invalid points '{args['points']}'.")
+    if not 3 <= points <= DOWNSAMPLE_MAX_POINTS:
+        raise DownsampleError(f"'points' must be between 3 and {DOWNSAMPLE_MAX_POINTS}.")
+    method = args.get("downsample", "lttb")
+    if method not in METHODS:
+        raise DownsampleError(f"Unknown downsample '{method}'. Use one of: {', '.join(METHODS)}.")
+    return points, method
+
+
+def _seconds(times):
+    # Several times faster than numpy's own datetime64 conversion, and
+    # works for aware datetimes too.
+    epoch = EPOCH if times[0].tzinfo is None else EPOCH.replace(tzinfo=timezone.utc)
+    return numpy.fromiter(((t - epoch).total_seconds() for t in times), float, len(times))
+
+
+def _extremes(buckets, values):
+    """Indices of the minimum and maximum of `values` within each bucket (NaNs ignored)."""
+    valid = numpy.flatnonzero(~numpy.isnan(values))
+    if not valid.size:
+        return valid
+    order = valid[numpy.lexsort((values[valid], buckets[valid]))]
+    groups = buckets[order]
+    starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+    ends = numpy.r_[starts[1:], len(order)] - 1
+    return numpy.concatenate((order[starts], order[ends]))
+
+
+def minmax(x, y, buckets):
+    """
+    Indices (sorted) of the rows holding each column of `y`'s minimum and
+    maximum within `buckets` equal time buckets over x, the first row of
+    each bucket with no values, and the first and last row.
+    """
+    span = x[-1] - x[0]
+    if span > 0:
+        index = numpy.minimum((x - x[0]) / span * buckets, buckets - 1).astype(numpy.int64)
+    else:
+        index = numpy.zeros(len(x), dtype=numpy.int64)
+    keep = [_extremes(index, y[:, column]) for column in range(y.shape[1])]
+    # One row with no values at all per bucket, so gaps stay gaps.
+    missing = numpy.flatnonzero(numpy.isnan(y).all(axis=1))
+    keep.append(missing[numpy.unique(index[missing], return_index=True)[1]])
+    keep.append(numpy.array([0, len(x) - 1]))
+    return numpy.unique(numpy.concatenate(keep))
+
+
+def lttb(x, y, points):
+    """Indices (sorted) of the `points` rows Largest-Triangle-Three-Buckets keeps."""
+    size = len(x)
+    if points >= size:
+        return numpy.arange(size)
+    # Each metric counts in units of its own range; missing values add nothing.
+    with warnings.catch_warnings():
+        # A metric with no values at all stays NaN and is ignored.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        low, high = numpy.nanmin(y, axis=0), numpy.nanmax(y, axis=0)
+    scale = numpy.where(high > low, high - low, 1.0)
+    y = (y - low) / scale
+    x = (x - x[0]) / max(x[-1] - x[0], 1.0)
+
+    # points-2 buckets over the rows between the first and the last.
+    edges = (numpy.arange(points - 1) * (size - 2) // (points - 2) + 1).astype(numpy.int64)
+    counts = numpy.diff(edges)
+    average_x = numpy.add.reduceat(x[:size - 1], edges[:-1]) / counts
+    finite = ~numpy.isnan(y[:size - 1])
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        average_y = (numpy.add.reduceat(numpy.where(finite, y[:size - 1], 0.0), edges[:-1])
+                     / numpy.add.reduceat(finite.astype(float), edges[:-1]))
+
+    keep = numpy.empty(points, dtype=numpy.int64)
+    keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < points - 2:
+            cx, cy = average_x[i + 1], average_y[i + 1]
+        else:
+            cx, cy = x[-1], y[-1]
+        area = numpy.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi, None]) * (cy - y[a]))
+        a = lo + int(numpy.argmax(numpy.nansum(area, axis=1)))
+        keep[i + 1] = a
+    return keep
+
+
+class Downsampler:
+    """
+    Feed rows in time order with add(), one batch at a time; rows() returns
+    at most `points` of them. `key` maps a row to (time, value, ...) and
+    defaults to the row itself; values may be None.
+    """
+
+    def __init__(self, points, method="lttb", key=None):
+        self.points = points
+        self.method = method
+        self._key = key
+        self._rows = []
+        self._x = None
+        self._y = None
+
+    def add(self, rows):
+        if not rows:
+            return
+        table = rows if self._key is None else [self._key(row) for row in rows]
+        columns = list(zip(*table))
+        x = _seconds(columns[0])
+        y = numpy.array(columns[1:], dtype=float).T.reshape(len(rows), len(columns) - 1)
+        if self._x is None:
+            self._rows, self._x, self._y = list(rows), x, y
+        else:
+            self._rows.extend(rows)
+            self._x = numpy.concatenate((self._x, x))
+            self._y = numpy.concatenate((self._y, y))
+        budget = PRESELECT_RATIO * self.points * (2 * self._y.shape[1] + 1)
+        if len(self._rows) > 2 * budget:
+            self._select(minmax(self._x, self._y, PRESELECT_RATIO * self.points))
+
+    def _select(self, keep):
+        self._rows = [self._rows[i] for i in keep]
+        self._x, self._y = self._x[keep], self._y[keep]
+
+    def rows(self):
+        if len(self._rows) > self.points:
+            # Up to two rows per metric and one gap per bucket, plus first and last.
+            buckets = (self.points - 2) // (2 * self._y.shape[1] + 1)
+            if self.method == "lttb" or buckets < 1:
+                self._select(lttb(self._x, self._y, self.points))
+            else:
+                self._select(minmax(self._x, self._y, buckets))
+        return self._rows
+
+
+def downsample(rows, points, method="lttb", key=None):
+    """Downsample an in-memory list of rows; see Downsampler."""
+    sampler = Downsampler(points, method, key)
+    sampler.add(rows)
+    return sampler.rows()
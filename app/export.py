@@ -0,0 +1,220 @@
+"""
+Streaming export of raw readings.
+
+Rows are read through a server-side (named) cursor in batches of
+EXPORT_BATCH_ROWS and encoded batch by batch, so a worker only ever holds
+one batch in memory no matter how long the requested range is. The
+connection stays checked out of the pool until the response has been
+fully sent (or the client disconnects).
+
+Besides CSV and NDJSON, rows can be encoded as an Arrow IPC stream or a
+Parquet file (one record batch / row group per database batch), with the
+timestamps and metrics as typed columns. Those formats need pyarrow and
+are only offered when it is installed.
+
+A downsampled export (?points=N) reads the same batches but feeds them to
+a Downsampler per sensor instead, and sends the few rows it keeps as a
+single body.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+from datetime import datetime
+from operator import itemgetter
+
+from psycopg2.extensions import cursor as tuple_cursor
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from app.database import get_connection
+from app.downsample import Downsampler
+from app.queries import SENSOR_EXPORT, USER_EXPORT
+
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", 5000))
+
+EXPORTS = {
+    "sensor": (SENSOR_EXPORT, ("date", "temperature", "humidity", "pm25", "tvoc", "co2")),
+    "user": (USER_EXPORT, ("date", "sensor_id", "temperature", "humidity", "pm25", "tvoc", "co2")),
+}
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def fetch_batches(scope, scope_id, start, end, batch_size=None):
+    """
+    Yield lists of row tuples (in EXPORTS[scope] column order) for one
+    sensor/user over [start, end), oldest first.
+    """
+    query, _ = EXPORTS[scope]
+    with get_connection() as conn:
+        # Plain tuples: no per-row dict for rows that are only re-encoded.
+        with conn.cursor(name=f"export_{uuid.uuid4().hex}", cursor_factory=tuple_cursor) as cursor:
+            cursor.execute(query, (str(scope_id), start, end))
+            while True:
+                rows = cursor.fetchmany(batch_size or EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                yield rows
+
+
+def encode_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_value(v) for v in row] for row in rows)
+        yield buffer.getvalue()
+
+
+def encode_ndjson(columns, batches):
+    for rows in batches:
+        yield "".join(json.dumps(dict(zip(columns, map(_value, row)))) + "\n" for row in rows)
+
+
+def arrow_schema(columns):
+    def column_type(name):
+        if name == "date":
+            return pyarrow.timestamp("us")
+        if name == "bucket":
+            return pyarrow.timestamp("us", tz="UTC")
+        if name.endswith("_id"):
+            return pyarrow.string()
+        return pyarrow.float64()
+    return pyarrow.schema([(name, column_type(name)) for name in columns])
+
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if pyarrow.types.is_string(field.type):
+            values = [str(v) if v is not None else None for v in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Chunks(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _encode_columnar(columns, batches, open_writer):
+    schema = arrow_schema(columns)
+    sink = _Chunks()
+    writer = open_writer(sink, schema)
+    for rows in batches:
+        writer.write_batch(_record_batch(schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def encode_arrow(columns, batches):
+    return _encode_columnar(columns, batches, pyarrow.ipc.new_stream)
+
+
+def encode_parquet(columns, batches):
+    return _encode_columnar(columns, batches, pyarrow.parquet.ParquetWriter)
+
+
+# format name -> (mimetype, file extension, encoder(columns, batches))
+FORMATS = {
+    "csv": ("text/csv", "csv", encode_csv),
+    "ndjson": ("application/x-ndjson", "ndjson", encode_ndjson),
+}
+COLUMNAR_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows", encode_arrow),
+    "parquet": ("application/vnd.apache.parquet", "parquet", encode_parquet),
+}
+if pyarrow is not None:
+    FORMATS.update(COLUMNAR_FORMATS)
+
+
+def negotiate_format(request, formats=None, default="csv"):
+    """
+    Pick a format name from ?format= or, failing that, the Accept header.
+    `formats` maps names to mimetypes (defaults to FORMATS). Returns None
+    for an unsupported ?format=.
+    """
+    if formats is None:
+        formats = {name: mimetype for name, (mimetype, _, _) in FORMATS.items()}
+    requested = request.args.get("format")
+    if requested:
+        return requested if requested in formats else None
+    by_mimetype = {mimetype: name for name, mimetype in formats.items()}
+    best = request.accept_mimetypes.best_match([formats[default]] + list(by_mimetype))
+    return by_mimetype.get(best, default)
+
+
+def columnar_formats():
+    """{name: mimetype} of the columnar formats available in this install."""
+    return {name: mimetype for name, (mimetype, _, _) in FORMATS.items() if name in COLUMNAR_FORMATS}
+
+
+def encode(format, columns, rows):
+    """Encode in-memory `rows` as one response body in `format`; returns (mimetype, bytes)."""
+    mimetype, _, encoder = FORMATS[format]
+    chunks = encoder(columns, [rows] if rows else [])
+    return mimetype, b"".join(c.encode() if isinstance(c, str) else c for c in chunks)
+
+
+def export(scope, scope_id, start, end, format="csv"):
+    """Return (mimetype, filename, iterator of encoded chunks)."""
+    _, columns = EXPORTS[scope]
+    mimetype, extension, encoder = FORMATS[format]
+    filename = f"{scope}-{scope_id}.{extension}"
+    return mimetype, filename, encoder(columns, fetch_batches(scope, scope_id, start, end))
+
+
+def downsampled_export(scope, scope_id, start, end, points, method="lttb", format="csv"):
+    """
+    Like export(), but with at most `points` rows per sensor, chosen by
+    `method` (see app.downsample). Returns (mimetype, filename, bytes).
+    """
+    _, columns = EXPORTS[scope]
+    metrics = [i for i, name in enumerate(columns) if name not in ("date", "sensor_id")]
+    key = itemgetter(0, *metrics)
+    group = itemgetter(columns.index("sensor_id")) if "sensor_id" in columns else None
+    samplers = {}
+    for rows in fetch_batches(scope, scope_id, start, end):
+        if group is None:
+            samplers.setdefault(None, Downsampler(points, method, key)).add(rows)
+            continue
+        by_sensor = {}
+        for row in rows:
+            by_sensor.setdefault(group(row), []).append(row)
+        for sensor_id, sensor_rows in by_sensor.items():
+            samplers.setdefault(sensor_id, Downsampler(points, method, key)).add(sensor_rows)
+    rows = sorted((row for sampler in samplers.values() for row in sampler.rows()), key=itemgetter(0))
+    _, extension, _ = FORMATS[format]
+    mimetype, body = encode(format, columns, rows)
+    return mimetype, f"{scope}-{scope_id}.{extension}", body
@@ -0,0 +1,260 @@
+"""
+Write-behind ingest buffer.
+
+When INGEST_WRITE_BEHIND=1, add_data validates a reading, enqueues it here
+and returns 202. A background thread drains the buffer into the data table
+in bulk whenever INGEST_FLUSH_ROWS readings are queued or INGEST_FLUSH_INTERVAL
+seconds have passed, whichever comes first. The buffer is bounded by
+INGEST_BUFFER_CAPACITY; when it is full, offer() returns False and the caller
+should shed load.
+
+A flush that fails because the database is unreachable is put back and
+retried after a pause. Any other failure means some row cannot be written,
+so the batch is retried one row at a time and the rows that still fail are
+logged and dropped, instead of blocking every reading queued behind them.
+
+Every ingest path (add_data, the batch endpoint and the flusher) calls
+publish() with the committed rows so that derived state such as caches can
+react to new readings; register a callback with @on_ingest.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from app.database import PoolTimeout, get_connection
+from app.queries import INSERT_DATA_VALUES, EXISTING_SENSOR_IDS
+
+logger = logging.getLogger(__name__)
+
+# Failures that say nothing about the rows; the batch is retried as is.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+
+_listeners = []
+
+
+def on_ingest(listener):
+    """
+    Register `listener(rows)` to be called after readings are committed.
+    Rows are tuples in INSERT_DATA column order.
+    """
+    _listeners.append(listener)
+    return listener
+
+
+def publish(rows):
+    if not rows:
+        return
+    for listener in _listeners:
+        try:
+            listener(rows)
+        except Exception:
+            logger.exception("Ingest listener %r failed", listener)
+
+
+def write_behind_enabled():
+    return os.environ.get("INGEST_WRITE_BEHIND", "0") == "1"
+
+
+def write_readings(batch):
+    """
+    Insert INSERT_DATA-ordered rows in one statement, skipping rows whose
+    sensor no longer exists, and publish them. Returns the rows written.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(EXISTING_SENSOR_IDS, (list({row[0] for row in batch}),))
+            known = {str(result["id"]) for result in cursor.fetchall()}
+            rows = [row for row in batch if row[0] in known]
+            if rows:
+                execute_values(cursor, INSERT_DATA_VALUES, rows, page_size=len(rows))
+    publish(rows)
+    return rows
+
+
+class WriteBehindBuffer:
+    """
+    Bounded queue drained by a background thread that hands batches of up
+    to `flush_rows` items to `write(batch)`, which returns the items it
+    actually wrote (the rest are counted as dropped).
+    """
+
+    def __init__(self, write, capacity=10000, flush_rows=500, flush_interval=1.0, name="ingest-flusher"):
+        self._write = write
+        self.name = name
+        self.capacity = capacity
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        self._enqueued = 0
+        self._rejected = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._flushed_rows = 0
+        self._dropped_rows = 0
+        self._last_flush_rows = 0
+        self._last_flush_seconds = 0.0
+        self._max_flush_seconds = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def offer(self, row):
+        """Queue one INSERT_DATA-ordered row. Returns False if the buffer is full."""
+        with self._cond:
+            if self._stopping or len(self._queue) >= self.capacity:
+                self._rejected += 1
+                return False
+            self._queue.append(row)
+            self._enqueued += 1
+            if len(self._queue) >= self.flush_rows:
+                self._cond.notify()
+            return True
+
+    def stop(self, timeout=10.0):
+        """Stop accepting rows, flush everything still queued and join the flusher."""
+        with self._cond:
+            self._stopping = True
+            thread = self._thread
+            self._cond.notify()
+        if thread is not None:
+            thread.join(timeout)
+        # Anything left (flusher never started, or join timed out) goes out inline.
+        while True:
+            batch = self._take()
+            if not batch:
+                break
+            if not self._flush(batch):
+                break
+        with self._cond:
+            self._thread = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "depth": len(self._queue),
+                "capacity": self.capacity,
+                "enqueued": self._enqueued,
+                "rejected": self._rejected,
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "flushed_rows": self._flushed_rows,
+                "dropped_rows": self._dropped_rows,
+                "last_flush_rows": self._last_flush_rows,
+                "last_flush_seconds": round(self._last_flush_seconds, 6),
+                "max_flush_seconds": round(self._max_flush_seconds, 6),
+                "avg_rows_per_flush": round(self._flushed_rows / self._flushes, 2) if self._flushes else 0,
+            }
+
+    def _take(self):
+        with self._cond:
+            count = min(len(self._queue), self.flush_rows)
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            with self._cond:
+                while not self._stopping and len(self._queue) < self.flush_rows:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            deadline = time.monotonic() + self.flush_interval
+            batch = self._take()
+            if batch and not self._flush(batch):
+                # Back off so a database outage doesn't turn into a hot loop.
+                time.sleep(self.flush_interval)
+
+    def _requeue(self, batch):
+        with self._cond:
+            self._failed_flushes += 1
+            # Put the batch back at the head, dropping the oldest rows if
+            # new readings have since filled the buffer.
+            room = max(self.capacity - len(self._queue), 0)
+            requeue = batch[-room:] if room else []
+            self._dropped_rows += len(batch) - len(requeue)
+            self._queue.extendleft(reversed(requeue))
+
+    def _write_each(self, batch):
+        """Write `batch` one row at a time, dropping rows that fail. Returns the rows written, or None."""
+        rows = []
+        for index, row in enumerate(batch):
+            try:
+                rows.extend(self._write([row]))
+            except TRANSIENT_ERRORS:
+                logger.exception("%s: flush failed; requeueing %d rows", self.name, len(batch) - index)
+                self._requeue(batch[index:])
+                with self._cond:
+                    self._flushed_rows += len(rows)
+                    self._dropped_rows += index - len(rows)
+                return None
+            except Exception:
+                logger.exception("%s: dropping row that cannot be written: %r", self.name, row)
+        return rows
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            rows = self._write(batch)
+        except TRANSIENT_ERRORS:
+            logger.exception("%s: flush of %d rows failed; requeueing", self.name, len(batch))
+            self._requeue(batch)
+            return False
+        except Exception:
+            logger.exception("%s: flush of %d rows failed; retrying row by row", self.name, len(batch))
+            rows = self._write_each(batch)
+            if rows is None:
+                return False
+
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._flushes += 1
+            self._flushed_rows += len(rows)
+            self._dropped_rows += len(batch) - len(rows)
+            self._last_flush_rows = len(rows)
+            self._last_flush_seconds = elapsed
+            self._max_flush_seconds = max(self._max_flush_seconds, elapsed)
+        return True
+
+
+_buffer = None
+_buffer_pid = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Return this process's buffer, starting its flusher on first use."""
+    global _buffer, _buffer_pid
+    pid = os.getpid()
+    if _buffer is not None and _buffer_pid == pid:
+        return _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer_pid != pid:
+            _buffer = WriteBehindBuffer(
+                write_readings,
+                capacity=int(os.environ.get("INGEST_BUFFER_CAPACITY", 10000)),
+                flush_rows=int(os.environ.get("INGEST_FLUSH_ROWS", 500)),
+                flush_interval=float(os.environ.get("INGEST_FLUSH_INTERVAL", 1.0)),
+            )
+            _buffer_pid = pid
+            _buffer.start()
+            atexit.register(_buffer.stop)
+    return _buffer
@@ -0,0 +1,151 @@
+"""
+Last-value store for the latest reading of every sensor.
+
+The shared copy is the latest_readings table, upserted by a statement-level
+trigger on data so every insert path keeps it current. A reading only
+replaces the stored one if its date is not older, so readings submitted
+out of order through the 'date' field never move "latest" backwards.
+
+On top of that each worker keeps an in-memory copy, updated from its own
+ingest path and warmed from latest_readings at startup. Entries are
+re-read from the table once they are older than LATEST_MEMORY_TTL seconds
+so that writes handled by other workers/instances are picked up.
+"""
+import os
+import threading
+import time
+import uuid
+
+from app.aggregation import to_local
+from app.database import get_connection
+from app.ingest import on_ingest
+from app.queries import SENSOR_LATEST_READING, ALL_LATEST_READINGS
+
+READING_FIELDS = ("temperature", "humidity", "pm25", "tvoc", "co2", "date")
+
+CREATE_LATEST_READINGS = """
+CREATE TABLE IF NOT EXISTS latest_readings (
+    sensor_id UUID PRIMARY KEY,
+    temperature DOUBLE PRECISION DEFAULT NULL,
+    humidity DOUBLE PRECISION DEFAULT NULL,
+    pm25 DOUBLE PRECISION DEFAULT NULL,
+    tvoc DOUBLE PRECISION DEFAULT NULL,
+    co2 DOUBLE PRECISION DEFAULT NULL,
+    date TIMESTAMP NOT NULL,
+    FOREIGN KEY (sensor_id) REFERENCES sensors (id) ON DELETE CASCADE
+);
+"""
+
+
+def upsert_latest_sql(source):
+    return f"""
+INSERT INTO latest_readings AS l (sensor_id, temperature, humidity, pm25, tvoc, co2, date)
+SELECT DISTINCT ON (sensor_id) sensor_id, temperature, humidity, pm25, tvoc, co2, date
+FROM {source}
+WHERE sensor_id IS NOT NULL AND date IS NOT NULL
+ORDER BY sensor_id, date DESC
+ON CONFLICT (sensor_id) DO UPDATE SET
+    temperature = EXCLUDED.temperature,
+    humidity = EXCLUDED.humidity,
+    pm25 = EXCLUDED.pm25,
+    tvoc = EXCLUDED.tvoc,
+    co2 = EXCLUDED.co2,
+    date = EXCLUDED.date
+WHERE l.date <= EXCLUDED.date;
+"""
+
+
+def schema_sql():
+    """DDL for latest_readings and its trigger, plus the initial backfill."""
+    return CREATE_LATEST_READINGS + f"""
+CREATE OR REPLACE FUNCTION data_latest_after_insert() RETURNS trigger AS $$
+BEGIN
+{upsert_latest_sql("new_rows")}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS data_latest ON data;
+CREATE TRIGGER data_latest
+    AFTER INSERT ON data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION data_latest_after_insert();
+""" + upsert_latest_sql("data")
+
+
+def _as_float(value):
+    # Match what the DOUBLE PRECISION columns hand back.
+    return float(value) if value is not None else None
+
+
+class LatestReadings:
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._readings = {}
+        self._lock = threading.Lock()
+
+    def update(self, sensor_id, reading):
+        """Record `reading` unless a newer one is already known."""
+        with self._lock:
+            current = self._readings.get(sensor_id)
+            if current is not None and current[1]["date"] > reading["date"]:
+                return False
+            self._readings[sensor_id] = (time.monotonic(), reading)
+            return True
+
+    def get(self, sensor_id):
+        """
+        Return the latest reading as a dict of READING_FIELDS, or None if the
+        sensor has no data. Falls back to latest_readings when the in-memory
+        copy is missing or older than the TTL.
+        """
+        with self._lock:
+            entry = self._readings.get(sensor_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SENSOR_LATEST_READING, (sensor_id,))
+                result = cursor.fetchone()
+        if not result:
+            return None
+        reading = {field: result[field] for field in READING_FIELDS}
+        with self._lock:
+            self._readings[sensor_id] = (time.monotonic(), reading)
+        return reading
+
+    def warm(self):
+        """Load every sensor's latest reading from latest_readings."""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(ALL_LATEST_READINGS)
+                results = cursor.fetchall()
+        now = time.monotonic()
+        with self._lock:
+            for result in results:
+                self._readings[str(result["sensor_id"])] = (
+                    now, {field: result[field] for field in READING_FIELDS})
+        return len(results)
+
+    def forget(self, sensor_id):
+        with self._lock:
+            self._readings.pop(sensor_id, None)
+
+
+latest_readings = LatestReadings(ttl=float(os.environ.get("LATEST_MEMORY_TTL", 5)))
+
+
+@on_ingest
+def _record_ingested(rows):
+    newest = {}
+    for sensor_id, temperature, humidity, pm25, tvoc, co2, date in rows:
+        date = to_local(date)
+        if sensor_id not in newest or newest[sensor_id]["date"] <= date:
+            newest[sensor_id] = {
+                "temperature": _as_float(temperature), "humidity": _as_float(humidity),
+                "pm25": _as_float(pm25), "tvoc": _as_float(tvoc), "co2": _as_float(co2),
+                "date": date,
+            }
+    for sensor_id, reading in newest.items():
+        latest_readings.update(str(uuid.UUID(str(sensor_id))), reading)
@@ -0,0 +1,195 @@
+"""
+Prometheus metrics for requests, queries and the connection pool, served
+at GET /metrics in the Prometheus text format.
+
+Requests are timed per endpoint (blueprint.view), method and status, up to
+the point the response is handed to the server, so streamed bodies
+(exports, SSE) count their time to first byte. Queries are timed per
+statement (through app.database.on_statement) and labelled with the name of
+the app/queries.py constant they came from, matched on the SQL text (or
+its static prefix for templates and execute_values batches).
+psycopg2.sql queries can carry a `name` attribute instead, as the
+aggregation engine's do. Anything else is "other".
+
+Under gunicorn every worker records into PROMETHEUS_MULTIPROC_DIR
+(gunicorn.conf.py sets it up and cleans it), and /metrics merges all
+workers' files, so any worker can answer a scrape. Without it, metrics
+are this process's only. METRICS_ENABLED=0 or a missing prometheus_client
+turns all of this off.
+"""
+import os
+import threading
+import time
+
+from flask import Response, g, request
+
+from app import queries
+from app.database import on_checkout, on_release, on_statement
+
+try:
+    import prometheus_client
+    from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Shortest static prefix trusted to identify a templated query.
+MIN_PREFIX = 24
+
+
+def metrics_enabled():
+    return prometheus_client is not None and os.environ.get("METRICS_ENABLED", "1") == "1"
+
+
+if prometheus_client is not None:
+    REQUEST_SECONDS = Histogram(
+        "airborne_request_duration_seconds", "Time to produce a response, by endpoint.",
+        ("endpoint", "method", "status"), buckets=LATENCY_BUCKETS)
+    REQUEST_EXCEPTIONS = Counter(
+        "airborne_request_exceptions_total", "Requests that raised an unhandled exception.",
+        ("endpoint", "exception"))
+    QUERY_SECONDS = Histogram(
+        "airborne_query_duration_seconds", "Statement execution time, by query constant.",
+        ("query",), buckets=LATENCY_BUCKETS)
+    QUERY_ROWS = Counter(
+        "airborne_query_rows_total", "Rows returned by SELECTs, by query constant.", ("query",))
+    QUERY_ERRORS = Counter(
+        "airborne_query_errors_total", "Statements that raised, by query constant and error.",
+        ("query", "error"))
+    CONNECTION_ACQUIRE_SECONDS = Histogram(
+        "airborne_db_connection_acquire_seconds", "Time to check a connection out of the pool.",
+        buckets=LATENCY_BUCKETS)
+    CONNECTION_ERRORS = Counter(
+        "airborne_db_connection_errors_total", "Failed connection checkouts, by error.", ("error",))
+    CONNECTIONS_IN_USE = Gauge(
+        "airborne_db_connections_in_use", "Connections checked out of the pool.",
+        multiprocess_mode="livesum")
+
+
+def _query_names():
+    exact, prefixes = {}, []
+    for name, value in vars(queries).items():
+        if not name.isupper() or not isinstance(value, str):
+            continue
+        exact[value] = name
+        # Templates (str.format placeholders, execute_values' VALUES %s)
+        # are matched on the text before their first placeholder.
+        cut = min((i for i in (value.find("{"), value.find("VALUES %s")) if i >= 0), default=-1)
+        if cut >= MIN_PREFIX:
+            prefixes.append((value[:cut].lstrip(), name))
+    prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+    return exact, prefixes
+
+
+_EXACT_NAMES, _PREFIX_NAMES = _query_names()
+_names = {}
+_names_lock = threading.Lock()
+
+
+def query_name(query):
+    """The metrics label for `query` (str, bytes or psycopg2.sql object)."""
+    name = getattr(query, "name", None)
+    if name:
+        return name
+    if isinstance(query, bytes):
+        query = query[:512].decode(errors="replace")
+    elif not isinstance(query, str):
+        return "other"
+    name = _names.get(query)
+    if name is not None:
+        return name
+    name = _EXACT_NAMES.get(query)
+    if name is None:
+        stripped = query.lstrip()
+        name = next((n for prefix, n in _PREFIX_NAMES if stripped.startswith(prefix)), "other")
+    with _names_lock:
+        # Bounded: execute_values batches are all different strings.
+        if len(_names) < 2048:
+            _names[query] = name
+    return name
+
+
+_query_metrics = {}
+
+
+def _metrics_for(name):
+    # labels() takes a lock and builds a key on every call; the set of
+    # query names is small, so keep the children.
+    children = _query_metrics.get(name)
+    if children is None:
+        children = _query_metrics[name] = (QUERY_SECONDS.labels(name), QUERY_ROWS.labels(name))
+    return children
+
+
+def _record_statement(cursor, query, vars, seconds, error):
+    name = query_name(query)
+    duration, rows = _metrics_for(name)
+    duration.observe(seconds)
+    if error is not None:
+        QUERY_ERRORS.labels(name, type(error).__name__).inc()
+    # Named cursors only know their row count once fetched.
+    elif cursor.description is not None and cursor.rowcount > 0:
+        rows.inc(cursor.rowcount)
+
+
+def _record_checkout(seconds, error):
+    if error is not None:
+        CONNECTION_ERRORS.labels(type(error).__name__).inc()
+        return
+    CONNECTION_ACQUIRE_SECONDS.observe(seconds)
+    CONNECTIONS_IN_USE.inc()
+
+
+def _record_release():
+    CONNECTIONS_IN_USE.dec()
+
+
+if metrics_enabled():
+    on_statement(_record_statement)
+    on_checkout(_record_checkout)
+    on_release(_record_release)
+
+
+def _endpoint():
+    return request.url_rule.endpoint if request.url_rule is not None else "unmatched"
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _record_response(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        REQUEST_SECONDS.labels(_endpoint(), request.method, str(response.status_code)).observe(
+            time.perf_counter() - started)
+    return response
+
+
+def _record_exception(exc):
+    if exc is None:
+        return
+    REQUEST_EXCEPTIONS.labels(_endpoint(), type(exc).__name__).inc()
+    # Normally the 500 response went through _record_response already.
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        REQUEST_SECONDS.labels(_endpoint(), request.method, "500").observe(time.perf_counter() - started)
+
+
+def render():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry)
+
+
+def init_app(app):
+    if not metrics_enabled():
+        return
+    app.before_request(_start_timer)
+    app.after_request(_record_response)
+    app.teardown_request(_record_exception)
+    app.add_url_rule("/metrics", "metrics", lambda: Response(render(), content_type=prometheus_client.CONTENT_TYPE_LATEST))
+
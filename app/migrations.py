@@ -0,0 +1,127 @@
+"""
+Versioned schema migrations.
+
+Each entry in MIGRATIONS is (version, description, sql) and runs at most once
+per database, in version order. Applied versions are recorded in
+schema_migrations so request handlers can assume the schema exists.
+Append new migrations to the end of the list; never edit an applied one.
+"""
+import click
+
+from app import conditional, latest, partitions, rollups, stream
+from app.database import get_connection
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+# Serializes migrations across gunicorn workers/instances starting together.
+MIGRATIONS_LOCK_ID = 7_264_001
+
+MIGRATIONS = [
+    (1, "create sensors table", """
+CREATE TABLE IF NOT EXISTS sensors (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    name TEXT NOT NULL,
+    latitude DOUBLE PRECISION DEFAULT NULL,
+    longitude DOUBLE PRECISION DEFAULT NULL
+);
+"""),
+    (2, "create data table", """
+CREATE TABLE IF NOT EXISTS data (
+    sensor_id UUID,
+    temperature DOUBLE PRECISION DEFAULT NULL,
+    humidity DOUBLE PRECISION DEFAULT NULL,
+    pm25 DOUBLE PRECISION DEFAULT NULL,
+    tvoc DOUBLE PRECISION DEFAULT NULL,
+    co2 DOUBLE PRECISION DEFAULT NULL,
+    date TIMESTAMP,
+    FOREIGN KEY (sensor_id) REFERENCES sensors (id) ON DELETE CASCADE
+);
+"""),
+    (3, "create users table", """
+CREATE TABLE IF NOT EXISTS users (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+"""),
+    (4, "create user_data table", """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id UUID,
+    temperature DOUBLE PRECISION DEFAULT NULL,
+    humidity DOUBLE PRECISION DEFAULT NULL,
+    pm25 DOUBLE PRECISION DEFAULT NULL,
+    tvoc DOUBLE PRECISION DEFAULT NULL,
+    co2 DOUBLE PRECISION DEFAULT NULL,
+    date TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+"""),
+    (5, "index readings by sensor/user and time", """
+CREATE INDEX IF NOT EXISTS data_sensor_id_date_idx ON data (sensor_id, date);
+CREATE INDEX IF NOT EXISTS user_data_user_id_date_idx ON user_data (user_id, date);
+"""),
+    (6, "hourly/daily rollups maintained by insert triggers", rollups.schema_sql()),
+    (7, "latest reading per sensor maintained by an insert trigger", latest.schema_sql()),
+    (8, "record the source sensor of user snapshots", """
+ALTER TABLE user_data ADD COLUMN IF NOT EXISTS sensor_id UUID DEFAULT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS user_data_snapshot_idx
+    ON user_data (user_id, sensor_id, date) WHERE sensor_id IS NOT NULL;
+"""),
+    (9, "partition data and user_data by month", partitions.schema_sql()),
+    (10, "index sensor names and locations for the registry filters", """
+CREATE INDEX IF NOT EXISTS sensors_name_prefix_idx ON sensors (name text_pattern_ops);
+CREATE INDEX IF NOT EXISTS sensors_location_idx ON sensors USING gist (point(longitude, latitude));
+"""),
+    (11, "last ingest time per sensor/user for HTTP validators", conditional.schema_sql()),
+    (12, "notify listeners of new readings", stream.schema_sql()),
+    (13, "notify workers of last ingest changes", conditional.notify_sql()),
+]
+
+
+def current_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations;")
+    return cursor.fetchone()["version"]
+
+
+def migrate(target=None):
+    """
+    Apply every pending migration up to `target` (default: latest) and
+    return the list of versions applied. Each migration commits on its own.
+    """
+    applied = []
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(CREATE_MIGRATIONS_TABLE)
+            conn.commit()
+            cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATIONS_LOCK_ID,))
+            try:
+                version = current_version(cursor)
+                for number, description, sql in sorted(MIGRATIONS, key=lambda m: m[0]):
+                    if number <= version or (target is not None and number > target):
+                        continue
+                    cursor.execute(sql)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                        (number, description))
+                    conn.commit()
+                    applied.append(number)
+            finally:
+                conn.rollback()
+                cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATIONS_LOCK_ID,))
+    return applied
+
+
+@click.command("migrate")
+@click.option("--target", type=int, default=None, help="Stop after this schema version.")
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    applied = migrate(target)
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        click.echo(f"Schema is up to date (version {MIGRATIONS[-1][0]}).")
@@ -0,0 +1,134 @@
+"""
+Monthly range partitioning of data and user_data on their date column.
+
+Each table has one partition per calendar month (<table>_YYYY_MM) and a
+<table>_default partition that catches NULL dates and months that have no
+partition yet. ensure_partitions() (run at startup and by
+`flask ensure-partitions`) creates partitions for the current month and
+PARTITION_MONTHS_AHEAD months after it, and gives any month found in the
+default partition its own partition, moving those rows over.
+
+Rows are moved by inserting into the partition itself, not the parent, so
+the statement-level rollup/latest triggers on the parent do not count
+them a second time.
+"""
+import os
+
+import click
+
+from app.database import get_connection
+
+PARTITIONED_TABLES = ("data", "user_data")
+# Keeps workers starting together from racing to create the same partition.
+PARTITIONS_LOCK_ID = 7_264_002
+
+CREATE_PARTITION_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent TEXT, target_month DATE) RETURNS BOOLEAN AS $$
+DECLARE
+    month_start DATE := date_trunc('month', target_month)::date;
+    month_end DATE := (date_trunc('month', target_month) + INTERVAL '1 month')::date;
+    partition_name TEXT := format('%s_%s', parent, to_char(target_month, 'YYYY_MM'));
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', partition_name, parent);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM %I WHERE date >= %L AND date < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        parent || '_default', month_start, month_end, partition_name);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        parent, partition_name, month_start, month_end);
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent TEXT, months_ahead INTEGER) RETURNS INTEGER AS $$
+DECLARE
+    target_month DATE;
+    created INTEGER := 0;
+BEGIN
+    FOR target_month IN EXECUTE format(
+        'SELECT generate_series(date_trunc(''month'', NOW()), '
+        'date_trunc(''month'', NOW()) + make_interval(months => %s), INTERVAL ''1 month'')::date '
+        'UNION SELECT date_trunc(''month'', date)::date FROM %I WHERE date IS NOT NULL',
+        months_ahead, parent || '_default')
+    LOOP
+        IF create_monthly_partition(parent, target_month) THEN
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def convert_table_sql(table, indexes, triggers):
+    """
+    Swap `table` for a partitioned copy: partitions for every month present
+    in the old rows plus the default partition, copy the rows, then recreate
+    `indexes` and `triggers` (both lists of SQL) on the new parent. The
+    triggers are created after the copy so existing rows are not re-counted
+    by the rollups.
+    """
+    old = f"{table}_unpartitioned"
+    return f"""
+ALTER TABLE {table} RENAME TO {old};
+CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (date);
+CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;
+SELECT create_monthly_partition('{table}', month)
+FROM (SELECT DISTINCT date_trunc('month', date)::date AS month FROM {old} WHERE date IS NOT NULL) months;
+INSERT INTO {table} SELECT * FROM {old};
+DROP TABLE {old};
+""" + "".join(indexes) + "".join(triggers)
+
+
+def schema_sql():
+    return CREATE_PARTITION_FUNCTIONS + convert_table_sql(
+        "data",
+        indexes=[
+            "ALTER TABLE data ADD FOREIGN KEY (sensor_id) REFERENCES sensors (id) ON DELETE CASCADE;\n",
+            "CREATE INDEX data_sensor_id_date_idx ON data (sensor_id, date);\n",
+        ],
+        triggers=[
+            "CREATE TRIGGER data_rollups AFTER INSERT ON data REFERENCING NEW TABLE AS new_rows "
+            "FOR EACH STATEMENT EXECUTE FUNCTION data_rollups_after_insert();\n",
+            "CREATE TRIGGER data_latest AFTER INSERT ON data REFERENCING NEW TABLE AS new_rows "
+            "FOR EACH STATEMENT EXECUTE FUNCTION data_latest_after_insert();\n",
+        ],
+    ) + convert_table_sql(
+        "user_data",
+        indexes=[
+            "ALTER TABLE user_data ADD FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE;\n",
+            "CREATE INDEX user_data_user_id_date_idx ON user_data (user_id, date);\n",
+            "CREATE UNIQUE INDEX user_data_snapshot_idx ON user_data (user_id, sensor_id, date) "
+            "WHERE sensor_id IS NOT NULL;\n",
+        ],
+        triggers=[
+            "CREATE TRIGGER user_data_rollups AFTER INSERT ON user_data REFERENCING NEW TABLE AS new_rows "
+            "FOR EACH STATEMENT EXECUTE FUNCTION user_data_rollups_after_insert();\n",
+        ],
+    )
+
+
+def ensure_partitions(months_ahead=None):
+    """Create upcoming monthly partitions. Returns {table: partitions created}."""
+    if months_ahead is None:
+        months_ahead = int(os.environ.get("PARTITION_MONTHS_AHEAD", 3))
+    created = {}
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s);", (PARTITIONS_LOCK_ID,))
+            for table in PARTITIONED_TABLES:
+                cursor.execute("SELECT ensure_monthly_partitions(%s, %s) AS created;", (table, months_ahead))
+                created[table] = cursor.fetchone()["created"]
+    return created
+
+
+@click.command("ensure-partitions")
+@click.option("--months-ahead", type=int, default=None, help="Months after the current one to create.")
+def ensure_partitions_command(months_ahead):
+    """Create upcoming monthly partitions for data and user_data."""
+    for table, count in ensure_partitions(months_ahead).items():
+        click.echo(f"{table}: {count} partitions created")
@@ -0,0 +1,295 @@
+"""
+Query plan checks for the time-window aggregate queries.
+
+`flask check-plans` EXPLAINs the queries app.aggregation builds for each
+scope and a representative set of bucket widths and functions, with
+sequential scans disabled, and fails unless the readings and rollup tables
+are read through an index whose condition bounds both the id and the
+date/bucket, i.e. if a query change made the time range non-sargable again.
+
+The sensor registry filters (name prefix, bounding box) are checked the
+same way against the sensors table.
+
+It also EXPLAINs the queries that filter raw data/user_data by a recent
+time window, and the aggregations above (whose minute and percentile
+queries read raw rows, as does the rollup path for a partial last
+hour/day), and fails if any partition for a month before the window is
+still scanned, i.e. if partition pruning stopped working.
+
+Finally it runs the 7-day and hourly dashboard aggregations next to the
+original full-join queries they replaced, on the same ranges and snapshot,
+for the most recently active sensors and users and an id without readings,
+and fails unless both return the same buckets (empty ones as 0) and values.
+It also compares rollup-backed aggregations whose end falls inside an
+hour/day with the same aggregate over raw rows, so a partial edge bucket
+cannot pick up readings from after the end.
+"""
+import math
+import re
+import uuid
+from datetime import timedelta
+
+import click
+from psycopg2 import sql
+
+from app import queries
+from app.aggregation import (SCOPES, aggregate, build_fleet_query, build_query, last_7_days, local_now,
+                             query_params, today_hourly, truncate)
+from app.database import get_connection
+from app.rollups import METRICS
+
+# Also matches partitions (data_2024_05, data_default).
+SEQ_SCAN_ON_READINGS = re.compile(r"Seq Scan on (?:data|user_data|\w+_rollups)\w*")
+INDEX_COND = re.compile(r"Index Cond: (.*)")
+PARTITION_SCAN = re.compile(r" on (?:data|user_data)_(\d{4})_(\d{2})\b")
+
+# (bucket, function, range) combinations covering the rollup and raw-row paths.
+AGGREGATIONS = (
+    ("hour", "avg", timedelta(days=1)),
+    ("day", "avg", timedelta(days=7)),
+    ("week", "max", timedelta(days=28)),
+    ("minute", "avg", timedelta(hours=6)),
+    ("hour", "percentile", timedelta(days=1)),
+)
+
+# Queries on raw readings restricted to a recent window, whose start they
+# take as their second parameter; the first is a sensor id (an array of
+# them for FLEET_ queries).
+PRUNED_QUERIES = ("SENSOR_RECENT_AVERAGES", "SENSOR_RECENT_READINGS", "FLEET_LAST_10_AVG")
+PRUNED_WINDOW = timedelta(minutes=10)
+
+# The dashboard queries as they were before they were range-bounded: raw
+# rows joined onto the series by DATE()/DATE_TRUNC(), empty buckets as 0.
+REFERENCE_DAILY = """
+WITH days AS (
+    SELECT generate_series(%(first)s::date, %(last)s::date, '1 day'::interval)::date AS day
+)
+SELECT days.day AS bucket, {averages}
+FROM days
+LEFT JOIN {table} readings ON DATE(readings.date) = days.day AND readings.{key} = %(id)s
+GROUP BY days.day
+ORDER BY days.day;
+"""
+REFERENCE_HOURLY = """
+WITH hours AS (
+    SELECT generate_series(%(first)s::timestamp, %(last)s::timestamp, '1 hour'::interval) AS hour
+)
+SELECT hours.hour AS bucket, {averages}
+FROM hours
+LEFT JOIN {table} readings ON DATE_TRUNC('hour', readings.date) = hours.hour AND readings.{key} = %(id)s
+GROUP BY hours.hour
+ORDER BY hours.hour;
+"""
+# Raw-row aggregation over [first, end) the rollup paths must agree with.
+REFERENCE_EDGE = """
+SELECT DATE_TRUNC(%(bucket)s, date) AS bucket, {values}
+FROM {table}
+WHERE {key} = %(id)s AND date >= %(first)s AND date < %(end)s
+GROUP BY 1
+ORDER BY 1;
+"""
+EDGE_BUCKETS = ("hour", "day")
+EDGE_FUNCTIONS = ("avg", "min", "max", "count")
+EDGE_RANGE = timedelta(days=3)
+# Most recently active ids per scope whose dashboards are compared.
+OUTPUT_SAMPLE = 5
+
+
+def explain(cursor, query, params):
+    if isinstance(query, str):
+        query = sql.SQL(query)
+    cursor.execute(sql.SQL("EXPLAIN ") + query, params)
+    return "\n".join(row["QUERY PLAN"] for row in cursor.fetchall())
+
+
+def check_plans():
+    """
+    Return {"<scope> [fleet] <bucket> <function>": (ok, plan_text)} for every
+    aggregation, single-id and fleet-wide.
+    """
+    results = {}
+    probe_id = str(uuid.uuid4())
+    end = local_now()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Small or empty tables are cheaper to scan; forbid that so the
+            # check answers "can this query use an index", not "will it today".
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            for scope in SCOPES:
+                for bucket, function, span in AGGREGATIONS:
+                    query = build_query(scope, ["pm25", "co2"], bucket, function)
+                    params = query_params(probe_id, end - span, end, bucket, percentile=0.5)
+                    plan = explain(cursor, query, params)
+                    ok = SEQ_SCAN_ON_READINGS.search(plan) is None and _bounds_date(plan)
+                    results[f"{scope} {bucket} {function}"] = (ok, plan)
+
+                    query = build_fleet_query(scope, ["pm25", "co2"], bucket, function)
+                    params["ids"] = [probe_id, str(uuid.uuid4())]
+                    plan = explain(cursor, query, params)
+                    ok = SEQ_SCAN_ON_READINGS.search(plan) is None and _bounds_date(plan)
+                    results[f"{scope} fleet {bucket} {function}"] = (ok, plan)
+            conn.rollback()
+    return results
+
+
+def check_registry():
+    """Return {name: (ok, plan_text)} for the GET /api/sensor filters."""
+    filters = {
+        "SENSORS_FILTER_NAME_PREFIX": (queries.SENSORS_FILTER_NAME_PREFIX, ["probe%"]),
+        "SENSORS_FILTER_BBOX": (queries.SENSORS_FILTER_BBOX, [-80.0, 43.0, -79.0, 44.0]),
+    }
+    results = {}
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off;")
+            for name, (condition, params) in filters.items():
+                query = queries.SENSORS_LIST.format(conditions=condition, limit=" LIMIT %s")
+                plan = explain(cursor, query, params + [100])
+                results[name] = ("Seq Scan on sensors" not in plan and "Index Cond" in plan, plan)
+            conn.rollback()
+    return results
+
+
+def _stale_partitions(plan, floor):
+    """Partitions scanned in `plan` for a month before (year, month) `floor`."""
+    return [(int(y), int(m)) for y, m in PARTITION_SCAN.findall(plan) if (int(y), int(m)) < floor]
+
+
+def check_pruning():
+    """
+    Return {name: (ok, plan_text)} for every PRUNED_QUERIES entry and every
+    AGGREGATIONS entry, single-id and fleet-wide.
+    """
+    results = {}
+    probe_id = str(uuid.uuid4())
+    end = local_now()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT date_trunc('month', NOW() - INTERVAL '1 day')::date AS floor;")
+            floor = cursor.fetchone()["floor"]
+            for name in PRUNED_QUERIES:
+                ids = [probe_id] if name.startswith("FLEET_") else probe_id
+                plan = explain(cursor, getattr(queries, name), (ids, end - PRUNED_WINDOW))
+                results[name] = (not _stale_partitions(plan, (floor.year, floor.month)), plan)
+
+            for scope in SCOPES:
+                for bucket, function, span in AGGREGATIONS:
+                    params = query_params(probe_id, end - span, end, bucket, percentile=0.5)
+                    params["ids"] = [probe_id]
+                    floor = (params["start"].year, params["start"].month)
+                    for fleet, query in (("", build_query(scope, ["pm25", "co2"], bucket, function)),
+                                         ("fleet ", build_fleet_query(scope, ["pm25", "co2"], bucket, function))):
+                        plan = explain(cursor, query, params)
+                        results[f"{scope} {fleet}{bucket} {function} pruning"] = (
+                            not _stale_partitions(plan, floor), plan)
+            conn.rollback()
+    return results
+
+
+def _reference(cursor, template, scope, scope_id, first, last):
+    averages = sql.SQL(", ").join(
+        sql.SQL("COALESCE(AVG(readings.{0}), 0) AS {0}").format(sql.Identifier(m)) for m in METRICS)
+    query = sql.SQL(template).format(averages=averages, table=sql.Identifier(SCOPES[scope]["table"]),
+                                     key=sql.Identifier(SCOPES[scope]["key"]))
+    cursor.execute(query, {"id": scope_id, "first": first, "last": last})
+    return [(row["bucket"], *(row[m] for m in METRICS)) for row in cursor.fetchall()]
+
+
+def _differences(expected, actual):
+    """Lines describing where two lists of (bucket, *values) rows differ; empty if they match."""
+    if len(expected) != len(actual):
+        return [f"{len(expected)} buckets expected, got {len(actual)}"]
+    lines = []
+    for old, new in zip(expected, actual):
+        same = old[0] == new[0] and all(
+            a == b or (a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9))
+            for a, b in zip(old[1:], new[1:]))
+        if not same:
+            lines.append(f"expected {old}, got {new}")
+    return lines
+
+
+def _edge_differences(cursor, scope, scope_id, end):
+    """Differences between aggregate() and REFERENCE_EDGE over a range ending at `end`."""
+    lines = []
+    for bucket in EDGE_BUCKETS:
+        first = truncate(end - EDGE_RANGE, bucket)
+        for function in EDGE_FUNCTIONS:
+            values = sql.SQL(", ").join(
+                sql.SQL("{}({}) AS {}").format(sql.SQL(function.upper()), sql.Identifier(m), sql.Identifier(m))
+                for m in METRICS)
+            cursor.execute(sql.SQL(REFERENCE_EDGE).format(
+                values=values, table=sql.Identifier(SCOPES[scope]["table"]),
+                key=sql.Identifier(SCOPES[scope]["key"])),
+                {"bucket": bucket, "id": scope_id, "first": first, "end": end})
+            expected = [(row["bucket"], *(row[m] for m in METRICS)) for row in cursor.fetchall()]
+            actual = aggregate(scope, scope_id, METRICS, first, end, bucket=bucket, function=function,
+                               fill="none", cursor=cursor, tuples=True)
+            actual = [(b.replace(tzinfo=None), *values) for b, *values in actual]
+            lines += [f"{bucket} {function}: {line}" for line in _differences(expected, actual)]
+    return lines
+
+
+def check_outputs():
+    """
+    Return {"<scope> <id> <daily|hourly|edge> output": (ok, differences)}
+    comparing the dashboard aggregations with REFERENCE_DAILY /
+    REFERENCE_HOURLY, and aggregations ending just before each id's newest
+    reading with REFERENCE_EDGE.
+    """
+    results = {}
+    week, today = last_7_days(), today_hourly()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            # Both sides must see the same rows, whatever is ingested meanwhile.
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ;")
+            for scope, config in SCOPES.items():
+                cursor.execute(sql.SQL(
+                    "SELECT {key} AS id, MAX(date) AS newest FROM {table} WHERE date >= %s AND {key} IS NOT NULL "
+                    "GROUP BY 1 ORDER BY MAX(date) DESC LIMIT %s;").format(
+                        key=sql.Identifier(config["key"]), table=sql.Identifier(config["table"])),
+                    (week[0], OUTPUT_SAMPLE))
+                newest = {str(row["id"]): row["newest"] for row in cursor.fetchall()}
+                newest[str(uuid.uuid4())] = local_now()
+                for scope_id, last in newest.items():
+                    # Just before the newest reading, so the edge hour/day has rows past the end.
+                    differences = _edge_differences(cursor, scope, scope_id, last - timedelta(seconds=1))
+                    results[f"{scope} {scope_id} edge output"] = (not differences, "\n".join(differences))
+                    for name, template, (start, end), bucket, step in (
+                            ("daily", REFERENCE_DAILY, week, "day", timedelta(days=1)),
+                            ("hourly", REFERENCE_HOURLY, today, "hour", timedelta(hours=1))):
+                        expected = _reference(cursor, template, scope, scope_id, start, end - step)
+                        if bucket == "day":
+                            expected = [(day.isoformat(), *values) for day, *values in expected]
+                        actual = aggregate(scope, scope_id, METRICS, start, end, bucket=bucket, fill="zero",
+                                           cursor=cursor, tuples=True)
+                        actual = [(b.replace(tzinfo=None).date().isoformat() if bucket == "day"
+                                   else b.replace(tzinfo=None), *values) for b, *values in actual]
+                        differences = _differences(expected, actual)
+                        results[f"{scope} {scope_id} {name} output"] = (not differences, "\n".join(differences))
+            conn.rollback()
+    return results
+
+
+def _bounds_date(plan):
+    conditions = [c for c in INDEX_COND.findall(plan) if "sensor_id" in c or "user_id" in c]
+    return bool(conditions) and all("date" in c or "bucket" in c for c in conditions)
+
+
+@click.command("check-plans")
+@click.option("--verbose", is_flag=True, help="Print every plan, not just failing ones.")
+def check_plans_command(verbose):
+    """
+    Fail if a time-window query cannot use the indexes or partition pruning,
+    or if a dashboard aggregation returns different rows than the original query.
+    """
+    failed = []
+    results = {**check_plans(), **check_registry(), **check_pruning(), **check_outputs()}
+    for name, (ok, plan) in results.items():
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {name}")
+        if verbose or not ok:
+            click.echo(plan)
+        if not ok:
+            failed.append(name)
+    if failed:
+        raise click.ClickException(f"{len(failed)} checks failed; see the plans and differences above.")
@@ -1,51 +1,11 @@
-CREATE_SENSORS_TABLE = """
-CREATE TABLE IF NOT EXISTS sensors (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    name TEXT NOT NULL,
-    latitude DOUBLE PRECISION DEFAULT NULL,
-    longitude DOUBLE PRECISION DEFAULT NULL
-);
-"""
-CREATE_DATA_TABLE = """
-CREATE TABLE IF NOT EXISTS data (
-    sensor_id UUID,
-    temperature DOUBLE PRECISION DEFAULT NULL,
-    humidity DOUBLE PRECISION DEFAULT NULL,
-    pm25 DOUBLE PRECISION DEFAULT NULL,
-    tvoc DOUBLE PRECISION DEFAULT NULL,
-    co2 DOUBLE PRECISION DEFAULT NULL,
-    date TIMESTAMP,
-    FOREIGN KEY (sensor_id) REFERENCES sensors (id) ON DELETE CASCADE
-);
-"""
-CREATE_USERS_TABLE = """
-CREATE TABLE IF NOT EXISTS users (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
-);
-"""
-CREATE_USER_DATA_TABLE = """
-CREATE TABLE IF NOT EXISTS user_data (
-    user_id UUID,
-    temperature DOUBLE PRECISION DEFAULT NULL,
-    humidity DOUBLE PRECISION DEFAULT NULL,
-    pm25 DOUBLE PRECISION DEFAULT NULL,
-    tvoc DOUBLE PRECISION DEFAULT NULL,
-    co2 DOUBLE PRECISION DEFAULT NULL,
-    date TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-);
-"""
-
-
-
 INSERT_SENSOR_RETURN_ID = """
 INSERT INTO sensors (name, latitude, longitude) 
 VALUES (%s, %s, %s) 
 RETURNING id;
 """
 INSERT_DATA = "INSERT INTO data (sensor_id, temperature, humidity, pm25, tvoc, co2, date) VALUES (%s, %s, %s, %s, %s, %s, %s);"
+# Multi-row form for psycopg2.extras.execute_values; %s expands to the VALUES list.
+INSERT_DATA_VALUES = "INSERT INTO data (sensor_id, temperature, humidity, pm25, tvoc, co2, date) VALUES %s;"
 
 INSERT_USER_RETURN_ID = """
 INSERT INTO users (username, password) 
@@ -53,24 +13,42 @@ VALUES (%s, %s)
 RETURNING id;
 """
 
-INSERT_USER_DATA = """
-INSERT INTO user_data (user_id, temperature, humidity, pm25, tvoc, co2, date)
-VALUES (%s, %s, %s, %s, %s, %s, %s);
+# Multi-row form for psycopg2.extras.execute_values; duplicate snapshots of
+# the same sensor reading hit the unique (user_id, sensor_id, date) index.
+INSERT_USER_SNAPSHOTS = """
+INSERT INTO user_data (user_id, sensor_id, temperature, humidity, pm25, tvoc, co2, date)
+VALUES %s
+ON CONFLICT DO NOTHING;
 """
 
 
 
+EXISTING_SENSOR_IDS = "SELECT id FROM sensors WHERE id = ANY(%s::uuid[]);"
+EXISTING_USER_IDS = "SELECT id FROM users WHERE id = ANY(%s::uuid[]);"
+
 SENSOR_DETAILS_QUERY = "SELECT name, latitude, longitude FROM sensors WHERE id = %s;"
 
-SENSOR_LAST_10_TEMP_AVG = """
-SELECT AVG(temperature) as average 
-FROM data 
-WHERE sensor_id = %s AND date >= NOW() - INTERVAL '10 minutes';
+# Registry listing: SENSORS_LIST with any of the SENSORS_FILTER_* conditions
+# (AND-ed, each index-backed) in place of {conditions}, ordered by id for
+# keyset pagination.
+SENSORS_LIST = "SELECT id, name, latitude, longitude FROM sensors WHERE {conditions} ORDER BY id{limit};"
+SENSORS_FILTER_AFTER = "id > %s"
+SENSORS_FILTER_NAME_PREFIX = "name LIKE %s"
+SENSORS_FILTER_BBOX = "point(longitude, latitude) <@ box(point(%s, %s), point(%s, %s))"
+
+# Recent windows take their start (local_now() - N minutes) as a parameter.
+SENSOR_RECENT_AVERAGES = """
+SELECT COUNT(*) AS readings,
+       AVG(temperature) AS temperature, AVG(humidity) AS humidity,
+       AVG(pm25) AS pm25, AVG(tvoc) AS tvoc, AVG(co2) AS co2
+FROM data
+WHERE sensor_id = %s AND date >= %s;
 """
-SENSOR_LAST_10_HUMIDITY_AVG = """
-SELECT AVG(humidity) as average 
-FROM data 
-WHERE sensor_id = %s AND date >= NOW() - INTERVAL '10 minutes';
+SENSOR_RECENT_READINGS = """
+SELECT date, temperature, humidity, pm25, tvoc, co2
+FROM data
+WHERE sensor_id = %s AND date >= %s
+ORDER BY date;
 """
 # SENSOR_PM25_LAST_7_DAYS_AVG = """
 # SELECT DATE(date) AS day, AVG(pm25) AS average_pm25
@@ -81,204 +59,56 @@ WHERE sensor_id = %s AND date >= NOW() - INTERVAL '10 minutes';
 # ORDER BY day DESC;
 # """
 
-SENSOR_PM25_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                      
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(data.pm25), 0) AS average_pm25
-FROM last_7_days
-LEFT JOIN data ON DATE(data.date) = last_7_days.day AND data.sensor_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-USER_PM25_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                       
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(user_data.pm25), 0) AS average_pm25
-FROM last_7_days
-LEFT JOIN user_data ON DATE(user_data.date) = last_7_days.day AND user_data.user_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-
-
-SENSOR_TVOC_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                      
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(data.tvoc), 0) AS average_tvoc
-FROM last_7_days
-LEFT JOIN data ON DATE(data.date) = last_7_days.day AND data.sensor_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-USER_TVOC_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                       
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(user_data.tvoc), 0) AS average_tvoc
-FROM last_7_days
-LEFT JOIN user_data ON DATE(user_data.date) = last_7_days.day AND user_data.user_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-
-SENSOR_CO2_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                      
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(data.co2), 0) AS average_co2
-FROM last_7_days
-LEFT JOIN data ON DATE(data.date) = last_7_days.day AND data.sensor_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-
-USER_CO2_LAST_7_DAYS_AVG = """
-WITH last_7_days AS (
-    SELECT generate_series(
-        (NOW() - INTERVAL '4 hours')::date - INTERVAL '6 days',  
-        (NOW() - INTERVAL '4 hours')::date,                       
-        '1 day'::interval
-    )::date AS day
-)
-SELECT last_7_days.day, COALESCE(AVG(user_data.co2), 0) AS average_co2
-FROM last_7_days
-LEFT JOIN user_data ON DATE(user_data.date) = last_7_days.day AND user_data.user_id = %s
-GROUP BY last_7_days.day
-ORDER BY last_7_days.day DESC;
-"""
-
-
-
-PM25_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(d.pm25), 0) AS avg_pm25
-FROM hours
-LEFT JOIN data d ON DATE_TRUNC('hour', d.date) = hours.hour
-AND d.sensor_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
-"""
-
-USER_PM25_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(ud.pm25), 0) AS avg_pm25
-FROM hours
-LEFT JOIN user_data ud ON DATE_TRUNC('hour', ud.date) = hours.hour
-AND ud.user_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
-"""
-
-
-TVOC_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(d.tvoc), 0) AS avg_tvoc
-FROM hours
-LEFT JOIN data d ON DATE_TRUNC('hour', d.date) = hours.hour
-AND d.sensor_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
-"""
-
-USER_TVOC_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(ud.tvoc), 0) AS avg_tvoc
-FROM hours
-LEFT JOIN user_data ud ON DATE_TRUNC('hour', ud.date) = hours.hour
-AND ud.user_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
+SENSOR_LATEST_READING = """
+SELECT temperature, humidity, pm25, tvoc, co2, date
+FROM latest_readings
+WHERE sensor_id = %s;
 """
 
-
-CO2_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(d.co2), 0) AS avg_co2
-FROM hours
-LEFT JOIN data d ON DATE_TRUNC('hour', d.date) = hours.hour
-AND d.sensor_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
+# Newest readings after a date, for SSE clients resuming from Last-Event-ID.
+SENSOR_READINGS_SINCE = """
+SELECT temperature, humidity, pm25, tvoc, co2, date
+FROM data
+WHERE sensor_id = %s AND date > %s
+ORDER BY date DESC
+LIMIT %s;
 """
-
-USER_CO2_HOURLY_AVG = """
-WITH hours AS (
-    SELECT generate_series(
-        DATE_TRUNC('day', NOW() - INTERVAL '4 hours'),
-        DATE_TRUNC('hour', NOW() - INTERVAL '4 hours'),
-        INTERVAL '1 hour'
-    ) AS hour
-)
-SELECT hours.hour, COALESCE(AVG(ud.co2), 0) AS avg_co2
-FROM hours
-LEFT JOIN user_data ud ON DATE_TRUNC('hour', ud.date) = hours.hour
-AND ud.user_id = %s
-GROUP BY hours.hour
-ORDER BY hours.hour;
+LAST_INGEST = "SELECT ingested_at FROM last_ingest WHERE scope = %s AND id = %s;"
+ALL_LATEST_READINGS = """
+SELECT sensor_id, temperature, humidity, pm25, tvoc, co2, date
+FROM latest_readings;
 """
 
-
-
-
-SENSOR_LATEST_READING = """
-SELECT temperature, humidity, pm25, tvoc, co2, date
+# Raw history exports, read through a server-side cursor in date order.
+SENSOR_EXPORT = """
+SELECT date, temperature, humidity, pm25, tvoc, co2
 FROM data
-WHERE sensor_id = %s
-ORDER BY date DESC
-LIMIT 1;
+WHERE sensor_id = %s AND date >= %s AND date < %s
+ORDER BY date;
+"""
+USER_EXPORT = """
+SELECT date, sensor_id, temperature, humidity, pm25, tvoc, co2
+FROM user_data
+WHERE user_id = %s AND date >= %s AND date < %s
+ORDER BY date;
+"""
+
+# Fleet queries take a uuid[] of sensor ids (one page of them).
+FLEET_SENSOR_IDS_PAGE = "SELECT id FROM sensors WHERE id > %s ORDER BY id LIMIT %s;"
+FLEET_LATEST_READINGS = """
+SELECT sensor_id, temperature, humidity, pm25, tvoc, co2, date
+FROM latest_readings
+WHERE sensor_id = ANY(%s::uuid[])
+ORDER BY sensor_id;
+"""
+FLEET_LAST_10_AVG = """
+SELECT sensor_id, COUNT(*) AS readings,
+       AVG(temperature) AS temperature, AVG(humidity) AS humidity,
+       AVG(pm25) AS pm25, AVG(tvoc) AS tvoc, AVG(co2) AS co2
+FROM data
+WHERE sensor_id = ANY(%s::uuid[]) AND date >= %s
+GROUP BY sensor_id
+ORDER BY sensor_id;
 """
 
 
@@ -0,0 +1,129 @@
+"""
+Hourly and daily rollups of the raw readings.
+
+Each rollup row holds, per id and bucket, the number of readings plus
+sum/count/min/max for every metric (count is per metric because metrics
+are nullable). Statement-level AFTER INSERT triggers on data and user_data
+fold each inserted batch into the rollups in the same transaction, so the
+aggregate endpoints can read the rollups instead of raw rows.
+
+`flask backfill-rollups` rebuilds the rollups from raw history, e.g. after
+rows were deleted or edited by hand.
+"""
+import click
+
+from app.database import get_connection
+
+METRICS = ("temperature", "humidity", "pm25", "tvoc", "co2")
+
+# (rollup table, source table, id column, referenced table, bucket type, bucket expression)
+ROLLUPS = (
+    ("sensor_hourly_rollups", "data", "sensor_id", "sensors", "TIMESTAMP", "DATE_TRUNC('hour', date)"),
+    ("sensor_daily_rollups", "data", "sensor_id", "sensors", "DATE", "DATE(date)"),
+    ("user_hourly_rollups", "user_data", "user_id", "users", "TIMESTAMP", "DATE_TRUNC('hour', date)"),
+    ("user_daily_rollups", "user_data", "user_id", "users", "DATE", "DATE(date)"),
+)
+
+
+def create_table_sql(table, id_column, referenced, bucket_type):
+    metric_columns = "".join(
+        f"    {m}_sum DOUBLE PRECISION NOT NULL DEFAULT 0,\n"
+        f"    {m}_count BIGINT NOT NULL DEFAULT 0,\n"
+        f"    {m}_min DOUBLE PRECISION DEFAULT NULL,\n"
+        f"    {m}_max DOUBLE PRECISION DEFAULT NULL,\n"
+        for m in METRICS
+    )
+    return f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    {id_column} UUID NOT NULL,
+    bucket {bucket_type} NOT NULL,
+    readings BIGINT NOT NULL DEFAULT 0,
+{metric_columns}    PRIMARY KEY ({id_column}, bucket),
+    FOREIGN KEY ({id_column}) REFERENCES {referenced} (id) ON DELETE CASCADE
+);
+"""
+
+
+def upsert_sql(table, source, id_column, bucket):
+    """
+    INSERT ... SELECT that folds the rows of `source` into `table`. Used both
+    by the triggers (source = transition table) and by the backfill.
+    """
+    columns = ", ".join(
+        f"{m}_sum, {m}_count, {m}_min, {m}_max" for m in METRICS)
+    aggregates = ",\n        ".join(
+        f"COALESCE(SUM({m}), 0), COUNT({m}), MIN({m}), MAX({m})" for m in METRICS)
+    updates = ",\n    ".join(
+        f"{m}_sum = r.{m}_sum + EXCLUDED.{m}_sum, "
+        f"{m}_count = r.{m}_count + EXCLUDED.{m}_count, "
+        f"{m}_min = LEAST(r.{m}_min, EXCLUDED.{m}_min), "
+        f"{m}_max = GREATEST(r.{m}_max, EXCLUDED.{m}_max)"
+        for m in METRICS)
+    # ORDER BY keeps the row-lock order stable so concurrent batches that
+    # touch the same buckets cannot deadlock each other.
+    return f"""
+INSERT INTO {table} AS r ({id_column}, bucket, readings, {columns})
+SELECT {id_column}, {bucket}, COUNT(*),
+        {aggregates}
+FROM {source}
+WHERE {id_column} IS NOT NULL AND date IS NOT NULL
+GROUP BY 1, 2
+ORDER BY 1, 2
+ON CONFLICT ({id_column}, bucket) DO UPDATE SET
+    readings = r.readings + EXCLUDED.readings,
+    {updates};
+"""
+
+
+def trigger_sql(source, id_column):
+    rollups = [r for r in ROLLUPS if r[1] == source]
+    body = "".join(upsert_sql(table, "new_rows", id_column, bucket)
+                   for table, _, _, _, _, bucket in rollups)
+    return f"""
+CREATE OR REPLACE FUNCTION {source}_rollups_after_insert() RETURNS trigger AS $$
+BEGIN
+{body}
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {source}_rollups ON {source};
+CREATE TRIGGER {source}_rollups
+    AFTER INSERT ON {source}
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION {source}_rollups_after_insert();
+"""
+
+
+def schema_sql():
+    """DDL for the rollup tables and triggers, plus the initial backfill."""
+    statements = [create_table_sql(table, id_column, referenced, bucket_type)
+                  for table, _, id_column, referenced, bucket_type, _ in ROLLUPS]
+    statements += [trigger_sql("data", "sensor_id"), trigger_sql("user_data", "user_id")]
+    statements += [upsert_sql(table, source, id_column, bucket)
+                   for table, source, id_column, _, _, bucket in ROLLUPS]
+    return "".join(statements)
+
+
+def backfill_rollups():
+    """
+    Rebuild every rollup table from raw history. Inserts into data/user_data
+    are blocked while this runs so no reading is counted twice or missed.
+    Returns {rollup table: rows written}.
+    """
+    written = {}
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("LOCK TABLE data, user_data IN SHARE MODE;")
+            for table, source, id_column, _, _, bucket in ROLLUPS:
+                cursor.execute(f"DELETE FROM {table};")
+                cursor.execute(upsert_sql(table, source, id_column, bucket))
+                written[table] = cursor.rowcount
+    return written
+
+
+@click.command("backfill-rollups")
+def backfill_rollups_command():
+    """Rebuild the hourly/daily rollup tables from raw readings."""
+    for table, rows in backfill_rollups().items():
+        click.echo(f"{table}: {rows} buckets")
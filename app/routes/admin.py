@@ -0,0 +1,30 @@
+from flask import Blueprint, jsonify, request
+from app.slow_queries import slow_queries
+import hmac
+import os
+
+admin_bp = Blueprint('admin', __name__)
+
+
+@admin_bp.before_request
+def require_admin_token():
+    """
+    Admin endpoints need "Authorization: Bearer <ADMIN_TOKEN>"; without
+    ADMIN_TOKEN set they do not exist (404).
+    """
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        return jsonify({"error": "Not found."}), 404
+    scheme, _, supplied = request.headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not hmac.compare_digest(supplied.encode(), token.encode()):
+        return jsonify({"error": "Admin token required."}), 401
+    return None
+
+
+@admin_bp.route("/api/admin/slow-queries", methods=["GET"])
+def get_slow_queries():
+    """
+    This worker's most recent slow queries, newest first, with EXPLAIN
+    output for the sampled ones (null while pending or when not sampled).
+    """
+    return jsonify({**slow_queries.stats(), "entries": slow_queries.entries()}), 200
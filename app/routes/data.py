@@ -1,21 +1,52 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 from app.database import get_connection
-from app.queries import CREATE_DATA_TABLE, INSERT_DATA, SENSOR_LAST_10_TEMP_AVG, SENSOR_LAST_10_HUMIDITY_AVG, SENSOR_LATEST_READING
-from app.queries import SENSOR_PM25_LAST_7_DAYS_AVG, SENSOR_TVOC_LAST_7_DAYS_AVG, SENSOR_CO2_LAST_7_DAYS_AVG
-from app.queries import PM25_HOURLY_AVG, TVOC_HOURLY_AVG, CO2_HOURLY_AVG
-from app.queries import CREATE_USER_DATA_TABLE, INSERT_USER_DATA
-from datetime import datetime, timezone, timedelta
+from app.ingest import get_buffer, write_behind_enabled, publish
+from app.cache import cached
+from app.conditional import conditional
+from app.snapshots import snapshots
+from app.latest import latest_readings
+from app.windows import recent_windows
+from app.stream import StreamFull, backlog, event_stream, get_hub, parse_event_id
+from app.queries import INSERT_DATA
+from app.aggregation import AggregationError, aggregate, daily_chart, hourly_chart, local_now, parse_metrics, to_local
+from app.queries import INSERT_DATA_VALUES, EXISTING_SENSOR_IDS, SENSOR_DETAILS_QUERY
+from app.export import FORMATS, columnar_formats, downsampled_export, encode, export, negotiate_format
+from app.downsample import DownsampleError, downsample, parse_downsample
+from psycopg2.extras import execute_values
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import uuid
 import pytz
 
 data_bp = Blueprint('data', __name__)
 
-@data_bp.route("/api/data", methods=["POST"])
-def add_data():
-    data = request.get_json()
+BATCH_MAX_ROWS = int(os.environ.get("DATA_BATCH_MAX_ROWS", 5000))
+BATCH_PAGE_SIZE = 1000
+RECENT_MAX_MINUTES = 24 * 60
+
+def _is_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        # Also rules out ints too large for DOUBLE PRECISION.
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+def parse_reading(data):
+    """
+    Validate one reading payload. Returns (row, None) where row matches the
+    INSERT_DATA column order, or (None, error_message).
+    """
+    if not isinstance(data, dict):
+        return None, "Reading must be a JSON object"
 
     sensor_id = data.get("sensor")
     if not sensor_id:
-        return {"error": "Missing 'sensor' in payload"}, 400
+        return None, "Missing 'sensor' in payload"
 
     temperature = data.get("temperature")
     humidity = data.get("humidity")
@@ -23,91 +54,403 @@ def add_data():
     tvoc = data.get("tvoc")
     co2 = data.get("co2")
 
+    for name, value in (("temperature", temperature), ("humidity", humidity), ("pm25", pm25),
+                        ("tvoc", tvoc), ("co2", co2)):
+        if value is not None and not _is_number(value):
+            return None, f"'{name}' must be a finite number or null"
+
     try:
         date = datetime.strptime(data["date"], "%m-%d-%Y %H:%M:%S")
     except KeyError:
-        date = datetime.now(timezone.utc) - timedelta(hours=4)
+        date = local_now()
 
         # utc_now = datetime.now(timezone.utc)
         # est_tz = pytz.timezone('America/New_York')
         # date = utc_now.astimezone(est_tz)
 
     except ValueError:
-        return {"error": "Invalid 'date' format. Use '%m-%d-%Y %H:%M:%S'"}, 400
+        return None, "Invalid 'date' format. Use '%m-%d-%Y %H:%M:%S'"
+
+    return (sensor_id, temperature, humidity, pm25, tvoc, co2, date), None
+
 
+@data_bp.route("/api/data", methods=["POST"])
+def add_data():
+    data = request.get_json()
+
+    row, error = parse_reading(data)
+    if error:
+        return {"error": error}, 400
+
+    try:
+        row = (str(uuid.UUID(str(row[0]))),) + row[1:]
+    except ValueError:
+        return {"error": f"Invalid sensor id '{row[0]}'"}, 400
+
+    # Both modes refuse unknown sensors up front; the flusher would drop them.
     with get_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(CREATE_DATA_TABLE)  
-            cursor.execute(INSERT_DATA, (sensor_id, temperature, humidity, pm25, tvoc, co2, date))
+            cursor.execute(EXISTING_SENSOR_IDS, ([row[0]],))
+            if cursor.fetchone() is None:
+                return {"error": f"Unknown sensor '{row[0]}'"}, 400
+            if not write_behind_enabled():
+                cursor.execute(INSERT_DATA, row)
+
+    if write_behind_enabled():
+        if not get_buffer().offer(row):
+            return {"error": "Ingest buffer is full, retry shortly."}, 503, {"Retry-After": "1"}
+        return {"message": "Data accepted for writing."}, 202
+    publish([row])
 
     return {"message": "Data added successfully."}, 201
 
+
+@data_bp.route("/api/data/buffer", methods=["GET"])
+def get_ingest_buffer_stats():
+    """
+    Queue depth, flush latency and rows-per-flush for this worker's write-behind buffer.
+    """
+    if not write_behind_enabled():
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **get_buffer().stats()}), 200
+
+
+@data_bp.route("/api/data/stream/<uuid:sensor_id>", methods=["GET"])
+def stream_sensor_readings(sensor_id):
+    """
+    Push the sensor's new readings as Server-Sent Events (event "reading",
+    data shaped like latest_reading plus sensor_id). Starts with the latest
+    reading, or with the readings missed since Last-Event-ID on reconnect.
+    """
+    sensor_id = str(sensor_id)
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(EXISTING_SENSOR_IDS, ([sensor_id],))
+            if cursor.fetchone() is None:
+                return jsonify({"error": f"Sensor {sensor_id} not found."}), 404
+
+    hub = get_hub()
+    try:
+        subscription = hub.subscribe(sensor_id)
+    except StreamFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    try:
+        # Subscribed first, so nothing published meanwhile falls in between.
+        events = backlog(sensor_id, parse_event_id(request.headers.get("Last-Event-ID")))
+    except Exception:
+        hub.unsubscribe(subscription)
+        raise
+
+    response = Response(event_stream(subscription, events), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(lambda: hub.unsubscribe(subscription))
+    return response
+
+
+@data_bp.route("/api/data/streams", methods=["GET"])
+def get_stream_stats():
+    """
+    Open streams and the state of this worker's LISTEN connection.
+    """
+    return jsonify(get_hub().stats()), 200
+
+
+def _read_batch_payload():
+    """
+    Return a list of (index, payload_or_None, parse_error) from either a JSON
+    array body or an NDJSON body (one reading per line).
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = []
+        lines = (line for line in request.get_data(as_text=True).splitlines() if line.strip())
+        for index, line in enumerate(lines):
+            try:
+                items.append((index, json.loads(line), None))
+            except ValueError:
+                items.append((index, None, "Invalid JSON"))
+        return items
+
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get("readings")
+    if not isinstance(payload, list):
+        return None
+    return [(index, item, None) for index, item in enumerate(payload)]
+
+
+@data_bp.route("/api/data/batch", methods=["POST"])
+def add_data_batch():
+    """
+    Insert many readings (across any number of sensors) in one transaction.
+    Accepts a JSON array, {"readings": [...]}, or NDJSON. Invalid rows are
+    reported by index and skipped; valid rows are still inserted.
+    """
+    items = _read_batch_payload()
+    if items is None:
+        return jsonify({"error": "Expected a JSON array of readings or an NDJSON body."}), 400
+    if len(items) > BATCH_MAX_ROWS:
+        return jsonify({"error": f"Batch too large; at most {BATCH_MAX_ROWS} readings per request."}), 413
+
+    errors = []
+    rows = []
+    for index, payload, parse_error in items:
+        if parse_error:
+            errors.append({"index": index, "error": parse_error})
+            continue
+        row, error = parse_reading(payload)
+        if error:
+            errors.append({"index": index, "error": error})
+            continue
+        try:
+            sensor_id = str(uuid.UUID(str(row[0])))
+        except ValueError:
+            errors.append({"index": index, "error": f"Invalid sensor id '{row[0]}'"})
+            continue
+        rows.append((index, (sensor_id,) + row[1:]))
+
+    inserted = 0
+    if rows:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(EXISTING_SENSOR_IDS, (list({row[0] for _, row in rows}),))
+                known = {str(result["id"]) for result in cursor.fetchall()}
+
+                valid = []
+                for index, row in rows:
+                    if row[0] in known:
+                        valid.append(row)
+                    else:
+                        errors.append({"index": index, "error": f"Unknown sensor '{row[0]}'"})
+
+                if valid:
+                    execute_values(cursor, INSERT_DATA_VALUES, valid, page_size=BATCH_PAGE_SIZE)
+                    inserted = len(valid)
+        publish(valid)
+
+    errors.sort(key=lambda e: e["index"])
+    status = 201 if inserted else 400
+    return jsonify({
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors
+    }), status
+
+def parse_time(value):
+    """Parse an ISO 8601 or '%m-%d-%Y %H:%M:%S' query parameter as a naive timestamp."""
+    try:
+        # fromisoformat() takes no 'Z' before Python 3.11. Aware times are
+        # converted to the local wall time readings are stored in.
+        return to_local(datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value))
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%m-%d-%Y %H:%M:%S")
+    except ValueError:
+        raise AggregationError(f"Invalid time '{value}'. Use ISO 8601 or '%m-%d-%Y %H:%M:%S'.")
+
+
+@data_bp.route("/api/data/aggregate", methods=["GET"])
+@conditional("aggregate")
+def get_aggregate():
+    """
+    Aggregate one or more metrics for a sensor (?sensor=) or user (?user=)
+    over [start, end) in minute/hour/day/week buckets. Defaults to hourly
+    averages over the last 24 hours. Responds with JSON, or with Arrow or
+    Parquet (full precision) when asked for by ?format= or Accept.
+    ?points=N keeps at most N buckets, chosen to preserve the shape of the
+    series (?downsample=lttb, the default, or minmax).
+    """
+    args = request.args
+    format = negotiate_format(request, {"json": "application/json", **columnar_formats()}, default="json")
+    if format is None:
+        return jsonify({"error": f"Unknown format. Use json, {', '.join(columnar_formats())}."}), 400
+    if bool(args.get("sensor")) == bool(args.get("user")):
+        return jsonify({"error": "Pass exactly one of 'sensor' or 'user'."}), 400
+    scope = "sensor" if args.get("sensor") else "user"
+    try:
+        scope_id = str(uuid.UUID(args[scope]))
+    except ValueError:
+        return jsonify({"error": f"Invalid {scope} id '{args[scope]}'"}), 400
+
+    metrics = [m.strip() for m in args.get("metrics", "").split(",") if m.strip()]
+    bucket = args.get("bucket", "hour")
+    function = args.get("function", "avg")
+    fill = args.get("fill", "null")
+    try:
+        end = parse_time(args["end"]) if "end" in args else local_now()
+        start = parse_time(args["start"]) if "start" in args else end - timedelta(hours=24)
+        percentile = float(args["percentile"]) if "percentile" in args else None
+        points, method = parse_downsample(args)
+        results = aggregate(scope, scope_id, metrics, start, end, bucket=bucket, function=function,
+                            percentile=percentile, fill=fill, tuples=True)
+    except (AggregationError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if points:
+        results = downsample(results, points, method)
+
+    metrics = list(dict.fromkeys(metrics))
+    if format != "json":
+        mimetype, body = encode(format, ("bucket", *metrics), results)
+        return Response(body, mimetype=mimetype)
+
+    # JSON carries two decimals; binary formats keep full precision.
+    keys = ["bucket", *metrics]
+    buckets = [
+        dict(zip(keys, (row[0].isoformat(), *[round(v, 2) if v is not None else None for v in row[1:]])))
+        for row in results
+    ]
+
+    return jsonify({
+        f"{scope}_id": scope_id,
+        "bucket": bucket,
+        "function": function,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "metrics": metrics,
+        "buckets": buckets
+    }), 200
+
+
+def export_response(scope, scope_id):
+    """
+    Stream the raw readings of a sensor/user as CSV, NDJSON, Arrow or
+    Parquet, optionally restricted to ?start= and/or ?end=. With ?points=N
+    (and ?downsample=lttb|minmax) at most N readings per sensor are sent,
+    picked to keep the shape of the series.
+    """
+    format = negotiate_format(request)
+    if format is None:
+        return jsonify({"error": f"Unknown format. Use {', '.join(FORMATS)}."}), 400
+    try:
+        start = parse_time(request.args["start"]) if "start" in request.args else datetime.min
+        end = parse_time(request.args["end"]) if "end" in request.args else datetime.max
+        points, method = parse_downsample(request.args)
+    except (AggregationError, DownsampleError) as e:
+        return jsonify({"error": str(e)}), 400
+    if start >= end:
+        return jsonify({"error": "'start' must be before 'end'."}), 400
+
+    if points:
+        mimetype, filename, body = downsampled_export(scope, scope_id, start, end, points, method, format)
+        return Response(body, mimetype=mimetype, headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        })
+    mimetype, filename, chunks = export(scope, scope_id, start, end, format)
+    return Response(chunks, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Accel-Buffering": "no",
+    })
+
+
+@data_bp.route("/api/data/export/<uuid:sensor_id>", methods=["GET"])
+def export_sensor_data(sensor_id):
+    """
+    Export a sensor's raw readings (?format=csv|ndjson|arrow|parquet or by Accept header),
+    streamed in batches so any range can be exported in constant memory.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SENSOR_DETAILS_QUERY, (str(sensor_id),))
+            if not cursor.fetchone():
+                return jsonify({"error": f"Sensor with ID '{sensor_id}' not found."}), 404
+
+    return export_response("sensor", sensor_id)
+
+
 @data_bp.route("/api/data/temp/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("recent")
+@cached("recent")
 def get_sensor_avg_last_10_min(sensor_id):
     """
     Get the average temperature for a specific sensor in the last 10 minutes.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(SENSOR_LAST_10_TEMP_AVG, (str(sensor_id),))
-            result = cursor.fetchone()
+    result = recent_windows.averages(str(sensor_id), 10)
 
-    if not result or result["average"] is None:
+    if result["temperature"] is None:
         return jsonify({"error": f"No temperature data available for sensor {sensor_id} in the last 10 minutes."}), 404
 
     return jsonify({
         "sensor_id": str(sensor_id),
-        "average_temperature": round(result["average"], 2),
+        "average_temperature": round(result["temperature"], 2),
         "time_range": "10 minutes"
     }), 200
 
 @data_bp.route("/api/data/humidity/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("recent")
+@cached("recent")
 def get_sensor_humidity_avg_last_10_min(sensor_id):
     """
     Get the average humidity for a specific sensor in the last 10 minutes.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(SENSOR_LAST_10_HUMIDITY_AVG, (str(sensor_id),))
-            result = cursor.fetchone()
+    result = recent_windows.averages(str(sensor_id), 10)
 
-    if not result or result["average"] is None:
+    if result["humidity"] is None:
         return jsonify({"error": f"No humidity data available for sensor {sensor_id} in the last 10 minutes."}), 404
 
     return jsonify({
         "sensor_id": str(sensor_id),
-        "average_humidity": round(result["average"], 2),
+        "average_humidity": round(result["humidity"], 2),
         "time_range": "Last 10 minutes"
     }), 200
 
+@data_bp.route("/api/data/recent/<uuid:sensor_id>", methods=["GET"])
+@conditional("recent")
+@cached("recent")
+def get_sensor_recent_averages(sensor_id):
+    """
+    Get the averages of every metric for a specific sensor over the last
+    ?minutes= (10 by default). Lengths listed in WINDOW_MINUTES are served
+    from memory.
+    """
+    try:
+        minutes = int(request.args.get("minutes", 10))
+    except ValueError:
+        return jsonify({"error": "'minutes' must be an integer."}), 400
+    if not 1 <= minutes <= RECENT_MAX_MINUTES:
+        return jsonify({"error": f"'minutes' must be between 1 and {RECENT_MAX_MINUTES}."}), 400
+
+    result = recent_windows.averages(str(sensor_id), minutes)
+
+    if not result["readings"]:
+        return jsonify({"error": f"No data available for sensor {sensor_id} in the last {minutes} minutes."}), 404
+
+    return jsonify({
+        "sensor_id": str(sensor_id),
+        "readings": result["readings"],
+        **{f"average_{m}": round(result[m], 2) if result[m] is not None else None for m in ("temperature", "humidity", "pm25", "tvoc", "co2")},
+        "time_range": f"Last {minutes} minutes"
+    }), 200
+
+@data_bp.route("/api/data/windows", methods=["GET"])
+def get_window_stats():
+    """
+    Sensors, readings and memory/database split of this worker's recent-average windows.
+    """
+    return jsonify(recent_windows.stats()), 200
+
 @data_bp.route("/api/data/latest/<uuid:sensor_id>/<uuid:user_id>", methods=["GET"])
+@conditional("latest")
 def get_sensor_latest_reading(sensor_id, user_id):
     """
     Get the latest reading for each metric (temperature, humidity, PM2.5, TVOC, CO2) for a specific sensor.
-    Insert the latest data into the user_data table.
+    Record the latest data in the user_data table unless the user already has it.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            # Fetch the latest reading from sensor data
-            cursor.execute(SENSOR_LATEST_READING, (str(sensor_id),))
-            result = cursor.fetchone()
-
-            if not result:
-                return jsonify({"error": f"No data available for sensor {sensor_id}."}), 404
-
-            # Prepare latest data
-            latest_data = {
-                "temperature": result["temperature"],
-                "humidity": result["humidity"],
-                "pm25": result["pm25"],
-                "tvoc": result["tvoc"],
-                "co2": result["co2"],
-                "timestamp": result["date"]
-            }
-
-            cursor.execute(CREATE_USER_DATA_TABLE)
-            cursor.execute(INSERT_USER_DATA, (
-                str(user_id), result["temperature"], result["humidity"], result["pm25"], result["tvoc"], result["co2"], result["date"]))
+    result = latest_readings.get(str(sensor_id))
+    if not result:
+        return jsonify({"error": f"No data available for sensor {sensor_id}."}), 404
+
+    # Prepare latest data
+    latest_data = {
+        "temperature": result["temperature"],
+        "humidity": result["humidity"],
+        "pm25": result["pm25"],
+        "tvoc": result["tvoc"],
+        "co2": result["co2"],
+        "timestamp": result["date"]
+    }
+
+    # Recorded off the request path; repeated polls of the same reading are skipped.
+    snapshots.record(str(user_id), str(sensor_id), result)
 
     return jsonify({
         "sensor_id": str(sensor_id),
@@ -124,20 +467,17 @@ def get_sensor_latest_reading(sensor_id, user_id):
 
 # 7 day averages
 @data_bp.route("/api/data/pm25/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_sensor_pm25_avg_last_7_days(sensor_id):
     """
     Get the average PM2.5 levels per day for a specific sensor over the last 7 days.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(SENSOR_PM25_LAST_7_DAYS_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
+    pm25_data = daily_chart("sensor", sensor_id, ["pm25"])
 
-    if not results:
+    if not pm25_data:
         return jsonify({"error": f"No PM2.5 data available for sensor {sensor_id} in the last 7 days."}), 404
 
-    pm25_data = [{"date": str(row["day"]), "average_pm25": round(row["average_pm25"], 2)} for row in results]
-
     return jsonify({
         "sensor_id": str(sensor_id),
         "pm25_daily_averages": pm25_data,
@@ -145,13 +485,10 @@ def get_sensor_pm25_avg_last_7_days(sensor_id):
     }), 200
 
 @data_bp.route("/api/data/tvoc/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_sensor_tvoc_avg_last_7_days(sensor_id):
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(SENSOR_TVOC_LAST_7_DAYS_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
-
-    tvoc_data = [{"date": str(row["day"]), "average_tvoc": round(row["average_tvoc"], 2)} for row in results]
+    tvoc_data = daily_chart("sensor", sensor_id, ["tvoc"])
 
     return jsonify({
         "sensor_id": str(sensor_id),
@@ -160,13 +497,10 @@ def get_sensor_tvoc_avg_last_7_days(sensor_id):
     }), 200
 
 @data_bp.route("/api/data/co2/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_sensor_co2_avg_last_7_days(sensor_id):
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(SENSOR_CO2_LAST_7_DAYS_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
-
-    co2_data = [{"date": str(row["day"]), "average_co2": round(row["average_co2"], 2)} for row in results]
+    co2_data = daily_chart("sensor", sensor_id, ["co2"])
 
     return jsonify({
         "sensor_id": str(sensor_id),
@@ -176,14 +510,10 @@ def get_sensor_co2_avg_last_7_days(sensor_id):
 
 # Hourly averages
 @data_bp.route("/api/data/pm25/hourly/<uuid:sensor_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_pm25_avg_sensor(sensor_id):
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(PM25_HOURLY_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
-
-    # Format response
-    hourly_data = [{"hour": str(row["hour"]), "avg_pm25": round(row["avg_pm25"], 2)} for row in results]
+    hourly_data = hourly_chart("sensor", sensor_id, ["pm25"])
 
     return jsonify({
         "sensor_id": str(sensor_id),
@@ -192,15 +522,11 @@ def get_hourly_pm25_avg_sensor(sensor_id):
     }), 200
 
 @data_bp.route("/api/data/tvoc/hourly/<uuid:sensor_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_tvoc_avg_sensor(sensor_id):
 
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(TVOC_HOURLY_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
-
-    # Format response
-    hourly_data = [{"hour": str(row["hour"]), "avg_tvoc": round(row["avg_tvoc"], 2)} for row in results]
+    hourly_data = hourly_chart("sensor", sensor_id, ["tvoc"])
 
     return jsonify({
         "sensor_id": str(sensor_id),
@@ -209,18 +535,83 @@ def get_hourly_tvoc_avg_sensor(sensor_id):
     }), 200
 
 @data_bp.route("/api/data/co2/hourly/<uuid:sensor_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_co2_avg_sensor(sensor_id):
 
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(CO2_HOURLY_AVG, (str(sensor_id),))
-            results = cursor.fetchall()
-
-    # Format response
-    hourly_data = [{"hour": str(row["hour"]), "avg_co2": round(row["avg_co2"], 2)} for row in results]
+    hourly_data = hourly_chart("sensor", sensor_id, ["co2"])
 
     return jsonify({
         "sensor_id": str(sensor_id),
         "time_zone": "Eastern Time (EST/EDT)",
         "co2_hourly_averages": hourly_data
     }), 200
+
+
+@data_bp.route("/api/data/avg/<uuid:sensor_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
+def get_sensor_daily_averages(sensor_id):
+    """
+    Get the daily averages of several metrics (?metrics=pm25,tvoc,co2; all
+    by default) for a specific sensor over the last 7 days, from one query.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        daily = daily_chart("sensor", sensor_id, metrics)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "sensor_id": str(sensor_id),
+        "metrics": metrics,
+        "daily_averages": daily,
+        "time_range": "Last 7 days"
+    }), 200
+
+@data_bp.route("/api/data/hourly/<uuid:sensor_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
+def get_sensor_hourly_averages(sensor_id):
+    """
+    Get today's hourly averages of several metrics (?metrics=; all by
+    default) for a specific sensor, from one query.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        hourly = hourly_chart("sensor", sensor_id, metrics)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "sensor_id": str(sensor_id),
+        "metrics": metrics,
+        "time_zone": "Eastern Time (EST/EDT)",
+        "hourly_averages": hourly
+    }), 200
+
+@data_bp.route("/api/data/dashboard/<uuid:sensor_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
+def get_sensor_dashboard(sensor_id):
+    """
+    Get both the 7-day daily and today's hourly averages of several metrics
+    (?metrics=; all by default) for a specific sensor in one response, using
+    one connection and one query per chart.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                daily = daily_chart("sensor", sensor_id, metrics, cursor=cursor)
+                hourly = hourly_chart("sensor", sensor_id, metrics, cursor=cursor)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "sensor_id": str(sensor_id),
+        "metrics": metrics,
+        "time_zone": "Eastern Time (EST/EDT)",
+        "daily_averages": daily,
+        "hourly_averages": hourly
+    }), 200
@@ -0,0 +1,179 @@
+from flask import Blueprint, Response, request, jsonify
+from app.database import get_connection
+from app.aggregation import AggregationError, aggregate_fleet, local_now, parse_metrics
+from app.queries import FLEET_SENSOR_IDS_PAGE, FLEET_LATEST_READINGS, FLEET_LAST_10_AVG
+from app.export import columnar_formats, encode, negotiate_format
+from app.downsample import downsample, parse_downsample
+from app.routes.data import parse_time
+from datetime import timedelta
+from operator import itemgetter
+import os
+import uuid
+
+fleet_bp = Blueprint('fleet', __name__)
+
+FLEET_PAGE_SIZE = int(os.environ.get("FLEET_PAGE_SIZE", 100))
+FLEET_PAGE_MAX = int(os.environ.get("FLEET_PAGE_MAX", 1000))
+FIRST_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def sensor_page(cursor):
+    """
+    Resolve ?sensors=all (default) or ?sensors=<id>,<id>,... plus the keyset
+    parameters ?after=<last sensor id of the previous page>&limit=N into
+    (sorted sensor ids for this page, value of ?after= for the next page or None).
+    Raises ValueError for bad parameters.
+    """
+    try:
+        limit = int(request.args.get("limit", FLEET_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("'limit' must be an integer.")
+    if not 1 <= limit <= FLEET_PAGE_MAX:
+        raise ValueError(f"'limit' must be between 1 and {FLEET_PAGE_MAX}.")
+    try:
+        after = str(uuid.UUID(request.args.get("after", FIRST_ID)))
+    except ValueError:
+        raise ValueError(f"Invalid 'after' sensor id '{request.args['after']}'")
+
+    sensors = request.args.get("sensors", "all")
+    if sensors == "all":
+        cursor.execute(FLEET_SENSOR_IDS_PAGE, (after, limit + 1))
+        ids = [str(row["id"]) for row in cursor.fetchall()]
+    else:
+        try:
+            requested = {uuid.UUID(s.strip()) for s in sensors.split(",") if s.strip()}
+        except ValueError:
+            raise ValueError("'sensors' must be 'all' or a comma-separated list of sensor ids.")
+        ids = [str(s) for s in sorted(requested) if s > uuid.UUID(after)][:limit + 1]
+
+    # One id past the page tells us whether there is a next page.
+    if len(ids) > limit:
+        return ids[:limit], ids[limit - 1]
+    return ids, None
+
+
+@fleet_bp.route("/api/fleet/latest", methods=["GET"])
+def get_fleet_latest():
+    """
+    Get the latest reading of every sensor in ?sensors= (or all sensors),
+    one page at a time.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            try:
+                ids, next_after = sensor_page(cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            cursor.execute(FLEET_LATEST_READINGS, (ids,))
+            results = cursor.fetchall()
+
+    return jsonify({
+        "sensors": [
+            {
+                "sensor_id": str(row["sensor_id"]),
+                "latest_reading": {
+                    "temperature": row["temperature"],
+                    "humidity": row["humidity"],
+                    "pm25": row["pm25"],
+                    "tvoc": row["tvoc"],
+                    "co2": row["co2"],
+                    "timestamp": row["date"]
+                }
+            }
+            for row in results
+        ],
+        "next": next_after
+    }), 200
+
+
+@fleet_bp.route("/api/fleet/recent", methods=["GET"])
+def get_fleet_recent():
+    """
+    Get the 10-minute averages of every metric for each sensor in ?sensors=
+    (or all sensors), one page at a time. Sensors without recent data are left out.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            try:
+                ids, next_after = sensor_page(cursor)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            # Stored dates are local wall time, so the cutoff comes from local_now(), not NOW().
+            cursor.execute(FLEET_LAST_10_AVG, (ids, local_now() - timedelta(minutes=10)))
+            results = cursor.fetchall()
+
+    return jsonify({
+        "sensors": [
+            {
+                "sensor_id": str(row["sensor_id"]),
+                "readings": row["readings"],
+                **{f"average_{m}": round(row[m], 2) if row[m] is not None else None
+                   for m in ("temperature", "humidity", "pm25", "tvoc", "co2")}
+            }
+            for row in results
+        ],
+        "time_range": "Last 10 minutes",
+        "next": next_after
+    }), 200
+
+
+@fleet_bp.route("/api/fleet/aggregate", methods=["GET"])
+def get_fleet_aggregate():
+    """
+    GET /api/data/aggregate for every sensor in ?sensors= (or all sensors),
+    one page at a time, from a single query grouped by sensor. Takes
+    ?metrics= (all by default), start, end, bucket, function, percentile and
+    fill, and responds with JSON, Arrow or Parquet like /api/data/aggregate,
+    downsampled per sensor with ?points= and ?downsample= like it too.
+    """
+    args = request.args
+    format = negotiate_format(request, {"json": "application/json", **columnar_formats()}, default="json")
+    if format is None:
+        return jsonify({"error": f"Unknown format. Use json, {', '.join(columnar_formats())}."}), 400
+    metrics = parse_metrics(args.get("metrics"))
+    bucket = args.get("bucket", "hour")
+    function = args.get("function", "avg")
+    fill = args.get("fill", "null")
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            try:
+                ids, next_after = sensor_page(cursor)
+                end = parse_time(args["end"]) if "end" in args else local_now()
+                start = parse_time(args["start"]) if "start" in args else end - timedelta(hours=24)
+                percentile = float(args["percentile"]) if "percentile" in args else None
+                points, method = parse_downsample(args)
+                results = aggregate_fleet("sensor", ids, metrics, start, end, bucket=bucket, function=function,
+                                          percentile=percentile, fill=fill, cursor=cursor) if ids else {}
+            except (AggregationError, ValueError) as e:
+                return jsonify({"error": str(e)}), 400
+
+    if points:
+        key = itemgetter("bucket", *metrics)
+        results = {sensor_id: downsample(rows, points, method, key) for sensor_id, rows in results.items()}
+
+    if format != "json":
+        rows = [(sensor_id, row["bucket"], *(row[m] for m in metrics))
+                for sensor_id, buckets in results.items() for row in buckets]
+        mimetype, body = encode(format, ("sensor_id", "bucket", *metrics), rows)
+        headers = {"X-Next-After": next_after} if next_after else {}
+        return Response(body, mimetype=mimetype, headers=headers)
+
+    return jsonify({
+        "bucket": bucket,
+        "function": function,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "metrics": metrics,
+        "sensors": [
+            {
+                "sensor_id": sensor_id,
+                "buckets": [
+                    {"bucket": row["bucket"].isoformat(),
+                     **{m: round(row[m], 2) if row[m] is not None else None for m in metrics}}
+                    for row in rows
+                ]
+            }
+            for sensor_id, rows in results.items()
+        ],
+        "next": next_after
+    }), 200
@@ -1,4 +1,5 @@
 from flask import Blueprint
+from app.cache import response_cache
 
 root_bp = Blueprint("root", __name__)
 
@@ -6,3 +7,7 @@ root_bp = Blueprint("root", __name__)
 def root():
     return {"message": "Welcome to the Flask API!"}, 200
 
+
+@root_bp.route("/api/cache", methods=["GET"])
+def get_cache_stats():
+    return response_cache.stats(), 200
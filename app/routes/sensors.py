@@ -1,9 +1,50 @@
 from flask import Blueprint, jsonify, request
 from app.database import get_connection
-from app.queries import CREATE_SENSORS_TABLE, INSERT_SENSOR_RETURN_ID, SENSOR_DETAILS_QUERY
+from app.latest import latest_readings
+from app.windows import recent_windows
+from app.cache import invalidate_sensors, sensor_tag
+from app.conditional import REGISTRY_TAG, conditional, ingest_marks
+from app.queries import (INSERT_SENSOR_RETURN_ID, SENSOR_DETAILS_QUERY, SENSORS_LIST, SENSORS_FILTER_AFTER,
+                         SENSORS_FILTER_NAME_PREFIX, SENSORS_FILTER_BBOX)
+import os
+import uuid
 
 sensors_bp = Blueprint('sensors', __name__)
 
+SENSOR_PAGE_MAX = int(os.environ.get("SENSOR_PAGE_MAX", 1000))
+
+
+def _like_prefix(prefix):
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def sensor_filters(args):
+    """
+    Build the WHERE conditions and params for ?prefix=, ?bbox= and ?after=.
+    Raises ValueError for bad parameters.
+    """
+    conditions, params = [], []
+    if args.get("prefix"):
+        conditions.append(SENSORS_FILTER_NAME_PREFIX)
+        params.append(_like_prefix(args["prefix"]))
+    if args.get("bbox"):
+        try:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in args["bbox"].split(","))
+        except ValueError:
+            raise ValueError("'bbox' must be 'min_lon,min_lat,max_lon,max_lat'.")
+        if min_lon > max_lon or min_lat > max_lat:
+            raise ValueError("'bbox' minimums must not exceed its maximums.")
+        conditions.append(SENSORS_FILTER_BBOX)
+        params.extend([min_lon, min_lat, max_lon, max_lat])
+    if args.get("after"):
+        try:
+            params.append(str(uuid.UUID(args["after"])))
+        except ValueError:
+            raise ValueError(f"Invalid 'after' sensor id '{args['after']}'")
+        conditions.append(SENSORS_FILTER_AFTER)
+    return conditions, params
+
 @sensors_bp.route("/api/sensor", methods=["POST"])
 def create_sensor():
     data = request.get_json()
@@ -13,13 +54,14 @@ def create_sensor():
 
     with get_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(CREATE_SENSORS_TABLE)
             cursor.execute(INSERT_SENSOR_RETURN_ID, (name, latitude, longitude))
             sensor_id = cursor.fetchone()["id"]
+    ingest_marks.touch(REGISTRY_TAG)
     return {"id": sensor_id, "message": f"Sensor {name} created."}, 201
 
 
 @sensors_bp.route("/api/sensor/<uuid:sensor_id>", methods=["GET"])
+@conditional("registry")
 def get_sensor_details(sensor_id):
     with get_connection() as conn:
         with conn.cursor() as cursor:
@@ -37,11 +79,32 @@ def get_sensor_details(sensor_id):
     }, 200
 
 @sensors_bp.route("/api/sensor", methods=["GET"])
+@conditional("registry")
 def get_all_sensors():
-    """Retrieve all sensors from the database."""
+    """
+    Retrieve sensors from the database, optionally filtered by name
+    (?prefix=) and location (?bbox=min_lon,min_lat,max_lon,max_lat).
+
+    Without ?limit= or ?after= this returns the plain list of every matching
+    sensor. With them it returns one page ordered by id,
+    {"sensors": [...], "next": <id to pass as ?after=, or null>}.
+    """
+    try:
+        conditions, params = sensor_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    paginated = "limit" in request.args or "after" in request.args
+    limit = request.args.get("limit", str(SENSOR_PAGE_MAX))
+    limit = int(limit) if limit.isdigit() else 0
+    if paginated and not 1 <= limit <= SENSOR_PAGE_MAX:
+        return jsonify({"error": f"'limit' must be between 1 and {SENSOR_PAGE_MAX}."}), 400
+
+    query = SENSORS_LIST.format(conditions=" AND ".join(conditions) or "TRUE",
+                                limit=" LIMIT %s" if paginated else "")
     with get_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute("SELECT id, name, latitude, longitude FROM sensors;")
+            # One row past the page tells us whether there is a next page.
+            cursor.execute(query, params + [limit + 1] if paginated else params)
             results = cursor.fetchall()
 
     sensors = [
@@ -54,7 +117,13 @@ def get_all_sensors():
         for row in results
     ]
 
-    return jsonify(sensors), 200
+    if not paginated:
+        return jsonify(sensors), 200
+
+    return jsonify({
+        "sensors": sensors[:limit],
+        "next": sensors[limit - 1]["id"] if len(sensors) > limit else None
+    }), 200
 
 
 @sensors_bp.route("/api/sensor/<uuid:sensor_id>", methods=["DELETE"])
@@ -68,6 +137,11 @@ def delete_sensor(sensor_id):
                 return {"error": f"Sensor with ID '{sensor_id}' not found."}, 404
 
             cursor.execute("DELETE FROM sensors WHERE id = %s;", (str(sensor_id),))
+    latest_readings.forget(str(sensor_id))
+    recent_windows.forget(str(sensor_id))
+    invalidate_sensors([sensor_id])
+    ingest_marks.touch(REGISTRY_TAG)
+    ingest_marks.touch(sensor_tag(sensor_id))
 
     return {
         "message": f"Sensor with ID '{sensor_id}' and its associated data were deleted."
@@ -98,6 +172,7 @@ def update_sensor(sensor_id):
 
     if not updated_sensor:
         return jsonify({"error": "Sensor not found."}), 404
+    ingest_marks.touch(REGISTRY_TAG)
 
     return jsonify({
         "message": "Sensor updated successfully.",
@@ -1,25 +1,25 @@
 from flask import Blueprint, request, jsonify
+from app.cache import cached
+from app.conditional import conditional
 from app.database import get_connection
-from app.queries import USER_PM25_LAST_7_DAYS_AVG, USER_TVOC_LAST_7_DAYS_AVG, USER_CO2_LAST_7_DAYS_AVG
-from app.queries import USER_PM25_HOURLY_AVG, USER_TVOC_HOURLY_AVG, USER_CO2_HOURLY_AVG
+from app.queries import EXISTING_USER_IDS
+from app.routes.data import export_response
+from app.aggregation import AggregationError, daily_chart, hourly_chart, parse_metrics
 
 user_data_bp = Blueprint('user_data', __name__)
 
 @user_data_bp.route("/api/data/pm25/avg/user/<uuid:user_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_user_pm25_avg_last_7_days(user_id):
     """
     Get the average PM2.5 levels per day for a specific user over the last 7 days.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_PM25_LAST_7_DAYS_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    pm25_data = daily_chart("user", user_id, ["pm25"])
 
-    if not results:
+    if not pm25_data:
         return jsonify({"error": f"No PM2.5 data available for user {user_id} in the last 7 days."}), 404
 
-    pm25_data = [{"date": str(row["day"]), "average_pm25": round(row["average_pm25"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "pm25_daily_averages": pm25_data,
@@ -28,20 +28,17 @@ def get_user_pm25_avg_last_7_days(user_id):
 
 
 @user_data_bp.route("/api/data/tvoc/avg/user/<uuid:user_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_user_tvoc_avg_last_7_days(user_id):
     """
     Get the average TVOC levels per day for a specific user over the last 7 days.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_TVOC_LAST_7_DAYS_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    tvoc_data = daily_chart("user", user_id, ["tvoc"])
 
-    if not results:
+    if not tvoc_data:
         return jsonify({"error": f"No TVOC data available for user {user_id} in the last 7 days."}), 404
 
-    tvoc_data = [{"date": str(row["day"]), "average_tvoc": round(row["average_tvoc"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "tvoc_daily_averages": tvoc_data,
@@ -50,20 +47,17 @@ def get_user_tvoc_avg_last_7_days(user_id):
 
 
 @user_data_bp.route("/api/data/co2/avg/user/<uuid:user_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
 def get_user_co2_avg_last_7_days(user_id):
     """
     Get the average CO2 levels per day for a specific user over the last 7 days.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_CO2_LAST_7_DAYS_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    co2_data = daily_chart("user", user_id, ["co2"])
 
-    if not results:
+    if not co2_data:
         return jsonify({"error": f"No CO2 data available for user {user_id} in the last 7 days."}), 404
 
-    co2_data = [{"date": str(row["day"]), "average_co2": round(row["average_co2"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "co2_daily_averages": co2_data,
@@ -72,20 +66,17 @@ def get_user_co2_avg_last_7_days(user_id):
 
 
 @user_data_bp.route("/api/data/pm25/hourly/user/<uuid:user_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_pm25_avg_user(user_id):
     """
     Get the average PM2.5 per hour for a specific user.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_PM25_HOURLY_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    hourly_data = hourly_chart("user", user_id, ["pm25"])
 
-    if not results:
+    if not hourly_data:
         return jsonify({"error": f"No PM2.5 data available for user {user_id}."}), 404
 
-    hourly_data = [{"hour": str(row["hour"]), "avg_pm25": round(row["avg_pm25"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "time_zone": "Eastern Time (EST/EDT)",
@@ -94,20 +85,17 @@ def get_hourly_pm25_avg_user(user_id):
 
 
 @user_data_bp.route("/api/data/tvoc/hourly/user/<uuid:user_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_tvoc_avg_user(user_id):
     """
     Get the average TVOC per hour for a specific user.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_TVOC_HOURLY_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    hourly_data = hourly_chart("user", user_id, ["tvoc"])
 
-    if not results:
+    if not hourly_data:
         return jsonify({"error": f"No TVOC data available for user {user_id}."}), 404
 
-    hourly_data = [{"hour": str(row["hour"]), "avg_tvoc": round(row["avg_tvoc"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "time_zone": "Eastern Time (EST/EDT)",
@@ -116,22 +104,102 @@ def get_hourly_tvoc_avg_user(user_id):
 
 
 @user_data_bp.route("/api/data/co2/hourly/user/<uuid:user_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
 def get_hourly_co2_avg_user(user_id):
     """
     Get the average CO2 per hour for a specific user.
     """
-    with get_connection() as conn:
-        with conn.cursor() as cursor:
-            cursor.execute(USER_CO2_HOURLY_AVG, (str(user_id),))
-            results = cursor.fetchall()
+    hourly_data = hourly_chart("user", user_id, ["co2"])
 
-    if not results:
+    if not hourly_data:
         return jsonify({"error": f"No CO2 data available for user {user_id}."}), 404
 
-    hourly_data = [{"hour": str(row["hour"]), "avg_co2": round(row["avg_co2"], 2)} for row in results]
-
     return jsonify({
         "user_id": str(user_id),
         "time_zone": "Eastern Time (EST/EDT)",
         "co2_hourly_averages": hourly_data
     }), 200
+
+
+@user_data_bp.route("/api/data/avg/user/<uuid:user_id>", methods=["GET"])
+@conditional("daily")
+@cached("daily")
+def get_user_daily_averages(user_id):
+    """
+    Get the daily averages of several metrics (?metrics=pm25,tvoc,co2; all
+    by default) for a specific user over the last 7 days, from one query.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        daily = daily_chart("user", user_id, metrics)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "user_id": str(user_id),
+        "metrics": metrics,
+        "daily_averages": daily,
+        "time_range": "Last 7 days"
+    }), 200
+
+@user_data_bp.route("/api/data/hourly/user/<uuid:user_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
+def get_user_hourly_averages(user_id):
+    """
+    Get today's hourly averages of several metrics (?metrics=; all by
+    default) for a specific user, from one query.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        hourly = hourly_chart("user", user_id, metrics)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "user_id": str(user_id),
+        "metrics": metrics,
+        "time_zone": "Eastern Time (EST/EDT)",
+        "hourly_averages": hourly
+    }), 200
+
+@user_data_bp.route("/api/data/dashboard/user/<uuid:user_id>", methods=["GET"])
+@conditional("hourly")
+@cached("hourly")
+def get_user_dashboard(user_id):
+    """
+    Get both the 7-day daily and today's hourly averages of several metrics
+    (?metrics=; all by default) for a specific user in one response, using
+    one connection and one query per chart.
+    """
+    metrics = parse_metrics(request.args.get("metrics"))
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                daily = daily_chart("user", user_id, metrics, cursor=cursor)
+                hourly = hourly_chart("user", user_id, metrics, cursor=cursor)
+    except AggregationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "user_id": str(user_id),
+        "metrics": metrics,
+        "time_zone": "Eastern Time (EST/EDT)",
+        "daily_averages": daily,
+        "hourly_averages": hourly
+    }), 200
+
+@user_data_bp.route("/api/data/export/user/<uuid:user_id>", methods=["GET"])
+def export_user_data(user_id):
+    """
+    Export a user's recorded readings (?format=csv|ndjson|arrow|parquet or
+    by Accept header), streamed in batches so any range can be exported in constant memory.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(EXISTING_USER_IDS, ([str(user_id)],))
+            if not cursor.fetchone():
+                return jsonify({"error": f"User with ID '{user_id}' not found."}), 404
+
+    return export_response("user", user_id)
@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request
 from app.database import get_connection
-from app.queries import CREATE_USERS_TABLE, INSERT_USER_RETURN_ID
+from app.queries import INSERT_USER_RETURN_ID
+from app.cache import invalidate_user, user_tag
+from app.conditional import ingest_marks
 
 users_bp = Blueprint('users', __name__)
 
@@ -15,7 +17,6 @@ def create_user():
 
     with get_connection() as conn:
         with conn.cursor() as cursor:
-            cursor.execute(CREATE_USERS_TABLE)
             try:
                 cursor.execute(INSERT_USER_RETURN_ID, (username, password))
                 user_id = cursor.fetchone()["id"]
@@ -87,6 +88,8 @@ def delete_user(user_id):
 
     if not deleted_user:
         return jsonify({"error": "User not found."}), 404
+    invalidate_user(user_id)
+    ingest_marks.touch(user_tag(user_id))
 
     return jsonify({
         "message": "User deleted successfully.",
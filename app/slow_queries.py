@@ -0,0 +1,181 @@
+"""
+Slow-query log.
+
+Every statement slower than SLOW_QUERY_MS milliseconds is logged with its
+query name (as in /metrics), the shape of its parameters (types and
+lengths, never values), its duration and row count, and kept in a ring
+buffer of the last SLOW_QUERY_LOG_SIZE entries, served by
+GET /api/admin/slow-queries.
+
+A SLOW_QUERY_EXPLAIN_RATE fraction of them also get a query plan, captured
+by a background thread on its own connection so the request that ran the
+query does not wait for it. Reads (SELECT/WITH) are re-run under EXPLAIN
+(ANALYZE, BUFFERS) in a read-only transaction that is rolled back; writes
+only get a plain EXPLAIN. Only named queries are explained, never ad-hoc
+statements such as advisory locks, and at most SLOW_QUERY_EXPLAIN_QUEUE
+plans are pending at a time. SLOW_QUERY_MS=0 turns the log off.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from queue import Full, Queue
+
+import psycopg2
+
+from app.database import connect, on_statement
+from app.metrics import query_name
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 250))
+SLOW_QUERY_EXPLAIN_RATE = float(os.environ.get("SLOW_QUERY_EXPLAIN_RATE", 0.1))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.environ.get("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", 10000))
+# Longest statement text kept in an entry.
+STATEMENT_PREVIEW = 2000
+
+
+def params_shape(params):
+    """Describe query parameters by type (and length), e.g. (str, datetime, list[12])."""
+    def shape(value):
+        if isinstance(value, (list, tuple)):
+            return f"{type(value).__name__}[{len(value)}]"
+        return "null" if value is None else type(value).__name__
+    if params is None:
+        return "none"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{key}: {shape(value)}" for key, value in params.items()) + "}"
+    return "(" + ", ".join(shape(value) for value in params) + ")"
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=250, explain_rate=0.1, size=100, explain_queue=8, connect=connect):
+        self.threshold = threshold_ms / 1000
+        self.explain_rate = explain_rate
+        self._connect = connect
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._pending = Queue(maxsize=explain_queue)
+        self._thread = None
+        self._thread_pid = None
+        self._recorded = 0
+        self._skipped_explains = 0
+
+    def observe(self, cursor, query, vars, seconds, error):
+        """on_statement listener."""
+        if seconds < self.threshold or error is not None or threading.current_thread() is self._thread:
+            return
+        name = query_name(query)
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        entry = {
+            "query": name,
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "params": params_shape(vars),
+            "at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "statement": self._preview(cursor, query),
+            "plan": None,
+        }
+        logger.warning("Slow query %s: %.1f ms, %s rows, params %s",
+                       name, entry["duration_ms"], "?" if rows is None else rows, entry["params"])
+        with self._lock:
+            self._entries.append(entry)
+            self._recorded += 1
+
+        if name != "other" and random.random() < self.explain_rate:
+            # Bound parameters are inlined here, on the request thread, while
+            # the cursor's connection can still render them.
+            try:
+                statement = cursor.mogrify(query, vars)
+            except psycopg2.Error:
+                return
+            try:
+                self._pending.put_nowait((entry, statement))
+            except Full:
+                with self._lock:
+                    self._skipped_explains += 1
+                return
+            self._start()
+
+    @staticmethod
+    def _preview(cursor, query):
+        # execute_values batches (bytes) have their values inlined; leave them out.
+        if hasattr(query, "as_string"):
+            query = query.as_string(cursor.connection)
+        return query[:STATEMENT_PREVIEW] if isinstance(query, str) else None
+
+    def entries(self):
+        """Newest first."""
+        with self._lock:
+            return [dict(entry) for entry in reversed(self._entries)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "explain_rate": self.explain_rate,
+                "recorded": self._recorded,
+                "pending_explains": self._pending.qsize(),
+                "skipped_explains": self._skipped_explains,
+            }
+
+    def _start(self):
+        with self._lock:
+            # A forked worker does not inherit the thread, only the attribute.
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _run(self):
+        conn = None
+        while True:
+            entry, statement = self._pending.get()
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                plan = self._explain(conn, statement)
+            except psycopg2.Error as e:
+                plan = {"error": str(e).strip()}
+                if conn is not None and conn.closed:
+                    conn = None
+            with self._lock:
+                entry["plan"] = plan
+
+    @staticmethod
+    def _explain(conn, statement):
+        verb = statement.lstrip()[:6].upper()
+        analyze = verb.startswith((b"SELECT", b"WITH"))
+        if not analyze and not verb.startswith((b"INSERT", b"UPDATE", b"DELETE")):
+            return {"error": "statement cannot be explained"}
+        options = b"(ANALYZE, BUFFERS)" if analyze else b""
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET TRANSACTION READ ONLY;")
+                cursor.execute("SET LOCAL statement_timeout = %s;", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+                started = time.perf_counter()
+                cursor.execute(b"EXPLAIN " + options + b" " + statement)
+                lines = [row["QUERY PLAN"] for row in cursor.fetchall()]
+            return {"analyzed": analyze, "text": "\n".join(lines),
+                    "explain_ms": round((time.perf_counter() - started) * 1000, 3)}
+        finally:
+            # Never keep what the statement did, locks included.
+            if not conn.closed:
+                conn.rollback()
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock_all();")
+                conn.rollback()
+
+
+slow_queries = SlowQueryLog(
+    threshold_ms=SLOW_QUERY_MS,
+    explain_rate=SLOW_QUERY_EXPLAIN_RATE,
+    size=int(os.environ.get("SLOW_QUERY_LOG_SIZE", 100)),
+    explain_queue=int(os.environ.get("SLOW_QUERY_EXPLAIN_QUEUE", 8)),
+)
+
+if SLOW_QUERY_MS > 0:
+    on_statement(slow_queries.observe)
@@ -0,0 +1,93 @@
+"""
+User snapshots written by GET /api/data/latest/<sensor_id>/<user_id>.
+
+A snapshot copies the sensor's latest reading into user_data. A client
+polling faster than the sensor reports would otherwise record the same
+reading over and over, so a snapshot is skipped when this worker has
+already recorded that (user, sensor, reading date). Across workers, the
+unique (user_id, sensor_id, date) index on user_data makes the insert a
+no-op. Snapshots that remain are queued and written in batches by a
+background WriteBehindBuffer, keeping the GET free of writes.
+"""
+import atexit
+import os
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+from app.cache import invalidate_user, user_tag
+from app.conditional import ingest_marks
+from app.database import get_connection
+from app.ingest import WriteBehindBuffer
+from app.queries import INSERT_USER_SNAPSHOTS, EXISTING_USER_IDS
+
+
+def write_snapshots(batch):
+    """
+    Insert (user_id, sensor_id, temperature, humidity, pm25, tvoc, co2, date)
+    rows, ignoring duplicates and users that no longer exist.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(EXISTING_USER_IDS, (list({row[0] for row in batch}),))
+            known = {str(result["id"]) for result in cursor.fetchall()}
+            rows = [row for row in batch if row[0] in known]
+            if rows:
+                execute_values(cursor, INSERT_USER_SNAPSHOTS, rows, page_size=len(rows))
+    for user_id in {row[0] for row in rows}:
+        invalidate_user(user_id)
+        ingest_marks.touch(user_tag(user_id))
+    return rows
+
+
+class SnapshotRecorder:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._recorded = OrderedDict()
+        self._lock = threading.Lock()
+        self._buffer = None
+        self._buffer_pid = None
+
+    def record(self, user_id, sensor_id, reading):
+        """
+        Queue a snapshot of `reading` for the user unless it was already
+        recorded. Returns False for a skipped duplicate.
+        """
+        key = (user_id, sensor_id)
+        with self._lock:
+            if self._recorded.get(key) == reading["date"]:
+                self._recorded.move_to_end(key)
+                return False
+            self._recorded[key] = reading["date"]
+            self._recorded.move_to_end(key)
+            while len(self._recorded) > self.maxsize:
+                self._recorded.popitem(last=False)
+
+        row = (user_id, sensor_id, reading["temperature"], reading["humidity"],
+               reading["pm25"], reading["tvoc"], reading["co2"], reading["date"])
+        if not self.buffer().offer(row):
+            # Never lose history to backpressure; write inline instead.
+            write_snapshots([row])
+        return True
+
+    def buffer(self):
+        pid = os.getpid()
+        if self._buffer is not None and self._buffer_pid == pid:
+            return self._buffer
+        with self._lock:
+            if self._buffer is None or self._buffer_pid != pid:
+                self._buffer = WriteBehindBuffer(
+                    write_snapshots,
+                    capacity=int(os.environ.get("SNAPSHOT_BUFFER_CAPACITY", 10000)),
+                    flush_rows=int(os.environ.get("SNAPSHOT_FLUSH_ROWS", 500)),
+                    flush_interval=float(os.environ.get("SNAPSHOT_FLUSH_INTERVAL", 1.0)),
+                    name="snapshot-flusher",
+                )
+                self._buffer_pid = pid
+                self._buffer.start()
+                atexit.register(self._buffer.stop)
+        return self._buffer
+
+
+snapshots = SnapshotRecorder()
@@ -0,0 +1,336 @@
+"""
+Live readings pushed to clients as Server-Sent Events.
+
+A statement-level trigger on data sends one NOTIFY on the 'readings'
+channel per sensor and statement, carrying that sensor's newest reading,
+so every ingest path (add_data, the batch endpoint, the write-behind
+flusher, other instances) is covered. Each worker holds a single LISTEN
+connection, opened when its first client subscribes and closed once none
+are left, and fans each notification out to that sensor's subscribers.
+The event is encoded once and shared by all of them, so clients cost no
+queries after they connect.
+
+With STREAM_SOURCE=local the LISTEN connection is skipped and events come
+from this worker's own ingest path (@on_ingest) instead; only suitable
+when a single worker handles both ingest and streams.
+
+Event ids are the reading's date. A client reconnecting with Last-Event-ID
+is first sent the readings stored after that date (at most
+STREAM_REPLAY_MAX), a new client the sensor's latest reading. Every
+STREAM_HEARTBEAT seconds without events a comment line keeps proxies from
+closing the connection and lets the worker notice clients that left.
+Under gunicorn's gthread workers each open stream holds one of the
+worker's GUNICORN_THREADS threads, so by default a worker takes at most
+GUNICORN_THREADS - 1 streams and keeps a thread for everything else;
+under gevent a stream only costs a greenlet and the default is 100.
+STREAM_MAX_SUBSCRIBERS overrides either.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import psycopg2
+from werkzeug.http import http_date
+
+from app.aggregation import to_local
+from app.database import connect, get_connection
+from app.ingest import on_ingest
+from app.latest import latest_readings
+from app.queries import SENSOR_READINGS_SINCE
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "readings"
+READING_FIELDS = ("temperature", "humidity", "pm25", "tvoc", "co2")
+# How often the listener wakes up to notice it has no subscribers left.
+LISTEN_POLL_SECONDS = 5.0
+STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", 15))
+STREAM_REPLAY_MAX = int(os.environ.get("STREAM_REPLAY_MAX", 1000))
+STREAM_RETRY_MS = int(os.environ.get("STREAM_RETRY_MS", 3000))
+
+
+def schema_sql():
+    """DDL for the trigger that NOTIFYs each sensor's newest inserted reading."""
+    return f"""
+CREATE OR REPLACE FUNCTION data_notify_readings() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', json_build_array(sensor_id, temperature, humidity, pm25, tvoc, co2, date)::text)
+    FROM (
+        SELECT DISTINCT ON (sensor_id) *
+        FROM new_rows
+        WHERE sensor_id IS NOT NULL AND date IS NOT NULL
+        ORDER BY sensor_id, date DESC
+    ) newest;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS data_notify_readings ON data;
+CREATE TRIGGER data_notify_readings
+    AFTER INSERT ON data
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION data_notify_readings();
+"""
+
+
+def parse_stored_date(value):
+    """A TIMESTAMP as json_build_array writes it (trailing zeros of the fraction dropped)."""
+    # fromisoformat() only takes 3 or 6 fractional digits before Python 3.11.
+    date, _, fraction = value.partition(".")
+    return datetime.fromisoformat(f"{date}.{fraction.ljust(6, '0')}" if fraction else date)
+
+
+def max_subscribers():
+    """STREAM_MAX_SUBSCRIBERS, or the default for this worker's serving profile."""
+    value = os.environ.get("STREAM_MAX_SUBSCRIBERS")
+    if value:
+        return int(value)
+    # gunicorn.conf.py sets these to what the running worker actually uses.
+    if os.environ.get("GUNICORN_WORKER_CLASS", "gthread").startswith("gevent"):
+        return 100
+    return max(int(os.environ.get("GUNICORN_THREADS", 8)) - 1, 0)
+
+
+class StreamFull(Exception):
+    """Raised when a worker already serves STREAM_MAX_SUBSCRIBERS streams."""
+
+
+def format_event(sensor_id, reading):
+    """Encode a reading (READING_FIELDS plus a naive 'date') as one SSE event."""
+    data = {"sensor_id": sensor_id, **{field: reading[field] for field in READING_FIELDS},
+            "timestamp": http_date(reading["date"])}
+    return f"id: {reading['date'].isoformat()}\nevent: reading\ndata: {json.dumps(data, sort_keys=True)}\n\n"
+
+
+def parse_event_id(value):
+    """The reading date a Last-Event-ID refers to, or None if it is not one of ours."""
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+class Subscription:
+    def __init__(self, sensor_id, queue_size):
+        self.sensor_id = sensor_id
+        # A client too slow to keep up loses its oldest events, not the newest.
+        self._events = deque(maxlen=queue_size)
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def put(self, date, event):
+        with self._cond:
+            self._events.append((date, event))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Next (date, event), or None after `timeout` seconds or once closed."""
+        with self._cond:
+            if not self._events and not self.closed:
+                self._cond.wait(timeout)
+            return self._events.popleft() if self._events else None
+
+
+class StreamHub:
+    def __init__(self, connect, max_subscribers=100, queue_size=100, listen=True):
+        self._connect = connect
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.listen = listen
+
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._published = 0
+
+    def subscribe(self, sensor_id):
+        """Register a subscriber for `sensor_id`. Raises StreamFull at the cap."""
+        subscription = Subscription(sensor_id, self.queue_size)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise StreamFull(f"At most {self.max_subscribers} streams per worker.")
+            self._subscribers.setdefault(sensor_id, set()).add(subscription)
+            self._count += 1
+            if self.listen and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stream-listener", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.sensor_id)
+            if subscribers is not None and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._subscribers[subscription.sensor_id]
+
+    def publish(self, sensor_id, reading):
+        """Send `reading` to every subscriber of `sensor_id`."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(sensor_id, ()))
+        if not subscribers:
+            return
+        event = format_event(sensor_id, reading)
+        for subscription in subscribers:
+            subscription.put(reading["date"], event)
+        self._published += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "max_subscribers": self.max_subscribers,
+                "sensors": len(self._subscribers),
+                "listening": self._thread is not None,
+                "published": self._published,
+            }
+
+    def _close_all(self):
+        # Streams end and their clients reconnect with Last-Event-ID, which
+        # replays whatever was missed while the listener was down.
+        with self._lock:
+            subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def _stop_if_idle(self):
+        # Decided under the lock so that subscribe() starts a new thread
+        # exactly when this one has committed to exiting.
+        with self._lock:
+            if self._count:
+                return False
+            self._thread = None
+            return True
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop_if_idle():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL};")
+                backoff = 1.0
+                while self._count:
+                    if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except (psycopg2.Error, OSError):
+                logger.exception("Stream listener lost its connection; retrying in %.0fs", backoff)
+                self._close_all()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+
+    def _dispatch(self, payload):
+        try:
+            sensor_id, *values, date = json.loads(payload)
+            # json_build_array writes whole doubles as integers.
+            reading = {field: float(value) if value is not None else None
+                       for field, value in zip(READING_FIELDS, values)}
+            reading["date"] = parse_stored_date(date)
+        except (TypeError, ValueError):
+            logger.warning("Ignoring malformed %s notification %r", CHANNEL, payload)
+            return
+        self.publish(sensor_id, reading)
+
+
+def backlog(sensor_id, since=None):
+    """
+    (date, event) pairs to send before live events: the newest readings
+    stored after `since` (oldest first), or the latest reading if no `since`.
+    """
+    if since is None:
+        reading = latest_readings.get(sensor_id)
+        return [(reading["date"], format_event(sensor_id, reading))] if reading else []
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SENSOR_READINGS_SINCE, (sensor_id, since, STREAM_REPLAY_MAX))
+            results = cursor.fetchall()
+    return [(row["date"], format_event(sensor_id, row)) for row in reversed(results)]
+
+
+def event_stream(subscription, events):
+    """Yield `events` (from backlog()), then live events and heartbeats until closed."""
+    yield f"retry: {STREAM_RETRY_MS}\n\n"
+    replayed_until = None
+    for date, event in events:
+        replayed_until = date
+        yield event
+    while True:
+        item = subscription.get(STREAM_HEARTBEAT)
+        if item is None:
+            if subscription.closed:
+                return
+            yield ": keep-alive\n\n"
+            continue
+        date, event = item
+        # Already sent as part of the backlog.
+        if replayed_until is not None and date <= replayed_until:
+            continue
+        yield event
+
+
+def local_source():
+    return os.environ.get("STREAM_SOURCE", "notify") == "local"
+
+
+_hub = None
+_hub_pid = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """Return this process's hub; like the pool, it is rebuilt after a fork."""
+    global _hub, _hub_pid
+    pid = os.getpid()
+    if _hub is not None and _hub_pid == pid:
+        return _hub
+    with _hub_lock:
+        if _hub is None or _hub_pid != pid:
+            _hub = StreamHub(
+                connect,
+                max_subscribers=max_subscribers(),
+                queue_size=int(os.environ.get("STREAM_QUEUE_SIZE", 100)),
+                listen=not local_source(),
+            )
+            _hub_pid = pid
+    return _hub
+
+
+@on_ingest
+def _publish_ingested(rows):
+    if not local_source() or _hub is None or _hub_pid != os.getpid():
+        return
+    newest = {}
+    for sensor_id, temperature, humidity, pm25, tvoc, co2, date in rows:
+        date = to_local(date)
+        values = (temperature, humidity, pm25, tvoc, co2)
+        reading = {field: float(value) if value is not None else None for field, value in zip(READING_FIELDS, values)}
+        reading["date"] = date
+        sensor_id = str(uuid.UUID(str(sensor_id)))
+        if sensor_id not in newest or newest[sensor_id]["date"] <= date:
+            newest[sensor_id] = reading
+    for sensor_id, reading in newest.items():
+        _hub.publish(sensor_id, reading)
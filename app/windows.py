@@ -0,0 +1,223 @@
+"""
+Sliding-window averages of each sensor's recent readings, in memory.
+
+For every window length in WINDOW_MINUTES (default 10), each worker keeps
+a sensor's readings inside the window in a deque, with a running sum and
+count per metric. Readings come in from the ingest path (@on_ingest) and
+fall out of the front as the window slides, so an average costs O(1) and
+no query. Windows end at local_now(), the clock readings are stored in.
+
+A window is only trusted once it holds everything in its range:
+- cold start: the first request for a sensor loads the readings of the
+  longest window from the database (one query) and seeds all its windows;
+- a sensor first seen through this worker's own ingest is complete once
+  it has been followed for the window's length.
+Readings ingested by other workers or instances show up in latest_readings
+(within LATEST_MEMORY_TTL seconds) and make the sensor be seeded again.
+Other lengths, and everything when WINDOW_ENABLED=0, are averaged by the
+database.
+"""
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import deque
+from datetime import timedelta
+
+from app.aggregation import local_now, to_local
+from app.database import get_connection
+from app.ingest import on_ingest
+from app.latest import _as_float, latest_readings
+from app.queries import SENSOR_RECENT_AVERAGES, SENSOR_RECENT_READINGS
+
+METRICS = ("temperature", "humidity", "pm25", "tvoc", "co2")
+# How long rows loaded by a seed are remembered, to skip their publish
+# if it arrives after the seed read them.
+SEED_GRACE_SECONDS = 10.0
+
+
+def window_enabled():
+    return os.environ.get("WINDOW_ENABLED", "1") == "1"
+
+
+class Window:
+    """One sensor's readings within the last `minutes`, oldest first, with running totals."""
+
+    __slots__ = ("span", "readings", "sums", "counts")
+
+    def __init__(self, minutes):
+        self.span = timedelta(minutes=minutes)
+        self.readings = deque()
+        self.sums = [0.0] * len(METRICS)
+        self.counts = [0] * len(METRICS)
+
+    def _count(self, values, sign):
+        for i, value in enumerate(values):
+            if value is not None:
+                self.sums[i] += sign * value
+                self.counts[i] += sign
+
+    def add(self, date, values):
+        if self.readings and date < self.readings[-1][0]:
+            # Out of order: rare, so just put it in place.
+            dates = [d for d, _ in self.readings]
+            self.readings.insert(bisect_right(dates, date), (date, values))
+        else:
+            self.readings.append((date, values))
+        self._count(values, 1)
+
+    def expire(self, now):
+        cutoff = now - self.span
+        while self.readings and self.readings[0][0] < cutoff:
+            self._count(self.readings.popleft()[1], -1)
+        for i, count in enumerate(self.counts):
+            if not count:
+                # No float drift left behind once a metric empties.
+                self.sums[i] = 0.0
+
+    def averages(self):
+        return {"readings": len(self.readings),
+                **{m: s / c if c else None for m, s, c in zip(METRICS, self.sums, self.counts)}}
+
+
+class SensorWindows:
+    def __init__(self, minutes, since):
+        self.windows = {m: Window(m) for m in minutes}
+        # Every reading dated from here on has been added.
+        self.since = since
+        self.newest = None
+        self.seeded = frozenset()
+        self.seeded_until = 0.0
+
+    def add(self, date, values, now):
+        if self.newest is None or date > self.newest:
+            self.newest = date
+        for window in self.windows.values():
+            window.add(date, values)
+            window.expire(now)
+
+
+class RecentWindows:
+    def __init__(self, minutes=(10,)):
+        self.minutes = tuple(sorted(set(minutes)))
+        self._sensors = {}
+        self._seeding = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._seeds = 0
+        self._queries = 0
+
+    def record(self, sensor_id, date, values):
+        """Add a committed reading (stored date, METRICS values) to the sensor's windows."""
+        reading = (date, values)
+        now = local_now()
+        with self._lock:
+            pending = self._seeding.get(sensor_id)
+            if pending is not None:
+                pending.append(reading)
+                return
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None:
+                sensor = self._sensors[sensor_id] = SensorWindows(self.minutes, now)
+            elif reading in sensor.seeded and time.monotonic() < sensor.seeded_until:
+                return
+            sensor.add(date, values, now)
+
+    def averages(self, sensor_id, minutes=10):
+        """
+        {"readings": n, metric: average or None, ...} over the last `minutes`,
+        from memory when the window is complete, otherwise from the database.
+        """
+        if minutes in self.minutes and window_enabled():
+            result = self._from_memory(sensor_id, minutes)
+            if result is None:
+                self._seed(sensor_id)
+                result = self._from_memory(sensor_id, minutes)
+            if result is not None:
+                with self._lock:
+                    self._hits += 1
+                return result
+        with self._lock:
+            self._queries += 1
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(SENSOR_RECENT_AVERAGES, (sensor_id, local_now() - timedelta(minutes=minutes)))
+                result = cursor.fetchone()
+        return {"readings": result["readings"], **{m: result[m] for m in METRICS}}
+
+    def _from_memory(self, sensor_id, minutes):
+        now = local_now()
+        latest = latest_readings.get(sensor_id)
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None or sensor.since > now - timedelta(minutes=minutes):
+                return None
+            # Something newer was ingested elsewhere.
+            if latest is not None and (sensor.newest is None or latest["date"] > sensor.newest) \
+                    and latest["date"] >= now - timedelta(minutes=self.minutes[-1]):
+                return None
+            window = sensor.windows[minutes]
+            window.expire(now)
+            return window.averages()
+
+    def _seed(self, sensor_id):
+        with self._lock:
+            if sensor_id in self._seeding:
+                return
+            self._seeding[sensor_id] = []
+        try:
+            now = local_now()
+            since = now - timedelta(minutes=self.minutes[-1])
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(SENSOR_RECENT_READINGS, (sensor_id, since))
+                    results = cursor.fetchall()
+            seeded = [(row["date"], tuple(row[m] for m in METRICS)) for row in results]
+        except Exception:
+            with self._lock:
+                # Whatever was published meanwhile is lost; start over next time.
+                del self._seeding[sensor_id]
+                self._sensors.pop(sensor_id, None)
+            raise
+        with self._lock:
+            sensor = SensorWindows(self.minutes, since)
+            for date, values in seeded:
+                sensor.add(date, values, now)
+            sensor.seeded = frozenset(seeded)
+            sensor.seeded_until = time.monotonic() + SEED_GRACE_SECONDS
+            # Published while the query ran; the ones it already saw are skipped.
+            for reading in self._seeding.pop(sensor_id):
+                if reading not in sensor.seeded:
+                    sensor.add(*reading, now)
+            self._sensors[sensor_id] = sensor
+            self._seeds += 1
+
+    def forget(self, sensor_id):
+        with self._lock:
+            self._sensors.pop(sensor_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": window_enabled(),
+                "minutes": list(self.minutes),
+                "sensors": len(self._sensors),
+                "readings": sum(len(s.windows[self.minutes[-1]].readings) for s in self._sensors.values()),
+                "memory_hits": self._hits,
+                "seeds": self._seeds,
+                "database_queries": self._queries,
+            }
+
+
+recent_windows = RecentWindows(
+    minutes=[int(m) for m in os.environ.get("WINDOW_MINUTES", "10").split(",") if m.strip()] or [10])
+
+
+@on_ingest
+def _record_ingested(rows):
+    if not window_enabled():
+        return
+    for sensor_id, temperature, humidity, pm25, tvoc, co2, date in rows:
+        values = tuple(map(_as_float, (temperature, humidity, pm25, tvoc, co2)))
+        recent_windows.record(str(uuid.UUID(str(sensor_id))), to_local(date), values)
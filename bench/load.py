@@ -0,0 +1,526 @@
+"""
+Load test of the API against a throwaway benchmark database.
+
+    python -m bench.load seed --sensors 50 --days 7 --per-minute 1
+    python -m bench.load run --concurrency 8 --duration 20
+    python -m bench.load compare bench/results/<before>.json bench/results/<after>.json
+
+seed drops and recreates BENCH_DATABASE (default airborne_bench) on the
+server DATABASE_URL points at, migrates it and fills it with sensors x
+days x readings per minute of synthetic data (reproducible with --seed),
+plus a few users.
+
+run starts gunicorn on the benchmark database the way the Dockerfile does
+(--workers/--threads, anything else through --server-args), or targets a
+server that is already up with --url. It then drives each endpoint in
+turn with --concurrency keep-alive clients for --duration seconds after
+--warmup seconds, prints throughput and p50/p95/p99 latency, and writes
+everything with the commit it ran against to bench/results/. The app
+runs with the settings in .env unless overridden with --env KEY=VALUE,
+e.g. --env CACHE_ENABLED=0 to measure the queries instead of the cache.
+
+scale compares serving profiles (see gunicorn.conf.py): for each of
+--profiles it starts gunicorn, optionally opens --streams SSE connections
+that stay open for the whole run (as dashboards do), and drives each
+endpoint at every client count in --levels:
+
+    python -m bench.load scale --profiles gthread,gevent --levels 8,64,256 --streams 6
+
+The load generator shares the machine with the server, so compare runs
+made on the same host with the same options.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extensions import make_dsn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+BENCH_PREFIX = "bench-"
+
+SEED_SENSORS = """
+INSERT INTO sensors (name, latitude, longitude)
+SELECT %(prefix)s || lpad(n::text, 5, '0'), 40 + random() * 5, -80 + random() * 5
+FROM generate_series(1, %(count)s) n;
+"""
+SEED_USERS = """
+INSERT INTO users (username, password)
+SELECT %(prefix)s || lpad(n::text, 5, '0'), 'bench'
+FROM generate_series(1, %(count)s) n;
+"""
+# One statement per day keeps the statement-level triggers' transition
+# tables (and the seed's memory use) bounded.
+SEED_READINGS = """
+INSERT INTO data (sensor_id, temperature, humidity, pm25, tvoc, co2, date)
+SELECT s.id,
+       21 + 3 * sin(extract(epoch FROM t) / 13751) + random(),
+       45 + 10 * sin(extract(epoch FROM t) / 20000) + 2 * random(),
+       8 + 6 * random() ^ 3 * 4,
+       150 + 250 * random() ^ 2,
+       450 + 500 * random() ^ 2,
+       t
+FROM sensors s
+CROSS JOIN generate_series(%(start)s, %(end)s, %(step)s) t
+WHERE s.name LIKE %(prefix)s || '%%';
+"""
+# gunicorn flags per serving profile, on top of --workers.
+PROFILES = {
+    "gthread": lambda args: ["--worker-class", "gthread", "--threads", str(args.threads)],
+    "gevent": lambda args: ["--worker-class", "gevent", "--worker-connections", str(args.worker_connections)],
+}
+BENCH_SENSORS = "SELECT id FROM sensors WHERE name LIKE %s || '%%' ORDER BY name;"
+BENCH_USERS = "SELECT id FROM users WHERE username LIKE %s || '%%' ORDER BY username;"
+
+
+def bench_dsn(database_url, name):
+    return make_dsn(database_url, dbname=name)
+
+
+def seed(args):
+    database_url = os.environ["DATABASE_URL"]
+    admin = psycopg2.connect(bench_dsn(database_url, "postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{args.database}";')
+        cursor.execute(f'CREATE DATABASE "{args.database}";')
+    admin.close()
+
+    # The app's pool reads these when first used, i.e. below.
+    os.environ.update({"DB_CONNECTION": "url", "DATABASE_URL": bench_dsn(database_url, args.database)})
+    from app.aggregation import local_now
+    from app.database import get_connection
+    from app.migrations import migrate
+    from app.partitions import ensure_partitions
+
+    migrate()
+    end = local_now().replace(second=0, microsecond=0)
+    start = end - timedelta(days=args.days)
+    step = timedelta(seconds=60 / args.per_minute)
+    started = time.perf_counter()
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s);", (args.seed / 2 ** 31,))
+            cursor.execute(SEED_SENSORS, {"prefix": BENCH_PREFIX, "count": args.sensors})
+            cursor.execute(SEED_USERS, {"prefix": BENCH_PREFIX, "count": args.users})
+            cursor.execute(
+                "SELECT create_monthly_partition('data', m::date) "
+                "FROM generate_series(date_trunc('month', %s::timestamp), %s, INTERVAL '1 month') m;",
+                (start, end))
+    ensure_partitions()
+
+    rows = 0
+    day = start
+    while day < end:
+        until = min(day + timedelta(days=1), end)
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT setseed(%s);", (((args.seed + rows) % 2 ** 31) / 2 ** 31,))
+                cursor.execute(SEED_READINGS, {"start": day, "end": until - timedelta(microseconds=1),
+                                               "step": step, "prefix": BENCH_PREFIX})
+                rows += cursor.rowcount
+        day = until
+        print(f"\rseeded {rows} readings up to {until}", end="", flush=True)
+    elapsed = time.perf_counter() - started
+
+    config = {"sensors": args.sensors, "users": args.users, "days": args.days,
+              "per_minute": args.per_minute, "seed": args.seed, "readings": rows, "end": end.isoformat()}
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE;")
+            cursor.execute(f'COMMENT ON DATABASE "{args.database}" IS %s;', (json.dumps(config),))
+    print(f"\n{rows} readings for {args.sensors} sensors in {elapsed:.1f}s")
+
+
+def seed_config(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT shobj_description(oid, 'pg_database') FROM pg_database "
+                           "WHERE datname = current_database();")
+            comment = cursor.fetchone()[0]
+            cursor.execute(BENCH_SENSORS, (BENCH_PREFIX,))
+            sensors = [str(row[0]) for row in cursor.fetchall()]
+            cursor.execute(BENCH_USERS, (BENCH_PREFIX,))
+            users = [str(row[0]) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    if not sensors or not users:
+        raise SystemExit("The benchmark database has no bench sensors/users; run `python -m bench.load seed` first.")
+    return (json.loads(comment) if comment else {}), sensors, users
+
+
+def scenarios(sensors, users):
+    """name -> function(rng) returning (method, path, JSON body or None)."""
+    def ingest(rng):
+        return "POST", "/api/data", {
+            "sensor": rng.choice(sensors),
+            "temperature": round(rng.uniform(18, 26), 2), "humidity": round(rng.uniform(30, 60), 2),
+            "pm25": round(rng.uniform(0, 35), 2), "tvoc": round(rng.uniform(50, 500), 1),
+            "co2": round(rng.uniform(400, 1200), 1),
+        }
+
+    return {
+        "ingest": ingest,
+        "latest": lambda rng: ("GET", f"/api/data/latest/{rng.choice(sensors)}/{rng.choice(users)}", None),
+        "avg10": lambda rng: ("GET", f"/api/data/temp/avg/{rng.choice(sensors)}", None),
+        "hourly": lambda rng: ("GET", f"/api/data/pm25/hourly/{rng.choice(sensors)}", None),
+        "daily": lambda rng: ("GET", f"/api/data/pm25/avg/{rng.choice(sensors)}", None),
+    }
+
+
+def percentile_ms(sorted_latencies, fraction):
+    index = min(int(round(fraction * (len(sorted_latencies) - 1))), len(sorted_latencies) - 1)
+    return round(sorted_latencies[index] * 1000, 3)
+
+
+def drive(host, port, request_for, concurrency, duration, warmup, seed):
+    """Run `concurrency` closed-loop clients; return the endpoint's summary."""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    statuses = [{} for _ in range(concurrency)]
+    started = time.monotonic()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    def client(index):
+        rng = random.Random(seed * 1000 + index)
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                break
+            method, path, body = request_for(rng)
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            begin = time.perf_counter()
+            try:
+                conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                status = "connection error"
+            elapsed = time.perf_counter() - begin
+            if now >= measure_from:
+                latencies[index].append(elapsed)
+                statuses[index][status] = statuses[index].get(status, 0) + 1
+                if status == "connection error" or status >= 500:
+                    errors[index] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    samples = sorted(value for values in latencies for value in values)
+    counts = {}
+    for per_client in statuses:
+        for status, count in per_client.items():
+            counts[str(status)] = counts.get(str(status), 0) + count
+    if not samples:
+        return {"requests": 0, "errors": sum(errors), "statuses": counts}
+    return {
+        "requests": len(samples),
+        "errors": sum(errors),
+        "statuses": counts,
+        "rps": round(len(samples) / duration, 1),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": percentile_ms(samples, 0.50),
+        "p95_ms": percentile_ms(samples, 0.95),
+        "p99_ms": percentile_ms(samples, 0.99),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def start_server(args, dsn, profile_args=None):
+    env = dict(os.environ, DB_CONNECTION="url", DATABASE_URL=dsn, MIGRATE_ON_STARTUP="0")
+    env.update(dict(item.split("=", 1) for item in args.env))
+    if profile_args is None:
+        profile_args = ["--threads", str(args.threads)]
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{args.port}",
+               "--workers", str(args.workers), *profile_args, "--timeout", "0",
+               *shlex.split(args.server_args), "wsgi:app"]
+    log = open(os.path.join(RESULTS_DIR, "server.log"), "w")
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"gunicorn exited with {server.returncode}; see {log.name}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", args.port, timeout=1)
+            conn.request("GET", "/")
+            if conn.getresponse().status == 200:
+                return server, command
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"gunicorn did not come up within 60s; see {log.name}")
+
+
+def hold_streams(host, port, sensors, count):
+    """
+    Open `count` SSE streams and keep reading them in the background.
+    Returns a function that closes them all.
+    """
+    conns = [http.client.HTTPConnection(host, port, timeout=10) for _ in range(count)]
+    opened = threading.Semaphore(0)
+
+    def stream(conn, sensor_id):
+        try:
+            conn.request("GET", f"/api/data/stream/{sensor_id}")
+            response = conn.getresponse()
+            conn.sock.settimeout(None)
+            opened.release()
+            while response.readline():
+                pass
+        except (OSError, http.client.HTTPException, AttributeError):
+            opened.release()
+
+    threads = [threading.Thread(target=stream, args=(conn, sensors[i % len(sensors)]), daemon=True)
+               for i, conn in enumerate(conns)]
+    for thread in threads:
+        thread.start()
+    for _ in threads:
+        opened.acquire(timeout=10)
+
+    def close():
+        for conn in conns:
+            if conn.sock is not None:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        for thread in threads:
+            thread.join(10)
+        for conn in conns:
+            conn.close()
+    return close
+
+
+def git_state():
+    def git(*command):
+        return subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", "app"))}
+
+
+def print_table(endpoints):
+    print(f"{'endpoint':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, result in endpoints.items():
+        if not result["requests"]:
+            print(f"{name:<10} {'no requests completed':>38}")
+            continue
+        print(f"{name:<10} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f} {result['errors']:>7}")
+
+
+def run(args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    dsn = bench_dsn(os.environ["DATABASE_URL"], args.database)
+    seeded, sensors, users = seed_config(dsn)
+    available = scenarios(sensors, users)
+    names = args.endpoints.split(",") if args.endpoints else list(available)
+    unknown = set(names) - set(available)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints {sorted(unknown)}; choose from {list(available)}.")
+
+    server = command = None
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        server, command = start_server(args, dsn)
+        host, port = "127.0.0.1", args.port
+
+    endpoints = {}
+    try:
+        for name in names:
+            print(f"{name}: {args.concurrency} clients, {args.duration}s ...", flush=True)
+            endpoints[name] = drive(host, port, available[name], args.concurrency,
+                                    args.duration, args.warmup, args.seed)
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+
+    result = {
+        **git_state(),
+        "label": args.label,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "seed": seeded,
+        "run": {"concurrency": args.concurrency, "duration": args.duration, "warmup": args.warmup,
+                "server": " ".join(command[2:]) if command else args.url, "env": args.env,
+                "cpus": os.cpu_count()},
+        "endpoints": endpoints,
+    }
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}{'-' + args.label if args.label else ''}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print_table(endpoints)
+    print(f"results written to {os.path.relpath(path)}")
+
+
+def scale(args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    dsn = bench_dsn(os.environ["DATABASE_URL"], args.database)
+    seeded, sensors, users = seed_config(dsn)
+    available = scenarios(sensors, users)
+    names = args.endpoints.split(",")
+    profiles = args.profiles.split(",")
+    levels = [int(level) for level in args.levels.split(",")]
+    unknown = (set(names) - set(available)) | (set(profiles) - set(PROFILES))
+    if unknown:
+        raise SystemExit(f"Unknown endpoints/profiles {sorted(unknown)}; choose from "
+                         f"{list(available)} and {list(PROFILES)}.")
+
+    results = {}
+    for profile in profiles:
+        server, command = start_server(args, dsn, PROFILES[profile](args))
+        host, port = "127.0.0.1", args.port
+        close_streams = hold_streams(host, port, sensors, args.streams) if args.streams else None
+        by_level = {}
+        try:
+            for level in levels:
+                by_level[str(level)] = {}
+                for name in names:
+                    print(f"{profile}, {name}: {level} clients, {args.streams} streams, {args.duration}s ...",
+                          flush=True)
+                    by_level[str(level)][name] = drive(host, port, available[name], level,
+                                                       args.duration, args.warmup, args.seed)
+        finally:
+            if close_streams is not None:
+                close_streams()
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+        results[profile] = {"server": " ".join(command[2:]), "levels": by_level}
+
+    result = {
+        **git_state(),
+        "label": args.label,
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "seed": seeded,
+        "run": {"levels": levels, "streams": args.streams, "duration": args.duration,
+                "warmup": args.warmup, "env": args.env, "cpus": os.cpu_count()},
+        "profiles": results,
+    }
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}-scale"
+                     f"{'-' + args.label if args.label else ''}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"{'endpoint':<10} {'clients':>7}" + "".join(f" {p + ' req/s':>15} {'p95 ms':>9} {'errors':>7}"
+                                                   for p in profiles))
+    for name in names:
+        for level in levels:
+            line = f"{name:<10} {level:>7}"
+            for profile in profiles:
+                summary = results[profile]["levels"][str(level)][name]
+                if summary["requests"]:
+                    line += f" {summary['rps']:>15.1f} {summary['p95_ms']:>9.2f} {summary['errors']:>7}"
+                else:
+                    line += f" {'none completed':>15} {'':>9} {summary['errors']:>7}"
+            print(line)
+    print(f"results written to {os.path.relpath(path)}")
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if "endpoints" not in before or "endpoints" not in after:
+        raise SystemExit("compare takes two `run` results; `scale` results compare profiles themselves.")
+    print(f"before {before['commit']}{' (dirty)' if before['dirty'] else ''} {before.get('label') or ''}")
+    print(f"after  {after['commit']}{' (dirty)' if after['dirty'] else ''} {after.get('label') or ''}")
+    if before["seed"] != after["seed"] or before["run"]["concurrency"] != after["run"]["concurrency"]:
+        print("warning: the runs used different seed data or concurrency")
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"{'endpoint':<10} {'req/s':>18} {'':>7} {'p95 ms':>18} {'':>7} {'p99 ms':>18} {'':>7}")
+    for name in before["endpoints"]:
+        old, new = before["endpoints"][name], after["endpoints"].get(name)
+        if not new or not old.get("requests") or not new.get("requests"):
+            continue
+        print(f"{name:<10} {old['rps']:>8.1f} {new['rps']:>9.1f} {change(old['rps'], new['rps']):>7} "
+              f"{old['p95_ms']:>8.2f} {new['p95_ms']:>9.2f} {change(old['p95_ms'], new['p95_ms']):>7} "
+              f"{old['p99_ms']:>8.2f} {new['p99_ms']:>9.2f} {change(old['p99_ms'], new['p99_ms']):>7}")
+
+
+def main():
+    load_dotenv(os.path.join(ROOT, ".env"))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", default=os.environ.get("BENCH_DATABASE", "airborne_bench"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="(Re)create and fill the benchmark database.")
+    seed_parser.add_argument("--sensors", type=int, default=50)
+    seed_parser.add_argument("--users", type=int, default=20)
+    seed_parser.add_argument("--days", type=int, default=7)
+    seed_parser.add_argument("--per-minute", type=float, default=1.0, help="Readings per sensor per minute.")
+    seed_parser.add_argument("--seed", type=int, default=1)
+
+    run_parser = commands.add_parser("run", help="Load the endpoints and record the results.")
+    run_parser.add_argument("--endpoints", help="Comma-separated subset of ingest,latest,avg10,hourly,daily.")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds per endpoint.")
+    run_parser.add_argument("--warmup", type=float, default=3.0, help="Unmeasured seconds per endpoint.")
+    run_parser.add_argument("--seed", type=int, default=1, help="Seeds the clients' choice of sensors.")
+    run_parser.add_argument("--url", help="Benchmark a server that is already running instead.")
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--threads", type=int, default=8)
+    run_parser.add_argument("--server-args", default="", help="Extra gunicorn arguments.")
+    run_parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                            help="Environment for the server, e.g. CACHE_ENABLED=0.")
+    run_parser.add_argument("--label", default="", help="Tag for the results file name.")
+    run_parser.add_argument("--output", help="Results file (default: bench/results/<time>-<commit>.json).")
+
+    scale_parser = commands.add_parser("scale", help="Compare serving profiles as client counts grow.")
+    scale_parser.add_argument("--profiles", default="gthread,gevent", help=f"Comma-separated subset of {','.join(PROFILES)}.")
+    scale_parser.add_argument("--levels", default="8,32,128", help="Comma-separated client counts.")
+    scale_parser.add_argument("--endpoints", default="ingest,avg10", help="Comma-separated endpoints, as for run.")
+    scale_parser.add_argument("--streams", type=int, default=0, help="SSE streams held open during the run.")
+    scale_parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds per endpoint and level.")
+    scale_parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds per endpoint and level.")
+    scale_parser.add_argument("--seed", type=int, default=1, help="Seeds the clients' choice of sensors.")
+    scale_parser.add_argument("--port", type=int, default=8765)
+    scale_parser.add_argument("--workers", type=int, default=1)
+    scale_parser.add_argument("--threads", type=int, default=8, help="Threads per gthread worker.")
+    scale_parser.add_argument("--worker-connections", type=int, default=1000, help="Connections per gevent worker.")
+    scale_parser.add_argument("--server-args", default="", help="Extra gunicorn arguments.")
+    scale_parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                              help="Environment for the server, e.g. CACHE_ENABLED=0.")
+    scale_parser.add_argument("--label", default="", help="Tag for the results file name.")
+    scale_parser.add_argument("--output", help="Results file (default: bench/results/<time>-<commit>-scale.json).")
+
+    compare_parser = commands.add_parser("compare", help="Compare two results files.")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    {"seed": seed, "run": run, "scale": scale, "compare": compare}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Micro-benchmark of the response path of the hourly and 7-day endpoints.
+
+Reports per-request CPU time of this process (database time excluded):
+
+  decode     rows as RealDictCursor dicts + round() in Python, versus
+             plain tuples (both rounded in Python)
+  serialize  Flask's default JSON provider versus orjson
+  request    full GET through the Flask test client with each JSON
+             provider (response cache and conditional requests disabled)
+
+Usage (with DATABASE_URL etc. set as for the app):
+
+    python -m bench.response_path --requests 500
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("CACHE_ENABLED", "0")
+os.environ.setdefault("CONDITIONAL_ENABLED", "0")
+os.environ.setdefault("COMPRESS_ENABLED", "0")
+os.environ.setdefault("MIGRATE_ON_STARTUP", "0")
+os.environ.setdefault("LATEST_WARMUP", "0")
+
+from app import create_app  # noqa: E402
+from app.aggregation import aggregate, daily_chart, hourly_chart, last_7_days, today_hourly  # noqa: E402
+from app.database import get_connection  # noqa: E402
+from app.json_provider import orjson  # noqa: E402
+from app.rollups import METRICS  # noqa: E402
+
+
+def compare(before, after, repeat):
+    """
+    Per-call CPU seconds of `before` and `after` as (median, mean) pairs.
+    Calls alternate so drift in machine load hits both sides alike.
+    """
+    before(), after()
+    samples = ([], [])
+    for _ in range(repeat):
+        for fn, times in zip((before, after), samples):
+            started = time.process_time()
+            fn()
+            times.append(time.process_time() - started)
+    return [(statistics.median(times), statistics.fmean(times)) for times in samples]
+
+
+def legacy_daily(sensor_id, metric):
+    results = aggregate("sensor", sensor_id, [metric], *last_7_days(), bucket="day", fill="zero")
+    return [{"date": str(row["bucket"].date()), f"average_{metric}": round(row[metric], 2)}
+            for row in reversed(results)]
+
+
+def legacy_hourly(sensor_id, metric):
+    results = aggregate("sensor", sensor_id, [metric], *today_hourly(), bucket="hour", fill="zero")
+    return [{"hour": str(row["bucket"]), f"avg_{metric}": round(row[metric], 2)} for row in results]
+
+
+def busiest_sensor():
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT sensor_id FROM sensor_daily_rollups GROUP BY 1 ORDER BY SUM(readings) DESC LIMIT 1;")
+            row = cursor.fetchone()
+    if row is None:
+        raise SystemExit("No readings found; seed some data first.")
+    return str(row["sensor_id"])
+
+
+def report(name, before, after, repeat):
+    (b_median, b_mean), (a_median, a_mean) = compare(before, after, repeat)
+    saving = (1 - a_mean / b_mean) * 100 if b_mean else 0.0
+    print(f"{name:<34} {b_median * 1e6:>9.1f} us {a_median * 1e6:>9.1f} us {saving:>7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="Calls per measurement.")
+    parser.add_argument("--sensor", help="Sensor id (default: the one with the most readings).")
+    parser.add_argument("--metric", default="pm25")
+    args = parser.parse_args()
+    sensor_id = args.sensor or busiest_sensor()
+    metric = args.metric
+
+    print(f"sensor {sensor_id}, {args.requests} calls each; median CPU per call, saving in mean CPU")
+    print(f"{'':<34} {'before':>12} {'after':>12} {'saving':>8}")
+
+    report("decode 7-day", lambda: legacy_daily(sensor_id, metric),
+           lambda: daily_chart("sensor", sensor_id, [metric]), args.requests)
+    report("decode hourly", lambda: legacy_hourly(sensor_id, metric),
+           lambda: hourly_chart("sensor", sensor_id, [metric]), args.requests)
+
+    if orjson is None:
+        print("orjson is not installed; skipping the serializer and request comparisons.")
+        return
+
+    payload = {"sensor_id": sensor_id, "time_zone": "Eastern Time (EST/EDT)",
+               "hourly_averages": hourly_chart("sensor", sensor_id, list(METRICS))}
+    report("serialize dashboard-sized body",
+           lambda: json.dumps(payload, sort_keys=True, separators=(",", ":")),
+           lambda: orjson.dumps(payload, option=orjson.OPT_SORT_KEYS), args.requests)
+
+    clients = {}
+    for provider in ("default", "orjson"):
+        os.environ["JSON_PROVIDER"] = provider
+        app = create_app()
+        app.debug = False
+        clients[provider] = app.test_client()
+    for path in (f"/api/data/{metric}/avg/{sensor_id}", f"/api/data/{metric}/hourly/{sensor_id}",
+                 f"/api/data/dashboard/{sensor_id}"):
+        report(f"GET {path.split(sensor_id)[0]}<id>",
+               lambda: clients["default"].get(path), lambda: clients["orjson"].get(path), args.requests)
+
+
+if __name__ == "__main__":
+    main()
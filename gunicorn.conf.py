@@ -0,0 +1,85 @@
+"""
+gunicorn settings, picked up automatically when gunicorn runs from the
+repository root (as in the Dockerfile). Command-line flags still win.
+
+Two serving profiles, chosen with GUNICORN_WORKER_CLASS:
+
+- gthread (default): each worker serves GUNICORN_THREADS requests at a
+  time (8), one per thread. An open SSE stream or a slow query holds a
+  thread for as long as it lasts.
+- gevent: each worker is a single event loop serving up to
+  GUNICORN_WORKER_CONNECTIONS requests (1000) as greenlets. gunicorn
+  monkey-patches the worker and psycopg2 waits on the database through
+  gevent (app.database.make_green), so idle streams and queries in flight
+  cost a greenlet, not a thread. The pool (DB_POOL_MAX) still bounds the
+  connections each worker opens. Needs gevent installed.
+
+Each SSE stream holds a gthread thread for as long as it is open, so under
+gthread a worker accepts at most GUNICORN_THREADS - 1 streams by default
+(100 under gevent; see app/stream.py).
+
+Either way there is one worker per CPU this process may run on, unless
+WEB_CONCURRENCY says otherwise. These settings can be set in .env.
+"""
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+
+# The app reads .env too, but only once a worker imports it.
+load_dotenv()
+
+# Workers record metrics into files here so /metrics can merge them (see
+# app/metrics.py). One directory per master keeps servers apart. Must be
+# set before prometheus_client is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                      os.path.join(tempfile.gettempdir(), f"airborne-metrics-{os.getpid()}"))
+
+try:
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+
+
+def cpu_count():
+    # The CPUs this process may use (container cpusets), not the host's.
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", 0)) or cpu_count()
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+# Cloud Run handles instance scaling; 0 disables gunicorn's worker timeout.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 0))
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def post_worker_init(worker):
+    green = type(worker).__module__ == "gunicorn.workers.ggevent"
+    # The app sizes its default stream cap from these; command-line flags
+    # may have overridden the settings above.
+    os.environ["GUNICORN_WORKER_CLASS"] = "gevent" if green else worker.cfg.worker_class_str
+    os.environ["GUNICORN_THREADS"] = str(worker.cfg.threads)
+    # gevent workers (either flavour) have monkey-patched themselves by now.
+    if green:
+        from app.database import make_green
+        make_green()
+
+
+def child_exit(server, worker):
+    if multiprocess is not None:
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)